@@ -0,0 +1,154 @@
+"""Agrégats hebdomadaires calculés côté serveur.
+
+`fetch_weekly_aggregates` appelle la fonction Postgres `weekly_user_aggregates`
+(voir sql/weekly_aggregates.sql) : pour une liste d'utilisateurs et une
+période, seuls le nombre de séances, le nombre d'exercices, le total de
+répétitions et les répétitions par exercice traversent le réseau.
+
+`SQLiteAggregates` implémente la même fonction sur SQLite pour tester ce
+chemin sans Supabase.
+"""
+import json
+import sqlite3
+import threading
+
+RPC_NAME = "weekly_user_aggregates"
+# Utilisateurs par appel RPC
+RPC_CHUNK_SIZE = 500
+# Codes d'erreur d'une table ou d'une fonction absente du schéma (PostgREST, Postgres, HTTP)
+MISSING_CODES = {"PGRST202", "PGRST205", "42P01", "42883", "404"}
+
+EMPTY_AGGREGATE = {
+    "workouts_count": 0,
+    "exercises_count": 0,
+    "total_reps": 0,
+    "reps_by_exercise": {},
+}
+
+
+def _normalize(row):
+    reps_by_exercise = row.get("reps_by_exercise") or {}
+    if isinstance(reps_by_exercise, str):
+        reps_by_exercise = json.loads(reps_by_exercise)
+    return {
+        "workouts_count": int(row.get("workouts_count") or 0),
+        "exercises_count": int(row.get("exercises_count") or 0),
+        "total_reps": int(row.get("total_reps") or 0),
+        "reps_by_exercise": {name: int(reps or 0) for name, reps in reps_by_exercise.items()},
+    }
+
+
+def is_missing_relation(error):
+    """Vrai si `error` signale une table ou une fonction RPC absente ; faux pour une
+    erreur réseau ou passagère, après laquelle un nouvel essai peut réussir"""
+    return str(getattr(error, "code", None)) in MISSING_CODES or getattr(error, "status_code", None) == 404
+
+
+def fetch_weekly_aggregates(client, user_ids, start_ts, end_ts):
+    """Retourne user_id -> agrégats de la période [start_ts, end_ts).
+
+    Les utilisateurs sans séance sont absents (voir EMPTY_AGGREGATE).
+    """
+    user_ids = list(user_ids)
+    aggregates = {}
+    for i in range(0, len(user_ids), RPC_CHUNK_SIZE):
+        r = client.rpc(RPC_NAME, {
+            "user_ids": user_ids[i:i + RPC_CHUNK_SIZE],
+            "start_ts": start_ts,
+            "end_ts": end_ts,
+        }).execute()
+        for row in (r.data or []):
+            aggregates[row["user_id"]] = _normalize(row)
+    return aggregates
+
+
+LOCAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workouts (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS exercises (
+    id INTEGER PRIMARY KEY,
+    workout_id INTEGER NOT NULL,
+    name TEXT,
+    reps INTEGER
+);
+CREATE INDEX IF NOT EXISTS workouts_user_id_created_at_idx ON workouts (user_id, created_at);
+CREATE INDEX IF NOT EXISTS exercises_workout_id_idx ON exercises (workout_id);
+"""
+
+# Même requête que sql/weekly_aggregates.sql, en dialecte SQLite
+LOCAL_QUERY = """
+WITH w AS (
+    SELECT id, user_id FROM workouts
+    WHERE user_id IN (SELECT value FROM json_each(:user_ids))
+      AND created_at >= :start_ts AND created_at < :end_ts
+),
+wc AS (
+    SELECT user_id, COUNT(*) AS workouts_count FROM w GROUP BY user_id
+),
+per_ex AS (
+    SELECT w.user_id, COALESCE(e.name, 'Inconnu') AS name, COUNT(*) AS n, SUM(COALESCE(e.reps, 0)) AS reps
+    FROM w JOIN exercises e ON e.workout_id = w.id
+    GROUP BY w.user_id, COALESCE(e.name, 'Inconnu')
+)
+SELECT wc.user_id,
+       wc.workouts_count,
+       (SELECT COALESCE(SUM(n), 0) FROM per_ex p WHERE p.user_id = wc.user_id) AS exercises_count,
+       (SELECT COALESCE(SUM(reps), 0) FROM per_ex p WHERE p.user_id = wc.user_id) AS total_reps,
+       (SELECT json_group_object(name, reps) FROM per_ex p WHERE p.user_id = wc.user_id) AS reps_by_exercise
+FROM wc
+"""
+
+
+class _RPCResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class _RPCCall:
+    def __init__(self, run):
+        self._run = run
+
+    def execute(self):
+        return _RPCResponse(self._run())
+
+
+class SQLiteAggregates:
+    """Remplaçant local de `supabase.rpc("weekly_user_aggregates", ...)` adossé à SQLite"""
+
+    def __init__(self, path=":memory:"):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript(LOCAL_SCHEMA)
+        self.calls = 0
+
+    def load(self, workouts=(), exercises=()):
+        """Insère des lignes au format des tables Supabase"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO workouts (id, user_id, created_at) VALUES (:id, :user_id, :created_at)",
+                [dict(w) for w in workouts]
+            )
+            self._conn.executemany(
+                "INSERT INTO exercises (id, workout_id, name, reps) VALUES (:id, :workout_id, :name, :reps)",
+                [{"id": None, "name": None, "reps": None, **e} for e in exercises]
+            )
+
+    def rpc(self, name, params):
+        if name != RPC_NAME:
+            raise ValueError(f"Fonction RPC inconnue : {name}")
+
+        def run():
+            with self._lock:
+                self.calls += 1
+                rows = self._conn.execute(LOCAL_QUERY, {
+                    "user_ids": json.dumps([str(u) for u in params["user_ids"]]),
+                    "start_ts": params["start_ts"],
+                    "end_ts": params["end_ts"],
+                }).fetchall()
+            return [dict(row) for row in rows]
+
+        return _RPCCall(run)
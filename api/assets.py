@@ -0,0 +1,153 @@
+"""Images des templates (logo) jointes aux emails par Content-ID.
+
+Chaque asset du dossier des templates est minifié puis encodé en base64 une
+seule fois ; la partie MIME obtenue (en-têtes compris) est gardée en mémoire
+sous forme de bytes immuables et partagée par tous les messages. Les
+templates y font référence par `<img src="cid:...">` au lieu d'un fichier
+relatif que les clients mail ne peuvent pas charger.
+"""
+import base64
+import hashlib
+import logging
+import os
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+try:
+    # Optionnel : rendu PNG du SVG (Gmail et Outlook n'affichent pas le SVG)
+    import cairosvg
+except ImportError:
+    cairosvg = None
+
+CONTENT_TYPES = {
+    ".svg": "image/svg+xml",
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+}
+BASE64_LINE_LENGTH = 76
+
+# Métadonnées d'éditeur (Inkscape, Sodipodi) inutiles au rendu
+_SVG_COMMENTS = re.compile(r"<!--.*?-->", re.S)
+_SVG_PROLOG = re.compile(r"<\?xml[^>]*\?>")
+_SVG_EDITOR_ELEMENTS = re.compile(
+    r"<(sodipodi|inkscape):[\w-]+\b[^>]*?(/>|>.*?</\1:[\w-]+>)|<metadata\b.*?</metadata>", re.S
+)
+_SVG_EDITOR_ATTRIBUTES = re.compile(r'\s+(?:xmlns:)?(?:sodipodi|inkscape)(?::[\w-]+)?="[^"]*"')
+_SVG_BETWEEN_TAGS = re.compile(r">\s+<")
+_SVG_SPACES = re.compile(r"\s+")
+# Coordonnées arrondies (pas tronquées) au millième de pixel : invisible pour un logo
+# de quelques centaines de pixels, y compris sur des chemins relatifs. Les transformations
+# (rotation, échelle) sont gardées telles quelles : arrondies, elles déformeraient l'image
+SVG_PRECISION = 3
+_SVG_NUMBERS = re.compile(r'(\b[\w:-]*[tT]ransform="[^"]*")|-?\d*\.\d+(?:[eE][-+]?\d+)?')
+
+
+def _round_number(match, precision):
+    if match[1]:
+        return match[1]
+    # "-0" gardé : le signe sépare ce nombre du précédent dans un chemin (« 1.5-.0001 »)
+    text = f"{float(match[0]):.{precision}f}".rstrip("0").rstrip(".")
+    # Nombre suivant collé (« 0.5.5 » dans un chemin) : séparé explicitement
+    if match.string[match.end():match.end() + 1] == ".":
+        text += " "
+    return text
+
+
+def minify_svg(source, precision=SVG_PRECISION):
+    """Retire commentaires, prologue XML, métadonnées d'éditeur, blancs superflus
+    et décimales invisibles (`precision` décimales gardées, None : nombres intacts)"""
+    source = _SVG_COMMENTS.sub("", source)
+    source = _SVG_PROLOG.sub("", source)
+    source = _SVG_EDITOR_ELEMENTS.sub("", source)
+    source = _SVG_EDITOR_ATTRIBUTES.sub("", source)
+    source = _SVG_BETWEEN_TAGS.sub("><", source)
+    if precision is not None:
+        source = _SVG_NUMBERS.sub(lambda match: _round_number(match, precision), source)
+    return _SVG_SPACES.sub(" ", source).strip()
+
+
+def encode_base64(data):
+    """Base64 coupé en lignes de 76 caractères, fins de ligne CRLF"""
+    encoded = base64.b64encode(data)
+    return b"\r\n".join(
+        encoded[i:i + BASE64_LINE_LENGTH] for i in range(0, len(encoded), BASE64_LINE_LENGTH)
+    ) + b"\r\n"
+
+
+class Asset:
+    """Image encodée une fois : partie MIME prête à être jointe à chaque message"""
+
+    def __init__(self, name, filename, content_type, data, source_size):
+        self.name = name
+        self.content_type = content_type
+        self.size = len(data)
+        self.source_size = source_size
+        digest = hashlib.sha1(data).hexdigest()[:12]
+        self.cid = f"{os.path.splitext(name)[0]}.{digest}@serenity-fitness"
+        self.part = (
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Transfer-Encoding: base64\r\n"
+            f"Content-ID: <{self.cid}>\r\n"
+            f'Content-Disposition: inline; filename="{filename}"\r\n'
+            f"\r\n"
+        ).encode("ascii") + encode_base64(data)
+
+
+class AssetRegistry:
+    """Assets d'un dossier, chargés et encodés au premier usage puis immuables"""
+
+    def __init__(self, directory="templates", png_fallback=False):
+        self.directory = directory
+        self.png_fallback = png_fallback
+        self._assets = {}
+        self._lock = threading.Lock()
+
+    def names(self):
+        return sorted(f for f in os.listdir(self.directory)
+                      if os.path.splitext(f)[1].lower() in CONTENT_TYPES)
+
+    def _load(self, name):
+        path = os.path.join(self.directory, name)
+        extension = os.path.splitext(name)[1].lower()
+        with open(path, "rb") as fichier:
+            raw = fichier.read()
+        content_type = CONTENT_TYPES[extension]
+        filename = name
+        data = raw
+        if extension == ".svg":
+            data = minify_svg(raw.decode("utf-8")).encode("utf-8")
+            if self.png_fallback and cairosvg is not None:
+                data = cairosvg.svg2png(bytestring=data)
+                content_type = "image/png"
+                filename = os.path.splitext(name)[0] + ".png"
+        asset = Asset(name, filename, content_type, data, len(raw))
+        logger.info(f"🖼️ Asset {name} encodé : {len(raw)} → {asset.size} octets ({content_type}), "
+                    f"partie MIME de {len(asset.part)} octets")
+        return asset
+
+    def get(self, name):
+        """Asset encodé ; FileNotFoundError s'il n'existe pas"""
+        asset = self._assets.get(name)
+        if asset is None:
+            with self._lock:
+                asset = self._assets.get(name)
+                if asset is None:
+                    asset = self._load(name)
+                    self._assets[name] = asset
+        return asset
+
+    def referenced_by(self, source):
+        """Assets du dossier référencés par `src="nom"` dans un template"""
+        return [self.get(name) for name in self.names()
+                if f'src="{name}"' in source or f"src='{name}'" in source]
+
+    def stats(self):
+        return {
+            name: {"content_type": asset.content_type, "source_bytes": asset.source_size,
+                   "encoded_bytes": asset.size, "mime_part_bytes": len(asset.part), "cid": asset.cid}
+            for name, asset in self._assets.items()
+        }
@@ -0,0 +1,146 @@
+"""Chargement groupé des données d'une campagne hebdomadaire.
+
+Au lieu de ~7 requêtes Supabase par utilisateur, toute la campagne est
+chargée avec quelques requêtes `in_()` paginées : users, user_workout_stats,
+puis soit les workouts de la semaine dernière et leurs exercises, soit
+directement leurs agrégats via la fonction RPC `weekly_user_aggregates`.
+"""
+import logging
+
+from api.aggregates import EMPTY_AGGREGATE, fetch_weekly_aggregates
+
+logger = logging.getLogger(__name__)
+
+# Nombre de valeurs par filtre in_() (limite la taille de l'URL PostgREST)
+IN_CHUNK_SIZE = 100
+# Nombre de lignes par page (en dessous du max-rows PostgREST par défaut)
+PAGE_SIZE = 1000
+
+DEFAULT_STATS = {
+    'total_workouts': 0,
+    'total_exercises': 0,
+    'last_workout_date': 'Aucune séance'
+}
+
+
+def chunked(values, size):
+    """Découpe une liste en morceaux de `size` éléments"""
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def fetch_all(build_query, page_size=PAGE_SIZE):
+    """Exécute une requête page par page (`range`) et retourne toutes les lignes"""
+    rows = []
+    offset = 0
+    while True:
+        r = build_query().range(offset, offset + page_size - 1).execute()
+        page = r.data or []
+        rows.extend(page)
+        if len(page) < page_size:
+            return rows
+        offset += page_size
+
+
+def fetch_in(client, table, columns, column, values, extra_filters=None, order='id'):
+    """Récupère les lignes de `table` dont `column` est dans `values` (par paquets in_())"""
+    rows = []
+    for chunk in chunked(list(values), IN_CHUNK_SIZE):
+        def build_query(chunk=chunk):
+            query = client.table(table).select(columns).in_(column, chunk)
+            if extra_filters:
+                query = extra_filters(query)
+            return query.order(order)
+        rows.extend(fetch_all(build_query))
+    return rows
+
+
+def summarize_exercises(rows):
+    """Agrège des lignes d'exercices en (nombre, total de reps, reps par exercice)"""
+    total = 0
+    by_ex = {}
+    for row in rows:
+        reps = row.get('reps') or 0
+        total += reps
+        name = row.get('name') or 'Inconnu'
+        by_ex[name] = by_ex.get(name, 0) + reps
+    return len(rows), total, by_ex
+
+
+def aggregate_rows(client, user_ids, start_prev, start_curr):
+    """Agrège côté Python les workouts et exercises bruts (sans fonction RPC)"""
+    workouts = fetch_in(
+        client, 'workouts', 'id, user_id', 'user_id', user_ids,
+        extra_filters=lambda q: q.gte('created_at', start_prev).lt('created_at', start_curr)
+    )
+    workouts_by_user = {}
+    user_by_workout = {}
+    for w in workouts:
+        workouts_by_user.setdefault(w['user_id'], []).append(w['id'])
+        user_by_workout[w['id']] = w['user_id']
+    logger.info(f"🏋️ {len(workouts)} workouts chargés pour la semaine du {start_prev[:10]}")
+
+    exercises = fetch_in(
+        client, 'exercises', 'name, reps, workout_id', 'workout_id', list(user_by_workout)
+    )
+    exercises_by_user = {}
+    for row in exercises:
+        user_id = user_by_workout.get(row.get('workout_id'))
+        if user_id is not None:
+            exercises_by_user.setdefault(user_id, []).append(row)
+    logger.info(f"💪 {len(exercises)} exercices chargés")
+
+    aggregates = {}
+    for user_id, workout_ids in workouts_by_user.items():
+        count, total, by_ex = summarize_exercises(exercises_by_user.get(user_id, []))
+        aggregates[user_id] = {
+            "workouts_count": len(workout_ids),
+            "exercises_count": count,
+            "total_reps": total,
+            "reps_by_exercise": by_ex,
+        }
+    return aggregates
+
+
+def load_weekly_summaries(client, emails, start_prev, start_curr, aggregation="rows"):
+    """Construit le résumé hebdomadaire de chaque destinataire.
+
+    `aggregation` : "rows" agrège les lignes brutes en Python, "rpc" délègue
+    le calcul à la fonction Postgres `weekly_user_aggregates` ; une fonction
+    `aggregation(user_ids, start_prev, start_curr)` peut aussi être fournie.
+    Retourne un dict email -> {"user", "stats", "seances", "total_exercises",
+    "repstotal", "reps_par_exo"}. Les emails sans utilisateur sont absents.
+    """
+    emails = list(dict.fromkeys(emails))
+    users = fetch_in(client, 'users', 'id, full_name, email', 'email', emails)
+    users_by_id = {u['id']: u for u in users if u.get('id')}
+    user_ids = list(users_by_id)
+    logger.info(f"👥 {len(users_by_id)}/{len(emails)} utilisateurs chargés")
+
+    stats_rows = fetch_in(
+        client, 'user_workout_stats',
+        'total_workouts, total_exercises, last_workout_date, user_id',
+        'user_id', user_ids, order='user_id'
+    )
+    stats_by_user = {s['user_id']: s for s in stats_rows}
+
+    if callable(aggregation):
+        aggregates = aggregation(user_ids, start_prev, start_curr)
+    elif aggregation == "rpc":
+        aggregates = fetch_weekly_aggregates(client, user_ids, start_prev, start_curr)
+        logger.info(f"🧮 Agrégats RPC reçus pour {len(aggregates)} utilisateurs")
+    else:
+        aggregates = aggregate_rows(client, user_ids, start_prev, start_curr)
+
+    summaries = {}
+    for user_id, user in users_by_id.items():
+        aggregate = aggregates.get(user_id, EMPTY_AGGREGATE)
+        summaries[user['email']] = {
+            "user": user,
+            "stats": stats_by_user.get(user_id, DEFAULT_STATS),
+            "seances": aggregate["workouts_count"],
+            "total_exercises": aggregate["exercises_count"],
+            "repstotal": aggregate["total_reps"],
+            "reps_par_exo": aggregate["reps_by_exercise"],
+        }
+    return summaries
@@ -0,0 +1,88 @@
+"""Cache mémoire avec expiration (TTL) et éviction LRU.
+
+Sert à mémoriser les lectures Supabase qui changent peu à l'échelle d'une
+campagne ou d'un appel de debug (utilisateur, stats, workouts de la semaine).
+"""
+import functools
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Dictionnaire borné : les entrées expirent après `ttl` secondes et les
+    moins récemment utilisées sont évincées au-delà de `maxsize`.
+
+    `clock` (time.monotonic par défaut) peut être remplacée par une horloge simulée.
+    """
+
+    def __init__(self, maxsize=4096, ttl=300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=_MISSING):
+        now = self._clock()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+        return default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (self._clock() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+def cached(cache):
+    """Mémorise le résultat d'une fonction, clé = (nom de la fonction, arguments).
+
+    Les exceptions et les résultats None (utilisateur introuvable, lecture trop
+    tôt) ne sont pas mis en cache : l'appel suivant interroge de nouveau la base.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            key = (func.__name__,) + args
+            value = cache.get(key)
+            if value is _MISSING:
+                value = func(*args)
+                if value is not None:
+                    cache.set(key, value)
+            return value
+        wrapper.cache = cache
+        return wrapper
+    return decorator
@@ -0,0 +1,136 @@
+"""Journalisation structurée des campagnes (LOG_FORMAT=json).
+
+En mode json, chaque enregistrement est sérialisé en une ligne JSON par un
+thread d'arrière-plan (QueueHandler → QueueListener) : le thread d'envoi ne
+fait que déposer le LogRecord dans la file, sans formater ni écrire. Les
+lignes de détail par destinataire de l'API (niveau INFO) sont coupées et
+remplacées par un seul enregistrement par destinataire (`recipient`), dont
+les succès peuvent être échantillonnés (LOG_SUCCESS_SAMPLE) ; les échecs sont
+toujours gardés.
+
+En mode text (défaut), la configuration reste celle de logging.basicConfig.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Enregistrements par destinataire, gardés même quand les détails sont coupés
+logger = logging.getLogger("api.campaign")
+
+# Attributs standard d'un LogRecord : tout le reste vient de `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+_structured = False
+_success_sample = 1.0
+
+
+class JSONFormatter(logging.Formatter):
+    """Une ligne JSON par enregistrement, champs `extra` compris"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler qui laisse le formatage au thread du listener.
+
+    QueueHandler.prepare formate le message dans le thread appelant ; ici la
+    file reste dans le processus, le LogRecord peut donc y passer tel quel.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def configure_logging(log_format="text", success_sample=1.0, quiet=()):
+    """Installe la journalisation de l'application.
+
+    `quiet` : loggers dont les détails INFO sont coupés en mode json (ils
+    continuent de journaliser avertissements et erreurs).
+    """
+    global _listener, _structured, _success_sample
+    _success_sample = success_sample
+    _structured = log_format == "json"
+    if not _structured:
+        logging.basicConfig(level=logging.INFO)
+        return
+
+    if _listener is None:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JSONFormatter())
+        records = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+        _listener.start()
+        # Vide la file à l'arrêt du processus
+        atexit.register(_listener.stop)
+
+        root = logging.getLogger()
+        for existing in root.handlers[:]:
+            root.removeHandler(existing)
+        root.addHandler(_DeferredQueueHandler(records))
+        root.setLevel(logging.INFO)
+
+    for quieted in quiet:
+        quieted.setLevel(logging.WARNING)
+
+
+def _keep_success():
+    return _success_sample >= 1.0 or random.random() < _success_sample
+
+
+@contextmanager
+def recipient(campaign_id, email):
+    """Un enregistrement pour l'envoi à `email` : toujours en cas d'échec,
+    échantillonné en cas de succès. Le bloc complète le dict cédé (message_id, size)."""
+    details = {}
+    if not _structured:
+        # Mode text : les lignes de détail de l'API suffisent
+        yield details
+        return
+    start = time.perf_counter()
+    try:
+        yield details
+    except Exception as e:
+        # Import local : api.retries journalise lui-même par ce module
+        from api.retries import classify_failure
+
+        # L'exception est convertie en texte par le formateur, dans le thread du listener
+        logger.warning("recipient failed", extra={
+            "campaign": campaign_id, "email": email, "status": "failed",
+            "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+            "error": e, "error_type": type(e).__name__, "classification": classify_failure(e),
+        })
+        raise
+    if logger.isEnabledFor(logging.INFO) and _keep_success():
+        logger.info("recipient sent", extra={
+            "campaign": campaign_id, "email": email, "status": "sent",
+            "duration_ms": round((time.perf_counter() - start) * 1000, 3),
+            **details,
+        })
+
+
+def summary(campaign_id, report):
+    """Bilan structuré d'une campagne (mode json : remplace la bannière de résumé)"""
+    if _structured:
+        logger.info("campaign summary", extra={
+            "campaign": campaign_id,
+            **{key: report.get(key) for key in ("kind", "status", "total", "sent", "failed")},
+        })
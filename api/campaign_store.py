@@ -0,0 +1,530 @@
+"""File d'attente durable des campagnes, stockée dans SQLite.
+
+Une campagne est enregistrée avec la liste de ses destinataires puis envoyée
+par paquets. Après chaque paquet, la progression (curseur, compteurs, échecs)
+est sauvegardée : un worker interrompu (timeout Vercel, redéploiement) peut
+reprendre là où le précédent s'est arrêté.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from api.retries import FATAL, MAX_ATTEMPTS, TRANSIENT, backoff_delay
+from api.sharding import shard_for
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS campaigns (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    sent INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    lease_owner TEXT,
+    lease_expires REAL NOT NULL DEFAULT 0,
+    shards INTEGER NOT NULL DEFAULT 1,
+    dry_run INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    updated_at REAL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS campaign_recipients (
+    campaign_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    email TEXT NOT NULL,
+    user_id TEXT,
+    full_name TEXT,
+    shard INTEGER,
+    PRIMARY KEY (campaign_id, position)
+);
+CREATE TABLE IF NOT EXISTS campaign_shards (
+    campaign_id TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    cursor INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (campaign_id, shard)
+);
+CREATE TABLE IF NOT EXISTS campaign_failures (
+    campaign_id TEXT NOT NULL,
+    email TEXT NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS retry_queue (
+    campaign_id TEXT NOT NULL,
+    email TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    message BLOB,
+    PRIMARY KEY (campaign_id, email)
+);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    campaign_id TEXT NOT NULL,
+    email TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    message BLOB,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    campaign_id TEXT NOT NULL,
+    email TEXT NOT NULL,
+    status TEXT NOT NULL,
+    message_id TEXT,
+    sent_at REAL,
+    size INTEGER,
+    UNIQUE (campaign_id, email)
+);
+CREATE INDEX IF NOT EXISTS idx_campaign_failures ON campaign_failures (campaign_id);
+CREATE INDEX IF NOT EXISTS idx_retry_queue_due ON retry_queue (next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_dead_letters ON dead_letters (campaign_id);
+CREATE INDEX IF NOT EXISTS idx_campaigns_status ON campaigns (status);
+"""
+
+# Colonnes ajoutées après la création initiale du schéma : (table, colonne, type)
+MIGRATIONS = [
+    ("campaign_recipients", "user_id", "TEXT"),
+    ("campaign_recipients", "full_name", "TEXT"),
+    ("campaign_recipients", "shard", "INTEGER"),
+    ("campaigns", "shards", "INTEGER NOT NULL DEFAULT 1"),
+    ("deliveries", "size", "INTEGER"),
+    ("campaigns", "dry_run", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Statuts du registre des envois (table deliveries)
+DELIVERED = "delivered"
+UNDELIVERED = "failed"
+DELIVERED_LOOKUP_SIZE = 500
+
+
+def default_db_path():
+    """Chemin de la base : CAMPAIGN_DB_PATH, sinon campaigns.db (dossier courant).
+
+    Sur Vercel, /tmp est propre à chaque instance et effacé à son recyclage : une
+    campagne y serait invisible du suivi, du cron /campaigns/drain et des reprises.
+    CAMPAIGN_DB_PATH doit alors désigner un stockage partagé, sinon RuntimeError.
+    """
+    path = os.getenv("CAMPAIGN_DB_PATH")
+    if os.getenv("VERCEL") and (not path or (os.path.abspath(path) + "/").startswith("/tmp/")):
+        raise RuntimeError(
+            "CAMPAIGN_DB_PATH doit désigner un stockage partagé entre les instances (pas /tmp) sur Vercel"
+        )
+    return path or "campaigns.db"
+
+
+def _iso(timestamp):
+    if not timestamp:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class CampaignStore:
+    """Accès à la base SQLite des campagnes (une connexion protégée par un verrou)"""
+
+    def __init__(self, path=None):
+        self.path = path or default_db_path()
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # Un commit par envoi (registre) : pas de fsync à chaque transaction en WAL
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Ajoute les colonnes manquantes aux bases créées par une version précédente"""
+        for table, column, column_type in MIGRATIONS:
+            columns = {row["name"] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_campaign_recipients_shard "
+            "ON campaign_recipients (campaign_id, shard, position)"
+        )
+
+    def _transaction(self):
+        return _Transaction(self._conn, self._lock)
+
+    def create_campaign(self, kind, recipients, shards=1, batch_size=1000, dry_run=False):
+        """Enregistre une campagne et ses destinataires ; retourne (identifiant, total).
+
+        `recipients` est un itérable (éventuellement un générateur paginé) d'emails
+        ou de lignes {"id", "email", "full_name"} ; il est inséré par lots sans
+        être matérialisé en mémoire. Avec `shards` > 1, chaque destinataire est
+        affecté à un shard (voir api.sharding). `dry_run` : les messages seront
+        écrits dans un fichier local au lieu d'être envoyés.
+        """
+        campaign_id = uuid.uuid4().hex
+        shards = max(1, int(shards))
+        total = 0
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO campaigns (id, kind, status, shards, dry_run, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (campaign_id, kind, QUEUED, shards, int(bool(dry_run)), time.time())
+            )
+            if shards > 1:
+                conn.executemany(
+                    "INSERT INTO campaign_shards (campaign_id, shard) VALUES (?, ?)",
+                    [(campaign_id, shard) for shard in range(shards)]
+                )
+            insert = (
+                "INSERT INTO campaign_recipients (campaign_id, position, email, user_id, full_name, shard) "
+                "VALUES (?, ?, ?, ?, ?, ?)"
+            )
+            batch = []
+            for recipient in recipients:
+                if isinstance(recipient, str):
+                    email, user_id, full_name = recipient, None, None
+                else:
+                    email, user_id, full_name = recipient["email"], recipient.get("id"), recipient.get("full_name")
+                shard = shard_for(user_id or email, shards) if shards > 1 else None
+                batch.append((campaign_id, total, email, user_id, full_name, shard))
+                total += 1
+                if len(batch) >= batch_size:
+                    conn.executemany(insert, batch)
+                    batch = []
+            if batch:
+                conn.executemany(insert, batch)
+            conn.execute("UPDATE campaigns SET total = ? WHERE id = ?", (total, campaign_id))
+        return campaign_id, total
+
+    def get(self, campaign_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM campaigns WHERE id = ?", (campaign_id,)).fetchone()
+        return dict(row) if row else None
+
+    def pending(self):
+        """Identifiants des campagnes non terminées, des plus anciennes aux plus récentes"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM campaigns WHERE status IN (?, ?) ORDER BY created_at",
+                (QUEUED, RUNNING)
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def claim(self, campaign_id, owner, lease_seconds=300):
+        """Réserve la campagne pour un worker ; False si un autre la traite déjà"""
+        now = time.time()
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE campaigns SET status = ?, lease_owner = ?, lease_expires = ?, "
+                "started_at = COALESCE(started_at, ?), updated_at = ? "
+                "WHERE id = ? AND status IN (?, ?) AND (lease_owner = ? OR lease_expires < ?)",
+                (RUNNING, owner, now + lease_seconds, now, now,
+                 campaign_id, QUEUED, RUNNING, owner, now)
+            )
+            return cur.rowcount == 1
+
+    def claim_retries(self, campaign_id, owner, lease_seconds=300):
+        """Réserve la campagne pour une relance, sans changer son statut ; False si
+        un worker l'envoie ou la relance déjà"""
+        now = time.time()
+        with self._transaction() as conn:
+            cur = conn.execute(
+                "UPDATE campaigns SET lease_owner = ?, lease_expires = ? "
+                "WHERE id = ? AND (lease_owner IS NULL OR lease_owner = ? OR lease_expires < ?)",
+                (owner, now + lease_seconds, campaign_id, owner, now)
+            )
+            return cur.rowcount == 1
+
+    def release(self, campaign_id, owner):
+        """Libère la réservation sans terminer la campagne (reprise par un autre worker)"""
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE campaigns SET lease_owner = NULL, lease_expires = 0 WHERE id = ? AND lease_owner = ?",
+                (campaign_id, owner)
+            )
+
+    def next_chunk(self, campaign_id, size, shard=None):
+        """Prochains destinataires après le curseur (de la campagne ou du shard) :
+        {"position", "email", "id", "full_name"}"""
+        with self._lock:
+            if shard is None:
+                rows = self._conn.execute(
+                    "SELECT r.position, r.email, r.user_id AS id, r.full_name FROM campaign_recipients r "
+                    "JOIN campaigns c ON c.id = r.campaign_id "
+                    "WHERE r.campaign_id = ? AND r.position >= c.cursor "
+                    "ORDER BY r.position LIMIT ?",
+                    (campaign_id, size)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT r.position, r.email, r.user_id AS id, r.full_name FROM campaign_recipients r "
+                    "JOIN campaign_shards s ON s.campaign_id = r.campaign_id AND s.shard = r.shard "
+                    "WHERE r.campaign_id = ? AND r.shard = ? AND r.position >= s.cursor "
+                    "ORDER BY r.position LIMIT ?",
+                    (campaign_id, shard, size)
+                ).fetchall()
+        return [dict(row) for row in rows]
+
+    def checkpoint(self, campaign_id, owner, cursor, sent, failed_emails, lease_seconds=300, shard=None):
+        """Sauvegarde la progression d'un paquet et prolonge la réservation.
+
+        Avec `shard`, le curseur avancé est celui du shard et les compteurs
+        s'additionnent à ceux de la campagne.
+        Les échecs classés (voir api.retries.describe_failure) sont placés dans
+        la file de relance (temporaires) ou en dead-letter (définitifs).
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            if shard is None:
+                conn.execute(
+                    "UPDATE campaigns SET cursor = ?, sent = sent + ?, failed = failed + ?, "
+                    "updated_at = ?, lease_expires = ? WHERE id = ? AND lease_owner = ?",
+                    (cursor, sent, len(failed_emails), now, now + lease_seconds, campaign_id, owner)
+                )
+            else:
+                conn.execute(
+                    "UPDATE campaign_shards SET cursor = ? WHERE campaign_id = ? AND shard = ?",
+                    (cursor, campaign_id, shard)
+                )
+                conn.execute(
+                    "UPDATE campaigns SET sent = sent + ?, failed = failed + ?, "
+                    "updated_at = ?, lease_expires = ? WHERE id = ? AND lease_owner = ?",
+                    (sent, len(failed_emails), now, now + lease_seconds, campaign_id, owner)
+                )
+            conn.executemany(
+                "INSERT INTO campaign_failures (campaign_id, email, error) VALUES (?, ?, ?)",
+                [(campaign_id, f["email"], f["error"]) for f in failed_emails]
+            )
+            self._record_undelivered(conn, campaign_id, failed_emails)
+            self._queue_failures(conn, campaign_id, failed_emails, now, attempts=1)
+
+    def record_deliveries(self, campaign_id, deliveries):
+        """Inscrit au registre les envois réussis [(email, message_id, size)] d'un
+        paquet (et leur taille en octets), en une transaction"""
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO deliveries (campaign_id, email, status, message_id, sent_at, size) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (campaign_id, email) DO UPDATE SET "
+                "status = excluded.status, message_id = excluded.message_id, "
+                "sent_at = excluded.sent_at, size = excluded.size",
+                [(campaign_id, email, DELIVERED, message_id, now, size) for email, message_id, size in deliveries]
+            )
+
+    def _record_undelivered(self, conn, campaign_id, failed_emails):
+        conn.executemany(
+            "INSERT INTO deliveries (campaign_id, email, status) VALUES (?, ?, ?) "
+            "ON CONFLICT (campaign_id, email) DO NOTHING",
+            [(campaign_id, f["email"], UNDELIVERED) for f in failed_emails]
+        )
+
+    def delivered(self, campaign_id, emails):
+        """Sous-ensemble des `emails` déjà livrés pour cette campagne (une requête par paquet)"""
+        emails = list(emails)
+        found = set()
+        # Lots bornés : SQLite limite le nombre de paramètres d'une requête
+        for start in range(0, len(emails), DELIVERED_LOOKUP_SIZE):
+            batch = emails[start:start + DELIVERED_LOOKUP_SIZE]
+            placeholders = ", ".join("?" * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT email FROM deliveries WHERE campaign_id = ? AND status = ? "
+                    f"AND email IN ({placeholders})",
+                    (campaign_id, DELIVERED, *batch)
+                ).fetchall()
+            found.update(row["email"] for row in rows)
+        return found
+
+    def delivery_stats(self, campaign_id):
+        """Envois livrés et octets transmis (taille des messages) d'une campagne"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) AS delivered, SUM(size) AS bytes_sent, AVG(size) AS bytes_per_message "
+                "FROM deliveries WHERE campaign_id = ? AND status = ?",
+                (campaign_id, DELIVERED)
+            ).fetchone()
+        return {
+            "delivered": row["delivered"],
+            "bytes_sent": row["bytes_sent"] or 0,
+            "bytes_per_message": round(row["bytes_per_message"]) if row["bytes_per_message"] else None,
+        }
+
+    def _queue_failures(self, conn, campaign_id, failed_emails, now, attempts):
+        """File de relance ou dead-letter selon le classement ; retourne le nombre de dead-letters"""
+        dead = 0
+        for f in failed_emails:
+            classification = f.get("classification")
+            if classification is None or classification == FATAL:
+                # Fatal : la campagne s'arrête, le destinataire n'y est pour rien
+                continue
+            if classification == TRANSIENT and attempts < MAX_ATTEMPTS:
+                conn.execute(
+                    "INSERT INTO retry_queue (campaign_id, email, attempts, next_attempt_at, last_error, message) "
+                    "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (campaign_id, email) DO UPDATE SET "
+                    "attempts = excluded.attempts, next_attempt_at = excluded.next_attempt_at, "
+                    "last_error = excluded.last_error, message = COALESCE(excluded.message, retry_queue.message)",
+                    (campaign_id, f["email"], attempts, now + backoff_delay(attempts),
+                     f["error"], f.get("message"))
+                )
+            else:
+                message = f.get("message")
+                if message is None:
+                    row = conn.execute(
+                        "SELECT message FROM retry_queue WHERE campaign_id = ? AND email = ?",
+                        (campaign_id, f["email"])
+                    ).fetchone()
+                    message = row["message"] if row else None
+                conn.execute(
+                    "DELETE FROM retry_queue WHERE campaign_id = ? AND email = ?",
+                    (campaign_id, f["email"])
+                )
+                conn.execute(
+                    "INSERT INTO dead_letters (campaign_id, email, attempts, error, message, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (campaign_id, f["email"], attempts, f["error"], message, now)
+                )
+                dead += 1
+        return dead
+
+    def due_retries(self, campaign_id, force=False):
+        """Échecs temporaires dont le délai de relance est écoulé (tous si `force`)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT email, attempts, message FROM retry_queue "
+                "WHERE campaign_id = ? AND (? OR next_attempt_at <= ?) ORDER BY next_attempt_at",
+                (campaign_id, 1 if force else 0, time.time())
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def campaigns_with_due_retries(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT campaign_id FROM retry_queue WHERE next_attempt_at <= ?",
+                (time.time(),)
+            ).fetchall()
+        return [row["campaign_id"] for row in rows]
+
+    def retry_count(self, campaign_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM retry_queue WHERE campaign_id = ?", (campaign_id,)
+            ).fetchone()[0]
+
+    def dead_letters(self, campaign_id, limit=None):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT email, attempts, error FROM dead_letters WHERE campaign_id = ? "
+                "ORDER BY rowid LIMIT ?",
+                (campaign_id, -1 if limit is None else limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def discard_retries(self, campaign_id, emails):
+        with self._transaction() as conn:
+            conn.executemany(
+                "DELETE FROM retry_queue WHERE campaign_id = ? AND email = ?",
+                [(campaign_id, email) for email in emails]
+            )
+
+    def record_retry_results(self, campaign_id, succeeded, failed_emails):
+        """Met à jour la file après une relance ; retourne le nombre de dead-letters"""
+        now = time.time()
+        with self._transaction() as conn:
+            for email in succeeded:
+                conn.execute("DELETE FROM retry_queue WHERE campaign_id = ? AND email = ?", (campaign_id, email))
+                conn.execute("DELETE FROM campaign_failures WHERE campaign_id = ? AND email = ?", (campaign_id, email))
+            conn.execute(
+                "UPDATE campaigns SET sent = sent + ?, failed = failed - ?, updated_at = ? WHERE id = ?",
+                (len(succeeded), len(succeeded), now, campaign_id)
+            )
+            dead = 0
+            for f in failed_emails:
+                row = conn.execute(
+                    "SELECT attempts FROM retry_queue WHERE campaign_id = ? AND email = ?",
+                    (campaign_id, f["email"])
+                ).fetchone()
+                attempts = (row["attempts"] if row else 0) + 1
+                conn.execute(
+                    "UPDATE campaign_failures SET error = ? WHERE campaign_id = ? AND email = ?",
+                    (f["error"], campaign_id, f["email"])
+                )
+                dead += self._queue_failures(conn, campaign_id, [f], now, attempts)
+            return dead
+
+    def finish(self, campaign_id, owner, error=None):
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE campaigns SET status = ?, error = ?, finished_at = ?, updated_at = ?, "
+                "lease_owner = NULL, lease_expires = 0 WHERE id = ? AND lease_owner = ?",
+                (FAILED if error else DONE, error, now, now, campaign_id, owner)
+            )
+
+    def failures(self, campaign_id, limit=None):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT email, error FROM campaign_failures WHERE campaign_id = ? "
+                "ORDER BY rowid LIMIT ?",
+                (campaign_id, -1 if limit is None else limit)
+            ).fetchall()
+        return [{"email": row["email"], "error": row["error"]} for row in rows]
+
+    def report(self, campaign_id, failures_limit=100):
+        """Progression, débit et échecs d'une campagne (None si inconnue)"""
+        campaign = self.get(campaign_id)
+        if not campaign:
+            return None
+        processed = campaign["sent"] + campaign["failed"]
+        elapsed = None
+        throughput = None
+        if campaign["started_at"]:
+            end = campaign["finished_at"] or campaign["updated_at"] or campaign["started_at"]
+            elapsed = max(end - campaign["started_at"], 0.0)
+            if elapsed > 0:
+                throughput = round(processed / elapsed, 2)
+        return {
+            "job_id": campaign["id"],
+            "kind": campaign["kind"],
+            "status": campaign["status"],
+            "total": campaign["total"],
+            "processed": processed,
+            "sent": campaign["sent"],
+            "failed": campaign["failed"],
+            "progress": round(processed / campaign["total"], 4) if campaign["total"] else 1.0,
+            "elapsed_seconds": round(elapsed, 3) if elapsed is not None else None,
+            "emails_per_second": throughput,
+            "shards": campaign["shards"],
+            "dry_run": bool(campaign["dry_run"]),
+            "error": campaign["error"],
+            "created_at": _iso(campaign["created_at"]),
+            "started_at": _iso(campaign["started_at"]),
+            "finished_at": _iso(campaign["finished_at"]),
+            "failed_emails": self.failures(campaign_id, failures_limit),
+            **self.delivery_stats(campaign_id),
+            "retry_pending": self.retry_count(campaign_id),
+            "dead_letters": self.dead_letters(campaign_id, failures_limit),
+        }
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE / COMMIT autour d'un bloc, sous le verrou du store"""
+
+    def __init__(self, conn, lock):
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.lock.release()
+        return False
@@ -0,0 +1,155 @@
+"""Exécution des campagnes enregistrées dans le CampaignStore.
+
+Un worker réserve une campagne, l'envoie paquet par paquet via le pipeline
+concurrent et sauvegarde la progression après chaque paquet. Les envois
+réussis d'un paquet sont inscrits au registre des livraisons en une
+transaction, à la fin du paquet ou à son interruption : une reprise ne
+renvoie pas les emails déjà partis, même au milieu d'un paquet. Seul un arrêt
+brutal du processus peut faire renvoyer les envois du paquet en cours.
+"""
+import asyncio
+import logging
+import time
+import uuid
+
+from api import campaign_log, metrics
+from api.pipeline import run_campaign
+from api.retries import check_fatal, describe_failure, is_fatal
+
+logger = logging.getLogger(__name__)
+
+
+def recorded(campaign_id, send_one, deliveries):
+    """Enveloppe `send_one` pour journaliser chaque envoi réussi et l'ajouter à
+    `deliveries` [(email, message_id, size)], inscrit ensuite au registre par paquet"""
+    def send_and_record(email):
+        # Exécuté dans un thread du pipeline : les étapes mesurées sont rattachées à la campagne
+        with campaign_log.recipient(campaign_id, email) as record, metrics.campaign_scope(campaign_id):
+            result = send_one(email)
+            details = result if isinstance(result, dict) else {}
+            record.update(message_id=details.get("message_id"), size=details.get("size"))
+        deliveries.append((email, details.get("message_id"), details.get("size")))
+        return result
+    return send_and_record
+
+
+def send_recorded_batch(store, campaign_id, send_batch, emails):
+    """Équivalent par lots de run_campaign(recorded(...)) : le paquet part en un appel
+    (transport HTTP par lots), puis chaque destinataire est journalisé et inscrit au registre.
+
+    Retourne (sent_count, failed_count, failed_emails) comme run_campaign.
+    """
+    with metrics.campaign_scope(campaign_id):
+        outcomes = send_batch(emails)
+    deliveries, failed_emails = [], []
+    for email, outcome in outcomes:
+        try:
+            with campaign_log.recipient(campaign_id, email) as record:
+                if isinstance(outcome, Exception):
+                    raise outcome
+                record.update(message_id=outcome.get("message_id"), size=outcome.get("size"))
+        except Exception as e:
+            logger.error(f"❌ Échec pour {email} : {str(e)}")
+            failed_emails.append(describe_failure(email, e))
+            continue
+        deliveries.append((email, outcome.get("message_id"), outcome.get("size")))
+    store.record_deliveries(campaign_id, deliveries)
+    return len(deliveries), len(failed_emails), failed_emails
+
+
+async def drain_chunks(store, campaign_id, owner, prepare_chunk, chunk_size=50,
+                       concurrency=4, deadline=None, shard=None, on_chunk=None):
+    """Envoie les paquets restants (de la campagne, ou d'un seul `shard`).
+
+    `on_chunk(résumé)` est appelée après la sauvegarde de chaque paquet
+    (compteurs et échecs du paquet, voir api.streaming).
+    Retourne True quand il n'y a plus de destinataires, False si `deadline`
+    (time.monotonic) est dépassée avant. CampaignAborted sur un échec fatal
+    (identifiants refusés) : aucun destinataire n'est mis en file de relance.
+    """
+    while True:
+        chunk = store.next_chunk(campaign_id, chunk_size, shard=shard)
+        if not chunk:
+            return True
+
+        # Reprise après une coupure : les destinataires déjà livrés (registre)
+        # sont comptés comme envoyés sans être relus ni renvoyés
+        delivered = store.delivered(campaign_id, (recipient["email"] for recipient in chunk))
+        pending = [recipient for recipient in chunk if recipient["email"] not in delivered]
+        if delivered:
+            logger.info(f"⏭️ Campagne {campaign_id} : {len(delivered)} destinataires déjà livrés ignorés")
+
+        sent_count, failed_count, failed_emails = 0, 0, []
+        if pending:
+            emails = [recipient["email"] for recipient in pending]
+            with metrics.campaign_scope(campaign_id):
+                send_one = await asyncio.to_thread(prepare_chunk, pending)
+            send_batch = getattr(send_one, "send_batch", None)
+            if send_batch:
+                # Transport par lots : un appel pour tout le paquet
+                sent_count, failed_count, failed_emails = await asyncio.to_thread(
+                    send_recorded_batch, store, campaign_id, send_batch, emails
+                )
+            else:
+                deliveries = []
+                try:
+                    sent_count, failed_count, failed_emails = await run_campaign(
+                        emails, recorded(campaign_id, send_one, deliveries), concurrency,
+                        describe=describe_failure, stop=is_fatal
+                    )
+                finally:
+                    # Paquet interrompu (annulation, erreur) : les envois partis restent inscrits
+                    store.record_deliveries(campaign_id, deliveries)
+            # Identifiants refusés : le paquet n'est pas sauvegardé, la campagne échoue
+            check_fatal(failed_emails)
+        sent_count += len(delivered)
+        store.checkpoint(campaign_id, owner, chunk[-1]["position"] + 1, sent_count, failed_emails, shard=shard)
+        label = campaign_id if shard is None else f"{campaign_id} (shard {shard})"
+        logger.info(f"💾 Campagne {label} : paquet de {len(chunk)} traité ({sent_count} succès, {failed_count} échecs)")
+        if on_chunk:
+            on_chunk({
+                "shard": shard,
+                "recipients": len(chunk),
+                "sent": sent_count,
+                "failed": failed_count,
+                # Sans le message conservé pour la relance
+                "failures": [{key: failure[key] for key in ("email", "error", "classification")}
+                             for failure in failed_emails],
+            })
+
+        if deadline and time.monotonic() >= deadline:
+            return False
+
+
+async def drain_campaign(store, campaign_id, prepare_chunk, chunk_size=50,
+                         concurrency=4, time_budget=None, owner=None, on_chunk=None):
+    """Envoie les destinataires restants d'une campagne.
+
+    `prepare_chunk(recipients)` est appelée (dans un thread) pour chaque paquet
+    de lignes {"email", "id", "full_name"} et retourne la fonction bloquante
+    `send_one(email)` du paquet ; si elle porte un attribut `send_batch(emails)`,
+    le paquet est envoyé d'un seul appel (voir send_recorded_batch).
+    Retourne True si la campagne est terminée, False si elle reste à reprendre
+    (budget de temps `time_budget` épuisé), None si un autre worker la traite.
+    """
+    owner = owner or uuid.uuid4().hex
+    if not store.claim(campaign_id, owner):
+        logger.info(f"⏭️ Campagne {campaign_id} déjà en cours de traitement ou terminée")
+        return None
+
+    deadline = time.monotonic() + time_budget if time_budget else None
+    try:
+        finished = await drain_chunks(store, campaign_id, owner, prepare_chunk,
+                                      chunk_size, concurrency, deadline, on_chunk=on_chunk)
+    except Exception as e:
+        logger.error(f"❌ Erreur fatale dans la campagne {campaign_id} : {str(e)}")
+        logger.exception("Stack trace complète :")
+        store.finish(campaign_id, owner, error=str(e))
+        return True
+    if finished:
+        store.finish(campaign_id, owner)
+        logger.info(f"🏁 Campagne {campaign_id} terminée")
+        return True
+    store.release(campaign_id, owner)
+    logger.info(f"⏸️ Budget de temps épuisé, campagne {campaign_id} à reprendre")
+    return False
@@ -1,30 +1,169 @@
 #uvicorn envmail:app --reload
-from pydantic import BaseModel, EmailStr
 import smtplib
-from email.message import EmailMessage
 import os
+from typing import Dict, Optional
 from fastapi import Depends, Header, HTTPException
-from dotenv import load_dotenv
-load_dotenv()
+from pydantic import BaseModel, Field
+
+if not os.getenv("VERCEL"):
+    # Fichier .env en local uniquement : sur Vercel, les variables sont déjà
+    # dans l'environnement et l'import de dotenv serait payé à chaque démarrage à froid
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
 
-import os
-from supabase import create_client, Client
 from datetime import datetime, timedelta, timezone
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import logging
 
-# Configuration du logging
-logging.basicConfig(level=logging.INFO)
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+import time
+
+from api import campaign_log, metrics
+from api.aggregates import fetch_weekly_aggregates, is_missing_relation
+from api.bulk_loader import aggregate_rows, load_weekly_summaries
+from api.cache import TTLCache, cached
+from api.campaign_store import CampaignStore, default_db_path
+from api.campaigns import drain_campaign
+from api.mime import PreparedMessage
+from api.retries import CampaignAborted, retry_campaign
+from api.sharding import drain_sharded
+from api.streaming import NDJSON, stream_campaign, wants_ndjson
+from api.resources import Resources
+from api.settings import Settings
+from api.weekly_summaries import get_weekly_history, load_materialized, refresh_weekly_summaries
+
+# Configuration lue une fois au démarrage (voir api.settings)
+settings = Settings.from_env()
+
+# Configuration du logging : "text" (lignes détaillées) ou "json" (une ligne
+# structurée par destinataire, écrite par un thread d'arrière-plan)
+LOG_FORMAT = settings.log_format
+# Part des envois réussis journalisés en mode json (les échecs le sont toujours)
+LOG_SUCCESS_SAMPLE = settings.log_success_sample
 logger = logging.getLogger(__name__)
+# Bannière des logs détaillés, construite une fois
+SEPARATOR = "=" * 60
+campaign_log.configure_logging(LOG_FORMAT, LOG_SUCCESS_SAMPLE, quiet=(logger,))
+
+API_KEY = settings.api_key
+
+# Nombre d'envois simultanés pendant une campagne
+CAMPAIGN_CONCURRENCY = settings.campaign_concurrency
+# Destinataires traités entre deux sauvegardes de progression
+CAMPAIGN_CHUNK_SIZE = settings.campaign_chunk_size
+# Durée maximale d'un envoi lancé par une requête ou d'une reprise via
+# /campaigns/drain (sous le timeout Vercel)
+CAMPAIGN_TIME_BUDGET = settings.campaign_time_budget
+# Processus d'envoi par campagne (shards), à augmenter sur une machine multi-cœurs
+CAMPAIGN_SHARDS = settings.campaign_shards
+# Délai maximal entre deux lignes d'une réponse NDJSON (progression lue dans le store)
+CAMPAIGN_PROGRESS_INTERVAL = settings.campaign_progress_interval
+# Utilisateurs lus par page lors du parcours des destinataires
+RECIPIENTS_PAGE_SIZE = settings.recipients_page_size
+# Adresse unique visée par /send-weekly-email (essai) ; None : tous les utilisateurs
+WEEKLY_TEST_RECIPIENT = settings.weekly_test_recipient
+# Agrégation hebdomadaire : "materialized" (table weekly_summaries), "rpc" (Postgres),
+# "rows" (Python) ou "auto" (la première disponible dans cet ordre)
+WEEKLY_AGGREGATION = settings.weekly_aggregation
+
+# Client Supabase, pool SMTP, templates compilés et images : créés une fois par
+# processus et partagés par les requêtes (et les invocations serverless « chaudes »)
+resources = Resources(settings)
+template_engine = resources.templates
+template_assets = resources.assets
+smtp_rate_limiter = resources.rate_limiter
+
+# Base des campagnes, vérifiée au démarrage : sur Vercel, l'API refuse de
+# démarrer si elle n'est pas sur un stockage partagé (voir default_db_path)
+CAMPAIGN_DB_PATH = default_db_path()
+_campaign_store = None
+
+def get_campaign_store():
+    """Retourne la file de campagnes SQLite (ouverte au premier accès)"""
+    global _campaign_store
+    if _campaign_store is None:
+        _campaign_store = CampaignStore(CAMPAIGN_DB_PATH)
+    return _campaign_store
+
+def send_prepared_message(email, data, transport=None):
+    """Remet un message déjà sérialisé (bytes) au transport MAIL_TRANSPORT
+    (ou à `transport`, celui d'une campagne en dry-run).
+
+    En cas d'échec, le message reste attaché à l'exception pour que la file de
+    relance puisse le renvoyer sans relire Supabase.
+    """
+    try:
+        (transport or resources.transport).send(settings.mail_from, email, data)
+    except Exception as e:
+        e.email_message = data
+        raise
+
+def resend_stored_message(email, data, transport=None):
+    """Renvoie tel quel un message conservé par la file de relance"""
+    (transport or resources.transport).send(settings.mail_from, email, data)
+
+def batch_sender(send_one, compose, transport=None):
+    """Ajoute `send_batch(emails)` à `send_one` quand le transport envoie par lots.
+
+    `compose(email)` retourne (résultat, message sérialisé) : tout le paquet est
+    composé puis remis en quelques requêtes. Retourne [(email, résultat ou exception)].
+    """
+    transport = transport or resources.transport
+    if not transport.batched:
+        return send_one
+
+    def send_batch(emails):
+        outcomes, ready = {}, []
+        for email in emails:
+            try:
+                result, data = compose(email)
+                ready.append((email, result, data))
+            except Exception as e:
+                outcomes[email] = e
+        errors = transport.send_batch(settings.mail_from, [(email, data) for email, _, data in ready])
+        for (email, result, data), error in zip(ready, errors):
+            if error is not None:
+                error.email_message = data
+            outcomes[email] = result if error is None else error
+        return [(email, outcomes[email]) for email in emails]
 
-API_KEY = os.getenv("API_KEY")
+    send_one.send_batch = send_batch
+    return send_one
+
+@asynccontextmanager
+async def lifespan(app):
+    """Prépare les ressources partagées au démarrage et ferme leurs connexions à l'arrêt"""
+    keepalive = None
+    if not settings.lazy_clients:
+        await asyncio.to_thread(resources.warm)
+        if settings.mail_transport == "smtp" and settings.smtp_configured and settings.transactional_keepalive > 0:
+            keepalive = asyncio.create_task(keep_transactional_warm())
+    yield
+    if keepalive is not None:
+        keepalive.cancel()
+    await asyncio.to_thread(resources.close)
+
+async def keep_transactional_warm():
+    """NOOP périodique : les sessions transactionnelles restent ouvertes entre deux envois"""
+    while True:
+        await asyncio.sleep(settings.transactional_keepalive)
+        try:
+            await asyncio.to_thread(resources.transactional_transport.keepalive)
+        except Exception as e:
+            logger.warning(f"⚠️ Keepalive SMTP transactionnel en échec : {str(e)}")
 
 app = FastAPI(
     title="API Email Serenity Fitness",
     description="API pour l'envoi automatique d'emails",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 def get_api_key(x_api_key: str = Header(None, alias="x-api-key")):
@@ -32,63 +171,55 @@ def get_api_key(x_api_key: str = Header(None, alias="x-api-key")):
         raise HTTPException(status_code=401, detail="Invalid API key")
     return x_api_key
 
-async def send_excuse_to_user(email):
+async def send_excuse_to_user(email, user=None):
     """Envoie un email d'excuses à un utilisateur"""
+    return await asyncio.to_thread(envoyer_excuse, email, user)
+
+def composer_excuse(email, user=None, transport=None):
+    """Construit l'email d'excuses : (résultat, message sérialisé)"""
+    # Vérification de la configuration du transport (un dry-run écrit en local)
+    if transport is None and not settings.transport_configured:
+        logger.error("❌ Configuration d'envoi incomplète (MAIL_TRANSPORT=%s)", settings.mail_transport)
+        raise HTTPException(status_code=500, detail="Configuration SMTP incomplète")
+    
+    # Récupération des données utilisateur
+    datadb = user if user and user.get("full_name") is not None else getclientbyid(email)
+    if not datadb:
+        logger.error(f"❌ Utilisateur introuvable pour : {email}")
+        raise HTTPException(status_code=404, detail=f"Utilisateur introuvable")
+    
+    full_name = datadb.get("full_name", "Membre")
+    
+    # Préparation des variables pour le template
+    variable = {"name": full_name}
+    
+    # Message pré-sérialisé (en-têtes et template encodés une fois par campagne)
+    message = preparer_message("excuses.html", "Message important - Serenity Fitness", settings.mail_from)
+    if not message:
+        logger.error("❌ Template excuses.html non trouvé")
+        raise HTTPException(status_code=500, detail="Template HTML non trouvé")
+    with metrics.stage("render"):
+        parts = message.render(variable)
+    with metrics.stage("mime_build"):
+        message_id, data = message.assemble(email, parts)
+    return {"message": "succès", "email": email, "user": full_name,
+            "message_id": message_id, "size": len(data)}, data
+
+def envoyer_excuse(email, user=None, transport=None):
+    """Version bloquante de send_excuse_to_user, exécutée dans le pool de threads.
+
+    `user` est la ligne déjà lue par iter_recipients ; sans elle, l'utilisateur
+    est récupéré par son email. `transport` : celui de la campagne (dry-run).
+    """
     try:
-        logger.info(f"📨 Envoi email d'excuses à : {email}")
-        
-        # Vérification de la configuration SMTP
-        SMTP_SERVER = os.getenv("SMTP_SERVER")
-        SMTP_PORT = os.getenv("SMTP_PORT", "465")
-        SMTP_USER = os.getenv("SMTP_USER")
-        SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+        logger.info("📨 Envoi email d'excuses à : %s", email)
+        result, data = composer_excuse(email, user, transport)
         
-        if not SMTP_PASSWORD or not SMTP_USER or not SMTP_SERVER:
-            logger.error("❌ Configuration SMTP incomplète")
-            raise HTTPException(status_code=500, detail="Configuration SMTP incomplète")
+        # Remise au transport (sessions SMTP réutilisées entre les destinataires)
+        send_prepared_message(email, data, transport)
         
-        try:
-            SMTP_PORT = int(SMTP_PORT)
-        except ValueError:
-            SMTP_PORT = 465
-        
-        # Récupération des données utilisateur
-        datadb = getclientbyid(email)
-        if not datadb:
-            logger.error(f"❌ Utilisateur introuvable pour : {email}")
-            raise HTTPException(status_code=404, detail=f"Utilisateur introuvable")
-        
-        full_name = datadb.get("full_name", "Membre")
-        
-        # Préparation des variables pour le template
-        variable = {"name": full_name}
-        
-        # Chargement du template HTML
-        contenue_html = charger_template_html("excuses.html", variable)
-        if not contenue_html:
-            logger.error("❌ Template excuses.html non trouvé")
-            raise HTTPException(status_code=500, detail="Template HTML non trouvé")
-        
-        # Création et envoi de l'email
-        msg = EmailMessage()
-        msg['Subject'] = "Message important - Serenity Fitness"
-        msg['From'] = SMTP_USER
-        msg['To'] = email
-        msg.add_alternative(contenue_html, subtype="html")
-        
-        # Envoi via SMTP
-        if SMTP_PORT == 465:
-            with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT) as server:
-                server.login(SMTP_USER, SMTP_PASSWORD)
-                server.send_message(msg)
-        else:
-            with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                server.starttls()
-                server.login(SMTP_USER, SMTP_PASSWORD)
-                server.send_message(msg)
-        
-        logger.info(f"✅ Email d'excuses envoyé à {email}")
-        return {"message": "succès", "email": email, "user": full_name}
+        logger.info("✅ Email d'excuses envoyé à %s", email)
+        return result
         
     except HTTPException:
         raise
@@ -117,7 +248,7 @@ async def test_supabase(x_api_key: str = Depends(get_api_key)):
         }
         
         if emails:
-            first_email = emails[3]
+            first_email = emails[0]
             user_data = getclientbyid(first_email)
             
             if user_data:
@@ -146,6 +277,8 @@ async def test_supabase(x_api_key: str = Depends(get_api_key)):
                     "exercises_detail": reps_by_ex
                 }
         
+        test_results["cache"] = supabase_cache.stats()
+        
         logger.info("✅ Test Supabase réussi")
         return test_results
         
@@ -157,54 +290,218 @@ async def test_supabase(x_api_key: str = Depends(get_api_key)):
             "error": str(e)
         }
 
-@app.post("/send-excuse-email")
-async def send_excuse_email(x_api_key: str = Depends(get_api_key)):
-    """Endpoint pour envoyer un email d'excuses à tous les utilisateurs"""
+def prepare_excuse_chunk(recipients, transport=None):
+    """Paquet d'excuses : les noms viennent des lignes déjà lues"""
+    users = {recipient["email"]: recipient for recipient in recipients}
+    return batch_sender(lambda email: envoyer_excuse(email, users.get(email), transport),
+                        lambda email: composer_excuse(email, users.get(email), transport), transport)
+
+def prepare_weekly_chunk(recipients, transport=None):
+    """Paquet hebdomadaire : stats du paquet chargées en un nombre constant de requêtes"""
+    with metrics.stage("aggregation"):
+        summaries = load_campaign_summaries([recipient["email"] for recipient in recipients])
+    return batch_sender(lambda email: envoyer_recap(email, summaries.get(email), transport),
+                        lambda email: composer_recap(email, summaries.get(email), transport), transport)
+
+# Préparation des paquets pour chaque type de campagne
+CAMPAIGN_KINDS = {
+    "excuse": prepare_excuse_chunk,
+    "weekly": prepare_weekly_chunk,
+}
+
+def campaign_transport(campaign):
+    """Transport d'une campagne : fichier local (DRY_RUN_FORMAT) en dry-run, sinon None (MAIL_TRANSPORT)"""
+    return resources.dry_run_transport if campaign.get("dry_run") else None
+
+def dry_run_location():
+    return settings.maildir_path if settings.dry_run_format == "maildir" else settings.mbox_path
+
+def chunk_preparer(campaign):
+    """prepare_chunk(recipients) du type de la campagne, branché sur son transport"""
+    prepare_chunk = CAMPAIGN_KINDS[campaign["kind"]]
+    transport = campaign_transport(campaign)
+    return lambda recipients: prepare_chunk(recipients, transport)
+
+def log_stage_throughput(campaign_id):
+    """Débit de chaque étape (dry-run : profil CPU de la campagne, sans réseau)"""
+    for name, summary in metrics.campaign_stages(campaign_id).items():
+        logger.info(f"⏱️ {name:<15} {summary['count']:>7} × {summary['avg_ms']:.3f} ms "
+                    f"= {summary['total_seconds']:.3f} s ({summary['per_second']}/s)")
+
+async def run_queued_campaign(campaign_id, time_budget=None, on_chunk=None):
+    """Envoie (ou reprend) une campagne de la file puis journalise son résumé.
+
+    `on_chunk` : rappel après chaque paquet (réponses NDJSON, un seul processus)
+    """
+    store = get_campaign_store()
+    campaign = store.get(campaign_id)
+    if not campaign:
+        return False
+    if campaign["shards"] > 1:
+        finished = await drain_sharded(store, campaign_id, campaign["shards"], time_budget=time_budget)
+    else:
+        finished = await drain_campaign(
+            store,
+            campaign_id,
+            chunk_preparer(campaign),
+            chunk_size=CAMPAIGN_CHUNK_SIZE,
+            concurrency=CAMPAIGN_CONCURRENCY,
+            time_budget=time_budget,
+            on_chunk=on_chunk
+        )
+    if finished is None:
+        return None
+    report = store.report(campaign_id, failures_limit=0)
+    logger.info("\n" + "="*60)
+    logger.info(f"📊 RÉSUMÉ DE LA CAMPAGNE {campaign_id} ({report['kind']}, {report['status']})")
+    logger.info(f"✅ Envoyés avec succès : {report['sent']}/{report['total']}")
+    logger.info(f"❌ Échecs : {report['failed']}/{report['total']}")
+    if report["dry_run"]:
+        logger.info(f"🧪 Dry-run : messages écrits dans {dry_run_location()}")
+        log_stage_throughput(campaign_id)
+    logger.info("="*60 + "\n")
+    campaign_log.summary(campaign_id, report)
+    return finished
+
+async def retry_failures(campaign_id, force=False):
+    """Renvoie les échecs temporaires d'une campagne (messages conservés, sans relecture).
+
+    None si la campagne est en cours d'envoi ou de relance par un autre worker.
+    """
+    store = get_campaign_store()
+    campaign = store.get(campaign_id)
+    prepare_chunk = chunk_preparer(campaign)
+    transport = campaign_transport(campaign)
+    return await retry_campaign(
+        store,
+        campaign_id,
+        lambda email, data: resend_stored_message(email, data, transport),
+        lambda email: prepare_chunk([{"email": email}])(email),
+        force=force,
+        concurrency=CAMPAIGN_CONCURRENCY
+    )
+
+async def drain_pending(time_budget=None):
+    """Reprend toutes les campagnes en attente puis les relances dues (worker, cron)"""
+    deadline = time.monotonic() + time_budget if time_budget else None
+    store = get_campaign_store()
+    drained = []
+    for campaign_id in store.pending():
+        remaining = deadline - time.monotonic() if deadline else None
+        if remaining is not None and remaining <= 0:
+            break
+        if await run_queued_campaign(campaign_id, remaining) is not None:
+            drained.append(campaign_id)
+    for campaign_id in store.campaigns_with_due_retries():
+        if deadline and time.monotonic() >= deadline:
+            break
+        try:
+            if await retry_failures(campaign_id) is None:
+                continue
+        except CampaignAborted as e:
+            logger.error(f"❌ Relance de la campagne {campaign_id} interrompue : {str(e)}")
+            continue
+        if campaign_id not in drained:
+            drained.append(campaign_id)
+    return drained
+
+def enqueue_campaign(kind, recipients, background_tasks, stream=False, dry_run=False):
+    """Enregistre la campagne, planifie son envoi et retourne la réponse de l'endpoint.
+
+    `recipients` peut être un générateur : il est écrit dans la file page par page.
+    `stream` : l'envoi est piloté par la réponse, qui suit la progression en NDJSON.
+    `dry_run` : tout le parcours (lecture, agrégation, rendu, MIME) sans rien
+    envoyer, les messages étant écrits dans un fichier local.
+    """
+    recipients = iter(recipients)
+    first = next(recipients, None)
+    if first is None:
+        logger.warning("⚠️ Aucun email trouvé dans la base de données")
+        return {
+            "success": False, 
+            "message": "Aucun email trouvé",
+            "sent": 0,
+            "failed": 0
+        }
+    
+    job_id, total = get_campaign_store().create_campaign(
+        kind, itertools.chain([first], recipients), shards=CAMPAIGN_SHARDS, dry_run=dry_run
+    )
+    logger.info(f"📥 Campagne {job_id} ({kind}{', dry-run' if dry_run else ''}) mise en file : {total} emails")
+    if stream:
+        return StreamingResponse(
+            stream_campaign(
+                get_campaign_store(), job_id,
+                lambda on_chunk: run_queued_campaign(job_id, CAMPAIGN_TIME_BUDGET, on_chunk=on_chunk),
+                interval=CAMPAIGN_PROGRESS_INTERVAL,
+            ),
+            media_type=NDJSON,
+            status_code=202,
+        )
+    # Budget de temps : une tâche d'arrière-plan serverless peut être gelée après la
+    # réponse ; le reste de la campagne est repris par le cron /campaigns/drain
+    background_tasks.add_task(run_queued_campaign, job_id, CAMPAIGN_TIME_BUDGET)
+    return {
+        "success": True,
+        "message": f"Campagne mise en file d'attente : {total} emails",
+        "job_id": job_id,
+        "status": "queued",
+        "total": total,
+        "dry_run": dry_run
+    }
+
+@app.get("/debug/cache")
+async def cache_stats(x_api_key: str = Depends(get_api_key)):
+    """Compteurs du cache des lectures Supabase"""
+    return supabase_cache.stats()
+
+@app.get("/debug/smtp")
+async def smtp_stats(x_api_key: str = Depends(get_api_key)):
+    """Débit SMTP courant et limitations subies"""
+    return smtp_rate_limiter.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics(x_api_key: str = Depends(get_api_key)):
+    """Durées par étape et compteurs d'envoi au format Prometheus"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/assets")
+async def assets_stats(x_api_key: str = Depends(get_api_key)):
+    """Images encodées, templates minifiés et taille fixe de chaque message préparé"""
+    return {
+        "assets": template_assets.stats(),
+        "templates": template_engine.stats(),
+        "messages": {
+            name: {"subject": subject, "static_bytes": prepared.static_size}
+            for (name, subject, _), prepared in _prepared_messages.items()
+        },
+    }
+
+# Même statut pour les deux formes de réponse : job_id en JSON, ou progression en NDJSON
+CAMPAIGN_RESPONSES = {
+    202: {
+        "description": "Campagne mise en file (JSON), ou suivie en direct avec Accept: application/x-ndjson "
+                       "(une ligne par paquet envoyé, puis le résumé)",
+        "content": {NDJSON: {"schema": {"type": "string"}}},
+    }
+}
+
+@app.post("/send-excuse-email", status_code=202, responses=CAMPAIGN_RESPONSES)
+async def send_excuse_email(background_tasks: BackgroundTasks, x_api_key: str = Depends(get_api_key),
+                            accept: Optional[str] = Header(None), dry_run: bool = False):
+    """Endpoint pour envoyer un email d'excuses à tous les utilisateurs (en tâche de fond).
+
+    Avec `Accept: application/x-ndjson`, la réponse suit l'envoi en direct.
+    Avec `?dry_run=true`, rien n'est envoyé : les messages vont dans un fichier local.
+    """
     logger.info("\n" + "📧"*30)
     logger.info("📧 ENVOI DES EMAILS D'EXCUSES")
     logger.info("📧"*30 + "\n")
     
     try: 
-        emails = getallemail()
-        
-        if not emails:
-            logger.warning("⚠️ Aucun email trouvé dans la base de données")
-            return {
-                "success": False, 
-                "message": "Aucun email trouvé",
-                "sent": 0,
-                "failed": 0
-            }
-        
-        logger.info(f"📬 {len(emails)} emails d'excuses à envoyer")
-        
-        sent_count = 0
-        failed_count = 0
-        failed_emails = []
-        
-        for email in emails:
-            try:
-                await send_excuse_to_user(email)
-                sent_count += 1
-            except Exception as e:
-                failed_count += 1
-                failed_emails.append({"email": email, "error": str(e)})
-                logger.error(f"❌ Échec pour {email} : {str(e)}")
-        
-        logger.info("\n" + "="*60)
-        logger.info(f"📊 RÉSUMÉ DE L'ENVOI D'EXCUSES")
-        logger.info(f"✅ Envoyés avec succès : {sent_count}/{len(emails)}")
-        logger.info(f"❌ Échecs : {failed_count}/{len(emails)}")
-        logger.info("="*60 + "\n")
-        
-        return {
-            "success": True,
-            "message": f"Envoi terminé : {sent_count} succès, {failed_count} échecs",
-            "sent": sent_count,
-            "failed": failed_count,
-            "total": len(emails),
-            "failed_emails": failed_emails if failed_emails else []
-        }
+        # Les destinataires sont lus page par page et écrits directement dans la file
+        return enqueue_campaign("excuse", iter_recipients(), background_tasks,
+                                stream=wants_ndjson(accept), dry_run=dry_run)
         
     except Exception as e:
         logger.error(f"❌ Erreur fatale dans send_excuse_email : {str(e)}")
@@ -214,55 +511,30 @@ async def send_excuse_email(x_api_key: str = Depends(get_api_key)):
             detail=f"Erreur inattendue : {str(e)}"
         )
 
-@app.post("/send-weekly-email")
-async def send_weekly_email(x_api_key: str = Depends(get_api_key)):
-    """Endpoint pour envoyer les emails hebdomadaires à tous les utilisateurs"""
+@app.post("/send-weekly-email", status_code=202, responses=CAMPAIGN_RESPONSES)
+async def send_weekly_email(background_tasks: BackgroundTasks, x_api_key: str = Depends(get_api_key),
+                            accept: Optional[str] = Header(None), dry_run: bool = False):
+    """Endpoint pour envoyer les emails hebdomadaires à tous les utilisateurs (en tâche de fond).
+
+    Avec `Accept: application/x-ndjson`, la réponse suit l'envoi en direct.
+    Avec `?dry_run=true`, rien n'est envoyé : les messages vont dans un fichier
+    local (profilage du parcours complet). WEEKLY_TEST_RECIPIENT limite un envoi
+    réel à cette seule adresse.
+    """
     logger.info("\n" + "🚀"*30)
     logger.info("🚀 DÉMARRAGE DE L'ENVOI DES EMAILS HEBDOMADAIRES")
     logger.info("🚀"*30 + "\n")
     
     try: 
-        emails = ["meiller.amaury@gmail.com"]
-        
-        if not emails:
-            logger.warning("⚠️ Aucun email trouvé dans la base de données")
-            return {
-                "success": False, 
-                "message": "Aucun email trouvé",
-                "sent": 0,
-                "failed": 0
-            }
-        
-        logger.info(f"📬 {len(emails)} emails à envoyer")
-        
-        # Compteurs pour le résumé
-        sent_count = 0
-        failed_count = 0
-        failed_emails = []
-        
-        for email in emails:
-            try:
-                await envmail(email)
-                sent_count += 1
-            except Exception as e:
-                failed_count += 1
-                failed_emails.append({"email": email, "error": str(e)})
-                logger.error(f"❌ Échec pour {email} : {str(e)}")
-        
-        logger.info("\n" + "="*60)
-        logger.info(f"📊 RÉSUMÉ DE L'ENVOI")
-        logger.info(f"✅ Envoyés avec succès : {sent_count}/{len(emails)}")
-        logger.info(f"❌ Échecs : {failed_count}/{len(emails)}")
-        logger.info("="*60 + "\n")
-        
-        return {
-            "success": True,
-            "message": f"Envoi terminé : {sent_count} succès, {failed_count} échecs",
-            "sent": sent_count,
-            "failed": failed_count,
-            "total": len(emails),
-            "failed_emails": failed_emails if failed_emails else []
-        }
+        if WEEKLY_TEST_RECIPIENT and not dry_run:
+            logger.info(f"🧪 WEEKLY_TEST_RECIPIENT : envoi limité à {WEEKLY_TEST_RECIPIENT}")
+            emails = [WEEKLY_TEST_RECIPIENT]
+        else:
+            # Destinataires lus page par page : l'envoi commence dès la première page
+            emails = iter_recipients()
+
+        return enqueue_campaign("weekly", emails, background_tasks,
+                                stream=wants_ndjson(accept), dry_run=dry_run)
         
     except Exception as e:
         logger.error(f"❌ Erreur fatale dans send_weekly_email : {str(e)}")
@@ -272,19 +544,157 @@ async def send_weekly_email(x_api_key: str = Depends(get_api_key)):
             detail=f"Erreur inattendue : {str(e)}"
         )
 
+# Emails transactionnels (templates d'authentification) : fichier et sujet
+TRANSACTIONAL_TEMPLATES = {
+    "confirm-signup": ("confirm-signup.html", "Confirmez votre adresse email - Serenity Fitness"),
+    "reset-password": ("reset-password.html", "Réinitialiser votre mot de passe - Serenity Fitness"),
+    "change-email": ("change-email.html", "Confirmez votre nouvelle adresse email - Serenity Fitness"),
+}
+
+# Adresse simple local@domaine (ASCII, sans espace ni retour à la ligne) : elle
+# est recopiée dans l'en-tête To, une valeur libre permettrait d'ajouter des en-têtes
+EMAIL_PATTERN = (r"^[A-Za-z0-9.!#$%&'*+/=?^_`{|}~-]+"
+                 r"@[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?(?:\.[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?)+$")
+
+class TransactionalEmail(BaseModel):
+    email: str = Field(..., max_length=254, pattern=EMAIL_PATTERN)
+    # Lien inséré à la place de {{ .ConfirmationURL }}
+    confirmation_url: Optional[str] = None
+    variables: Dict[str, str] = {}
+
+def envoyer_transactionnel(template, email, variables):
+    """Envoi transactionnel bloquant, exécuté sur les threads et la session SMTP réservés"""
+    nom_fichier, subject = TRANSACTIONAL_TEMPLATES[template]
+    if not settings.transport_configured:
+        logger.error("❌ Configuration d'envoi incomplète (MAIL_TRANSPORT=%s)", settings.mail_transport)
+        raise HTTPException(status_code=500, detail="Configuration SMTP incomplète")
+    message = preparer_message(nom_fichier, subject, settings.mail_from)
+    if not message:
+        raise HTTPException(status_code=500, detail="Template HTML non trouvé")
+    missing = message.template.variables - variables.keys()
+    if missing:
+        raise HTTPException(status_code=422, detail=f"Variables manquantes : {', '.join(sorted(missing))}")
+    with metrics.stage("render"):
+        parts = message.render(variables)
+    with metrics.stage("mime_build"):
+        message_id, data = message.assemble(email, parts)
+    try:
+        resources.transactional_transport.send(settings.mail_from, email, data)
+    except Exception as e:
+        logger.error(f"❌ Erreur lors de l'envoi de {template} à {email} : {str(e)}")
+        raise HTTPException(status_code=502, detail=f"Erreur d'envoi : {str(e)}")
+    return message_id, len(data)
+
+@app.post("/send/{template}")
+async def send_transactional(template: str, payload: TransactionalEmail, x_api_key: str = Depends(get_api_key)):
+    """Envoie tout de suite un email transactionnel (inscription, mot de passe, changement d'email).
+
+    Voie prioritaire : threads et session SMTP réservés, jetons du limiteur pris
+    sans attendre derrière une campagne en cours.
+    """
+    if template not in TRANSACTIONAL_TEMPLATES:
+        raise HTTPException(status_code=404, detail=f"Template inconnu : {template}")
+    variables = dict(payload.variables)
+    if payload.confirmation_url is not None:
+        variables["ConfirmationURL"] = payload.confirmation_url
+    start = time.perf_counter()
+    message_id, size = await asyncio.get_running_loop().run_in_executor(
+        resources.transactional_executor, envoyer_transactionnel, template, payload.email, variables
+    )
+    elapsed = time.perf_counter() - start
+    metrics.transactional_seconds.observe(elapsed, template)
+    if elapsed * 1000 > settings.transactional_p99_ms:
+        logger.warning(f"🐢 Email {template} envoyé en {elapsed * 1000:.0f} ms "
+                       f"(objectif p99 {settings.transactional_p99_ms:.0f} ms)")
+    return {
+        "message": "succès",
+        "email": payload.email,
+        "template": template,
+        "message_id": message_id,
+        "size": size,
+        "latency_ms": round(elapsed * 1000, 3),
+    }
+
+@app.get("/campaigns/{campaign_id}")
+async def get_campaign(campaign_id: str, x_api_key: str = Depends(get_api_key)):
+    """Progression, débit et échecs d'une campagne"""
+    report = get_campaign_store().report(campaign_id)
+    if not report:
+        raise HTTPException(status_code=404, detail="Campagne introuvable")
+    # Durées par étape, connues du processus qui a envoyé la campagne
+    report["stages"] = metrics.campaign_stages(campaign_id)
+    return report
+
+@app.post("/campaigns/{campaign_id}/retry")
+async def retry_campaign_failures(campaign_id: str, force: bool = False, x_api_key: str = Depends(get_api_key)):
+    """Renvoie uniquement les échecs temporaires de la campagne (les définitifs sont en dead-letter).
+
+    Seuls les échecs dont le délai de relance est écoulé partent, sauf avec `?force=true`.
+    """
+    if not get_campaign_store().get(campaign_id):
+        raise HTTPException(status_code=404, detail="Campagne introuvable")
+    try:
+        result = await retry_failures(campaign_id, force=force)
+    except CampaignAborted as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=409, detail="Campagne en cours d'envoi ou de relance")
+    return {"success": True, "job_id": campaign_id, **result}
+
+@app.post("/weekly-summaries/refresh")
+async def refresh_summaries(x_api_key: str = Depends(get_api_key)):
+    """Matérialise les semaines closes ayant reçu de nouvelles séances (cron hebdomadaire)"""
+    try:
+        result = await asyncio.to_thread(refresh_weekly_summaries, resources.supabase, aggregate_week)
+        return {"success": True, **result}
+    except Exception as e:
+        logger.error(f"❌ Erreur lors du rafraîchissement des résumés : {str(e)}")
+        logger.exception("Stack trace complète :")
+        raise HTTPException(status_code=500, detail=f"Erreur inattendue : {str(e)}")
+
+@app.get("/users/{user_id}/weekly-history")
+async def weekly_history(user_id: str, weeks: int = 8, x_api_key: str = Depends(get_api_key)):
+    """Historique des résumés hebdomadaires d'un utilisateur (évolution semaine après semaine)"""
+    history = await asyncio.to_thread(get_weekly_history, resources.supabase, user_id, weeks)
+    return {"user_id": user_id, "weeks": history}
+
+@app.post("/campaigns/drain")
+async def drain_campaigns(x_api_key: str = Depends(get_api_key)):
+    """Reprend les campagnes interrompues dans la limite de CAMPAIGN_TIME_BUDGET secondes (cron)"""
+    drained = await drain_pending(CAMPAIGN_TIME_BUDGET)
+    store = get_campaign_store()
+    return {
+        "success": True,
+        "campaigns": [store.report(campaign_id, failures_limit=0) for campaign_id in drained]
+    }
 
 
+def iter_recipients(page_size=None):
+    """Parcourt les utilisateurs page par page (pagination par clé sur `id`).
 
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-supabase: Client = create_client(url, key)
+    Générateur de lignes {"id", "email", "full_name"} : la page suivante n'est
+    demandée que lorsque la précédente a été consommée, la mémoire reste
+    constante et la limite de lignes PostgREST n'est jamais atteinte.
+    """
+    page_size = page_size or RECIPIENTS_PAGE_SIZE
+    last_id = None
+    while True:
+        query = resources.supabase.table('users').select('id, email, full_name').order('id').limit(page_size)
+        if last_id is not None:
+            query = query.gt('id', last_id)
+        rows = query.execute().data or []
+        for row in rows:
+            if row.get('email'):
+                yield row
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1]['id']
 
 def getallemail():
     """Récupère tous les emails des utilisateurs"""
     try:
         logger.info("📧 Récupération de tous les emails...")
-        responses = supabase.table('users').select('email').execute()
-        emails = [row['email'] for row in (responses.data or []) if row.get('email')]
+        emails = [row['email'] for row in iter_recipients()]
         logger.info(f"✅ {len(emails)} emails récupérés")
         return emails
     except Exception as e:
@@ -292,15 +702,49 @@ def getallemail():
         return []
 
 
+# Lectures Supabase mémorisées : un appel de debug ou une campagne ne refait
+# pas la même requête pour le même utilisateur et la même semaine
+supabase_cache = TTLCache(
+    maxsize=settings.cache_maxsize,
+    ttl=settings.cache_ttl
+)
+
+@cached(supabase_cache)
+def fetch_client(email):
+    responses = resources.supabase.table('users').select('id, full_name, email').eq('email', email).execute()
+    return responses.data[0] if responses.data else None
+
+@cached(supabase_cache)
+def fetch_sessions(user_id):
+    responses = resources.supabase.table('user_workout_stats').select('total_workouts, total_exercises, last_workout_date, user_id').eq('user_id', user_id).execute()
+    return responses.data[0] if responses.data else None
+
+@cached(supabase_cache)
+def fetch_workout_ids(user_id, start_prev, start_curr):
+    r = resources.supabase.table('workouts') \
+        .select('id, created_at') \
+        .eq('user_id', user_id) \
+        .gte('created_at', start_prev) \
+        .lt('created_at', start_curr) \
+        .execute()
+    return [row['id'] for row in (r.data or [])]
+
+@cached(supabase_cache)
+def fetch_exercises(workout_ids):
+    r = resources.supabase.table('exercises') \
+        .select('name, reps, workout_id') \
+        .in_('workout_id', list(workout_ids)) \
+        .execute()
+    return r.data or []
+
 def getclientbyid(email):
     """Récupère les informations d'un utilisateur par son email"""
     try:
-        logger.info(f"👤 Récupération des infos pour : {email}")
-        responses = supabase.table('users').select('id, full_name, email').eq('email', email).execute()
+        logger.info("👤 Récupération des infos pour : %s", email)
+        user = fetch_client(email)
         
-        if responses.data and len(responses.data) > 0:
-            user = responses.data[0]
-            logger.info(f"✅ Utilisateur trouvé : {user.get('full_name')} (ID: {user.get('id')})")
+        if user:
+            logger.info("✅ Utilisateur trouvé : %s (ID: %s)", user.get('full_name'), user.get('id'))
             return user
         
         logger.warning(f"⚠️ Aucun utilisateur trouvé pour : {email}")
@@ -312,13 +756,12 @@ def getclientbyid(email):
 def getsessionsbyid(user_id):
     """Récupère les statistiques d'entraînement d'un utilisateur par son ID"""
     try:
-        logger.info(f"📊 Récupération des stats pour user_id : {user_id}")
+        logger.info("📊 Récupération des stats pour user_id : %s", user_id)
         # Correction : utilisation de user_id au lieu de email
-        responses = supabase.table('user_workout_stats').select('total_workouts, total_exercises, last_workout_date, user_id').eq('user_id', user_id).execute()
+        stats = fetch_sessions(user_id)
         
-        if responses.data and len(responses.data) > 0:
-            stats = responses.data[0]
-            logger.info(f"✅ Stats trouvées : {stats.get('total_workouts')} séances, {stats.get('total_exercises')} exercices")
+        if stats:
+            logger.info("✅ Stats trouvées : %s séances, %s exercices", stats.get('total_workouts'), stats.get('total_exercises'))
             return stats
         
         logger.warning(f"⚠️ Aucune statistique trouvée pour user_id : {user_id}")
@@ -343,24 +786,17 @@ def week_bounds_previous():
     start_curr_week = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
     start_prev_week = start_curr_week - timedelta(days=7)
     # Intervalle fermé/ouvert: [start_prev_week, start_curr_week)
-    logger.info(f"📅 Période calculée : {start_prev_week.date()} à {start_curr_week.date()}")
+    logger.info("📅 Période calculée : %s à %s", start_prev_week.date(), start_curr_week.date())
     return start_prev_week.isoformat(), start_curr_week.isoformat()
 
 def get_workout_ids_last_week(user_id: str):
     """Récupère les IDs des workouts de la semaine dernière pour un utilisateur"""
     try:
         start_prev, start_curr = week_bounds_previous()
-        logger.info(f"🏋️ Recherche des workouts pour user_id {user_id} entre {start_prev} et {start_curr}")
+        logger.info("🏋️ Recherche des workouts pour user_id %s entre %s et %s", user_id, start_prev, start_curr)
         
-        r = supabase.table('workouts') \
-            .select('id, created_at') \
-            .eq('user_id', user_id) \
-            .gte('created_at', start_prev) \
-            .lt('created_at', start_curr) \
-            .execute()
-        
-        workout_ids = [row['id'] for row in (r.data or [])]
-        logger.info(f"✅ {len(workout_ids)} workouts trouvés : {workout_ids}")
+        workout_ids = fetch_workout_ids(user_id, start_prev, start_curr)
+        logger.info("✅ %d workouts trouvés : %s", len(workout_ids), workout_ids)
         return workout_ids
     except Exception as e:
         logger.error(f"❌ Erreur get_workout_ids_last_week pour user_id {user_id} : {str(e)}")
@@ -371,7 +807,7 @@ def get_workouts_count_last_week(user_id: str):
     try:
         workout_ids = get_workout_ids_last_week(user_id)
         count = len(workout_ids)
-        logger.info(f"📊 Nombre de séances la semaine dernière : {count}")
+        logger.info("📊 Nombre de séances la semaine dernière : %s", count)
         return count
     except Exception as e:
         logger.error(f"❌ Erreur get_workouts_count_last_week pour user_id {user_id} : {str(e)}")
@@ -385,14 +821,11 @@ def get_exercises_count_last_week(user_id: str):
             logger.warning(f"⚠️ Aucun workout pour compter les exercices")
             return 0
         
-        r = supabase.table('exercises') \
-            .select('name') \
-            .in_('workout_id', workout_ids) \
-            .execute()
+        rows = fetch_exercises(tuple(workout_ids))
         
         # Compter le nombre total d'exercices (pas distincts, mais tous les exercices faits)
-        count = len(r.data) if r.data else 0
-        logger.info(f"💪 Nombre d'exercices la semaine dernière : {count}")
+        count = len(rows)
+        logger.info("💪 Nombre d'exercices la semaine dernière : %s", count)
         return count
     except Exception as e:
         logger.error(f"❌ Erreur get_exercises_count_last_week pour user_id {user_id} : {str(e)}")
@@ -406,23 +839,20 @@ def get_total_reps_last_week(user_id: str):
             logger.warning(f"⚠️ Aucun workout trouvé pour user_id {user_id}")
             return 0, {}
         
-        logger.info(f"💪 Recherche des exercices pour les workouts : {workout_ids}")
-        r = supabase.table('exercises') \
-            .select('name, reps, workout_id') \
-            .in_('workout_id', workout_ids) \
-            .execute()
+        logger.info("💪 Recherche des exercices pour les workouts : %s", workout_ids)
+        rows = fetch_exercises(tuple(workout_ids))
         
         total = 0
         by_ex = {}
         
-        if r.data:
-            for row in r.data:
+        if rows:
+            for row in rows:
                 reps = row.get('reps') or 0
                 total += reps
                 name = row.get('name') or 'Inconnu'
                 by_ex[name] = by_ex.get(name, 0) + reps
             
-            logger.info(f"✅ Total répétitions : {total}, Exercices : {len(by_ex)}")
+            logger.info("✅ Total répétitions : %s, Exercices : %d", total, len(by_ex))
         else:
             logger.warning(f"⚠️ Aucun exercice trouvé pour les workouts")
         
@@ -431,128 +861,212 @@ def get_total_reps_last_week(user_id: str):
         logger.error(f"❌ Erreur get_total_reps_last_week pour user_id {user_id} : {str(e)}")
         return 0, {}
 
+_prepared_messages = {}
+
+def preparer_message(nom_fichier, subject, from_addr):
+    """Message pré-sérialisé pour un template (recréé si le template a été rechargé)"""
+    try:
+        template = template_engine.get(nom_fichier)
+    except FileNotFoundError:
+        logger.error(f"❌ Template {nom_fichier} non trouvé")
+        return None
+    key = (nom_fichier, subject, from_addr)
+    prepared = _prepared_messages.get(key)
+    if prepared is None or prepared.template is not template:
+        assets = template_assets.referenced_by("".join(template.parts))
+        prepared = PreparedMessage(template, subject, from_addr, assets)
+        _prepared_messages[key] = prepared
+        logger.info(f"📦 Message {nom_fichier} préparé : {prepared.static_size} octets fixes par email "
+                    f"({len(assets)} image(s) jointe(s))")
+    return prepared
+
 def charger_template_html(nom_fichier, variables=None):
-    """Charge un template HTML et remplace les variables"""
+    """Rend un template HTML compilé (mis en cache) avec les variables échappées"""
     try:
-        chemin_template = os.path.join("templates", nom_fichier)
-        with open(chemin_template, 'r', encoding='utf-8') as fichier:
-            contenu_html = fichier.read()
-        
-        if variables:
-            for cle, valeur in variables.items():
-                contenu_html = contenu_html.replace(f"{{{cle}}}", str(valeur))
-        
-        return contenu_html
+        return template_engine.render(nom_fichier, variables)
     except FileNotFoundError:
-        print(f"❌ Template {nom_fichier} non trouvé")
+        logger.error(f"❌ Template {nom_fichier} non trouvé")
         return None
 
 
-async def envmail(email):
-    """Envoie un email récapitulatif à un utilisateur"""
-    try:
-        logger.info(f"\n{'='*60}")
-        logger.info(f"📨 DÉBUT DE L'ENVOI D'EMAIL POUR : {email}")
-        logger.info(f"{'='*60}")
-        
-        # Vérification de la configuration SMTP
-        SMTP_SERVER = os.getenv("SMTP_SERVER")
-        SMTP_PORT = os.getenv("SMTP_PORT", "465")  # Par défaut 465 pour SSL
-        SMTP_USER = os.getenv("SMTP_USER")
-        SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-        
-        if not SMTP_PASSWORD or not SMTP_USER or not SMTP_SERVER:
-            logger.error("❌ Configuration SMTP incomplète")
-            raise HTTPException(
-                status_code=500, 
-                detail="Configuration SMTP incomplète"
-            )
-        
-        # Conversion du port en entier
+# Mode "auto" : chemin désactivé pour de bon si sa table ou sa fonction est absente,
+# pendant AGGREGATION_RETRY_AFTER secondes après une erreur passagère (réseau, PostgREST)
+AGGREGATION_RETRY_AFTER = 60.0
+_rpc_available = True
+_rpc_retry_at = 0.0
+# Début de semaine déjà couvert par weekly_summaries (None : pas encore vérifié)
+_materialized_fresh_until = None
+_materialized_available = True
+_materialized_retry_at = 0.0
+
+def aggregate_week(user_ids, start_ts, end_ts):
+    """Agrège une période via la RPC Postgres ou en Python selon WEEKLY_AGGREGATION"""
+    global _rpc_available, _rpc_retry_at
+    if WEEKLY_AGGREGATION == "rpc" or (
+        WEEKLY_AGGREGATION != "rows" and _rpc_available and time.monotonic() >= _rpc_retry_at
+    ):
         try:
-            SMTP_PORT = int(SMTP_PORT)
-        except ValueError:
-            logger.error(f"❌ Port SMTP invalide : {SMTP_PORT}")
-            SMTP_PORT = 465
-        
-        logger.info(f"🔧 Config SMTP : {SMTP_SERVER}:{SMTP_PORT}")
-        
-        # 1. Récupération des données utilisateur
-        datadb = getclientbyid(email)
-        if not datadb:
-            logger.error(f"❌ Utilisateur introuvable pour : {email}")
-            raise HTTPException(
-                status_code=404, 
-                detail=f"Utilisateur introuvable pour l'email : {email}"
-            )
-        
-        user_id = datadb.get("id")
-        full_name = datadb.get("full_name", "Utilisateur")
-        
-        if not user_id:
-            logger.error(f"❌ user_id manquant pour : {email}")
-            raise HTTPException(
-                status_code=500, 
-                detail="ID utilisateur manquant"
-            )
-        
-        # 2. Récupération des statistiques GLOBALES (pour la dernière séance)
-        datadb2 = getsessionsbyid(user_id)
-        
-        # 3. Calcul des statistiques de LA SEMAINE DERNIÈRE
-        seances_semaine = get_workouts_count_last_week(user_id)
-        exercices_semaine = get_exercises_count_last_week(user_id)
-        repstotal_semaine, reps_par_exo = get_total_reps_last_week(user_id)
-        
-        logger.info(f"📈 Stats semaine dernière : {seances_semaine} séances, {exercices_semaine} exercices, {repstotal_semaine} reps")
-        
-        # 4. Préparation des variables pour le template
-        variable = {
-            "name": full_name,
-            "seances": seances_semaine,  # CORRECTION : séances de la semaine dernière
-            "last_workout_date": datadb2.get("last_workout_date", "Aucune séance"),
-            "total_exercises": exercices_semaine,  # CORRECTION : exercices de la semaine dernière
-            "repstotal": repstotal_semaine,  # Répétitions de la semaine dernière
-        }
-        
-        logger.info(f"📝 Variables du template : {variable}")
-        
-        # 5. Chargement du template HTML
-        contenue_html = charger_template_html("score.html", variable)
-        if not contenue_html:
-            logger.error("❌ Template HTML non trouvé")
-            raise HTTPException(
-                status_code=500, 
-                detail="Template HTML non trouvé"
-            )
+            return fetch_weekly_aggregates(resources.supabase, user_ids, start_ts, end_ts)
+        except Exception as e:
+            if WEEKLY_AGGREGATION == "rpc":
+                raise
+            if is_missing_relation(e):
+                # Fonction weekly_user_aggregates absente : agrégation en Python désormais
+                logger.warning(f"⚠️ RPC weekly_user_aggregates absente, agrégation en Python : {str(e)}")
+                _rpc_available = False
+            else:
+                logger.warning(f"⚠️ RPC weekly_user_aggregates en erreur, agrégation en Python "
+                               f"(nouvel essai dans {AGGREGATION_RETRY_AFTER:.0f} s) : {str(e)}")
+                _rpc_retry_at = time.monotonic() + AGGREGATION_RETRY_AFTER
+    return aggregate_rows(resources.supabase, user_ids, start_ts, end_ts)
+
+def weekly_summaries_ready(start_curr):
+    """Vérifie (et rafraîchit au besoin) que weekly_summaries couvre la semaine dernière"""
+    global _materialized_fresh_until, _materialized_available, _materialized_retry_at
+    if _materialized_fresh_until == start_curr:
+        return True
+    if WEEKLY_AGGREGATION == "auto" and (
+        not _materialized_available or time.monotonic() < _materialized_retry_at
+    ):
+        return False
+    try:
+        refresh_weekly_summaries(resources.supabase, aggregate_week, until=start_curr)
+        _materialized_fresh_until = start_curr
+        return True
+    except Exception as e:
+        if is_missing_relation(e):
+            logger.warning(f"⚠️ Table weekly_summaries absente, calcul direct : {str(e)}")
+            _materialized_available = False
+        else:
+            logger.warning(f"⚠️ Table weekly_summaries indisponible, calcul direct "
+                           f"(nouvel essai dans {AGGREGATION_RETRY_AFTER:.0f} s) : {str(e)}")
+            _materialized_retry_at = time.monotonic() + AGGREGATION_RETRY_AFTER
+        return False
+
+def load_campaign_summaries(emails):
+    """Précharge les résumés hebdomadaires de tous les destinataires"""
+    try:
+        start_prev, start_curr = week_bounds_previous()
+        aggregation = aggregate_week
+        if WEEKLY_AGGREGATION in ("auto", "materialized") and weekly_summaries_ready(start_curr):
+            # Une ligne matérialisée par utilisateur
+            aggregation = lambda user_ids, start_ts, end_ts: load_materialized(resources.supabase, user_ids, start_ts)
+        summaries = load_weekly_summaries(resources.supabase, emails, start_prev, start_curr, aggregation)
+        logger.info(f"✅ {len(summaries)} résumés hebdomadaires préchargés")
+        return summaries
+    except Exception as e:
+        # Repli : chaque envoi refera ses propres requêtes
+        logger.error(f"❌ Erreur lors du préchargement des résumés : {str(e)}")
+        return {}
+
+
+async def envmail(email, summary=None):
+    """Envoie un email récapitulatif à un utilisateur.
+
+    `summary` est le résumé préchargé par load_weekly_summaries ; sans lui,
+    les données sont récupérées utilisateur par utilisateur.
+    """
+    return await asyncio.to_thread(envoyer_recap, email, summary)
+
+
+def composer_recap(email, summary=None, transport=None):
+    """Construit le récapitulatif hebdomadaire : (résultat, message sérialisé)"""
+    # Vérification de la configuration d'envoi (lue une fois au démarrage ; un dry-run écrit en local)
+    if transport is None and not settings.transport_configured:
+        logger.error("❌ Configuration d'envoi incomplète (MAIL_TRANSPORT=%s)", settings.mail_transport)
+        raise HTTPException(
+            status_code=500, 
+            detail="Configuration SMTP incomplète"
+        )
+    
+    # 1. Récupération des données utilisateur
+    datadb = summary["user"] if summary else getclientbyid(email)
+    if not datadb:
+        logger.error(f"❌ Utilisateur introuvable pour : {email}")
+        raise HTTPException(
+            status_code=404, 
+            detail=f"Utilisateur introuvable pour l'email : {email}"
+        )
+    
+    user_id = datadb.get("id")
+    full_name = datadb.get("full_name", "Utilisateur")
+    
+    if not user_id:
+        logger.error(f"❌ user_id manquant pour : {email}")
+        raise HTTPException(
+            status_code=500, 
+            detail="ID utilisateur manquant"
+        )
+    
+    if summary:
+        # 2-3. Statistiques déjà préchargées pour toute la campagne
+        datadb2 = summary["stats"]
+        seances_semaine = summary["seances"]
+        exercices_semaine = summary["total_exercises"]
+        repstotal_semaine, reps_par_exo = summary["repstotal"], summary["reps_par_exo"]
+    else:
+        with metrics.stage("aggregation"):
+            # 2. Récupération des statistiques GLOBALES (pour la dernière séance)
+            datadb2 = getsessionsbyid(user_id)
+            
+            # 3. Calcul des statistiques de LA SEMAINE DERNIÈRE
+            seances_semaine = get_workouts_count_last_week(user_id)
+            exercices_semaine = get_exercises_count_last_week(user_id)
+            repstotal_semaine, reps_par_exo = get_total_reps_last_week(user_id)
+    
+    logger.info("📈 Stats semaine dernière : %s séances, %s exercices, %s reps",
+                seances_semaine, exercices_semaine, repstotal_semaine)
+    
+    # 4. Préparation des variables pour le template
+    variable = {
+        "name": full_name,
+        "seances": seances_semaine,  # CORRECTION : séances de la semaine dernière
+        "last_workout_date": datadb2.get("last_workout_date", "Aucune séance"),
+        "total_exercises": exercices_semaine,  # CORRECTION : exercices de la semaine dernière
+        "repstotal": repstotal_semaine,  # Répétitions de la semaine dernière
+    }
+    
+    logger.info("📝 Variables du template : %s", variable)
+    
+    # 5. Message pré-sérialisé (en-têtes et template encodés une fois par campagne)
+    message = preparer_message("score.html", "Votre récapitulatif de la semaine", settings.mail_from)
+    if not message:
+        logger.error("❌ Template HTML non trouvé")
+        raise HTTPException(
+            status_code=500, 
+            detail="Template HTML non trouvé"
+        )
+    
+    # 6. Création de l'email
+    with metrics.stage("render"):
+        parts = message.render(variable)
+    with metrics.stage("mime_build"):
+        message_id, data = message.assemble(email, parts)
+    return {
+        "message": "succès",
+        "email": email,
+        "user": full_name,
+        "message_id": message_id,
+        "size": len(data)
+    }, data
+
+def envoyer_recap(email, summary=None, transport=None):
+    """Version bloquante d'envmail, exécutée dans le pool de threads"""
+    try:
+        logger.info("\n%s", SEPARATOR)
+        logger.info("📨 DÉBUT DE L'ENVOI D'EMAIL POUR : %s", email)
+        logger.info(SEPARATOR)
         
-        # 6. Création et envoi de l'email
-        msg = EmailMessage()
-        msg['Subject'] = "Votre récapitulatif de la semaine"
-        msg['From'] = SMTP_USER
-        msg['To'] = email
-        msg.add_alternative(contenue_html, subtype="html")
+        result, data = composer_recap(email, summary, transport)
         
-        logger.info(f"📧 Envoi de l'email via {SMTP_SERVER}:{SMTP_PORT}...")
+        logger.info("📧 Envoi de l'email (transport %s)...", (transport or resources.transport).name)
         
-        # Utilisation de SMTP_SSL pour port 465, ou SMTP avec starttls pour port 587
-        if SMTP_PORT == 465:
-            with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT) as server:
-                server.login(SMTP_USER, SMTP_PASSWORD)
-                server.send_message(msg)
-        else:  # Port 587
-            with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                server.starttls()
-                server.login(SMTP_USER, SMTP_PASSWORD)
-                server.send_message(msg)
+        # SMTP : le pool choisit SMTP_SSL pour le port 465, ou SMTP avec starttls pour le port 587
+        send_prepared_message(email, data, transport)
         
-        logger.info(f"✅ Email envoyé avec succès à {email}")
-        logger.info(f"{'='*60}\n")
-        return {
-            "message": "succès",
-            "email": email,
-            "user": full_name
-        }
+        logger.info("✅ Email envoyé avec succès à %s", email)
+        logger.info("%s\n", SEPARATOR)
+        return result
         
     except smtplib.SMTPAuthenticationError as e:
         logger.error(f"❌ Erreur d'authentification SMTP pour {email} : {str(e)}")
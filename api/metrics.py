@@ -0,0 +1,266 @@
+"""Mesure des étapes d'envoi et export au format Prometheus.
+
+`stage("render")` chronomètre un bloc et alimente l'histogramme global de
+l'étape, ainsi que celui de la campagne en cours (voir `campaign_scope`).
+Les compteurs (requêtes Supabase, octets et connexions SMTP) sont incrémentés
+sur le chemin d'envoi. `render()` produit le texte servi par GET /metrics.
+"""
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Étapes mesurées sur le chemin d'un email
+STAGES = ("db_lookup", "aggregation", "render", "mime_build", "smtp_connect", "smtp_send",
+          "transport_send")
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Campagnes dont les histogrammes restent exposés (les plus récentes)
+CAMPAIGNS_KEPT = 20
+
+_current_campaign = ContextVar("campaign_id", default=None)
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+
+class Histogram:
+    """Histogramme cumulatif par jeu de labels"""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def remove(self, *labels):
+        with self._lock:
+            self._series.pop(labels, None)
+
+    def export(self, *labels):
+        """Copie [compteurs des buckets, total, count] d'une série (None si jamais observée)"""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                return None
+            return [list(series[0]), series[1], series[2]]
+
+    def merge(self, exported, *labels):
+        """Ajoute à une série les observations exportées par un autre processus"""
+        counts, total, count = exported
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bucket_count in enumerate(counts):
+                series[0][i] += bucket_count
+            series[1] += total
+            series[2] += count
+
+    def summary(self, *labels):
+        """count / total / moyenne / débit (observations par seconde cumulée) d'une série
+        (None si jamais observée)"""
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                return None
+            _, total, count = series
+        return {"count": count, "total_seconds": round(total, 6), "avg_ms": round(total / count * 1000, 3),
+                "per_second": round(count / total, 1) if total > 0 else None}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+            for labels, (counts, total, count) in series:
+                pairs = list(zip(self.labelnames, labels))
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{_labels(pairs + [('le', bound)])} {bucket_count}")
+                lines.append(f"{self.name}_bucket{_labels(pairs + [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{_labels(pairs)} {total}")
+                lines.append(f"{self.name}_count{_labels(pairs)} {count}")
+        return lines
+
+
+class Counter:
+    """Compteur monotone par jeu de labels"""
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(list(zip(self.labelnames, labels)))} {value}")
+        return lines
+
+
+stage_seconds = Histogram("email_stage_seconds", "Durée des étapes d'envoi d'un email", ["stage"])
+campaign_stage_seconds = Histogram(
+    "email_campaign_stage_seconds", "Durée des étapes d'envoi par campagne", ["campaign", "stage"]
+)
+supabase_queries = Counter("supabase_queries_total", "Requêtes Supabase exécutées", ["kind"])
+smtp_bytes_sent = Counter("smtp_bytes_sent_total", "Octets de messages acceptés par le serveur SMTP")
+smtp_connections_opened = Counter("smtp_connections_opened_total", "Sessions SMTP ouvertes")
+transport_bytes_sent = Counter(
+    "transport_bytes_sent_total", "Octets de messages remis hors SMTP (maildir, API HTTP)", ["transport"]
+)
+http_batch_requests = Counter("http_batch_requests_total", "Requêtes de l'API d'envoi par lots", ["status"])
+transactional_seconds = Histogram(
+    "transactional_email_seconds", "Latence de bout en bout des emails transactionnels", ["template"]
+)
+
+METRICS = (stage_seconds, campaign_stage_seconds, supabase_queries, smtp_bytes_sent, smtp_connections_opened,
+           transport_bytes_sent, http_batch_requests, transactional_seconds)
+
+_campaigns = OrderedDict()
+_campaigns_lock = threading.Lock()
+
+
+def _track_campaign(campaign_id):
+    """Garde les CAMPAIGNS_KEPT dernières campagnes dans /metrics"""
+    with _campaigns_lock:
+        if campaign_id in _campaigns:
+            _campaigns.move_to_end(campaign_id)
+            return
+        _campaigns[campaign_id] = True
+        while len(_campaigns) > CAMPAIGNS_KEPT:
+            expired, _ = _campaigns.popitem(last=False)
+            for name in STAGES:
+                campaign_stage_seconds.remove(expired, name)
+
+
+def observe(name, seconds):
+    stage_seconds.observe(seconds, name)
+    campaign_id = _current_campaign.get()
+    if campaign_id is not None:
+        _track_campaign(campaign_id)
+        campaign_stage_seconds.observe(seconds, campaign_id, name)
+
+
+@contextmanager
+def stage(name):
+    """Chronomètre le bloc comme étape `name` (exceptions comprises)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+@contextmanager
+def campaign_scope(campaign_id):
+    """Rattache les étapes mesurées dans le bloc à la campagne"""
+    token = _current_campaign.set(campaign_id)
+    try:
+        yield
+    finally:
+        _current_campaign.reset(token)
+
+
+def campaign_stages(campaign_id):
+    """Durées cumulées par étape d'une campagne traitée par ce processus"""
+    stages = {}
+    for name in STAGES:
+        summary = campaign_stage_seconds.summary(campaign_id, name)
+        if summary:
+            stages[name] = summary
+    return stages
+
+
+def export_campaign(campaign_id):
+    """Séries par étape d'une campagne, à renvoyer au processus parent (shards)"""
+    stages = {}
+    for name in STAGES:
+        series = campaign_stage_seconds.export(campaign_id, name)
+        if series:
+            stages[name] = series
+    return stages
+
+
+def merge_campaign(campaign_id, stages):
+    """Ajoute les étapes mesurées par un shard (export_campaign) aux histogrammes
+    de ce processus : /metrics et le rapport de campagne les incluent"""
+    if not stages:
+        return
+    _track_campaign(campaign_id)
+    for name, series in stages.items():
+        campaign_stage_seconds.merge(series, campaign_id, name)
+        stage_seconds.merge(series, name)
+
+
+class _InstrumentedQuery:
+    """Requête supabase-py dont `execute()` est chronométré et compté"""
+
+    def __init__(self, builder, kind):
+        self._builder = builder
+        self._kind = kind
+
+    def __getattr__(self, name):
+        attribute = getattr(self._builder, name)
+        if name == "execute":
+            def execute(*args, **kwargs):
+                supabase_queries.inc(self._kind)
+                with stage("db_lookup"):
+                    return attribute(*args, **kwargs)
+            return execute
+        if not callable(attribute):
+            return attribute
+
+        def chained(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            return _InstrumentedQuery(result, self._kind) if hasattr(result, "execute") else result
+        return chained
+
+
+class InstrumentedClient:
+    """Enveloppe d'un client Supabase : chaque requête alimente db_lookup et supabase_queries_total"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def table(self, name):
+        return _InstrumentedQuery(self.client.table(name), "table")
+
+    def rpc(self, *args, **kwargs):
+        return _InstrumentedQuery(self.client.rpc(*args, **kwargs), "rpc")
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+def render():
+    """Toutes les métriques au format texte Prometheus"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
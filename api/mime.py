@@ -0,0 +1,155 @@
+"""Messages MIME pré-sérialisés.
+
+Pour une campagne, tout ce qui ne dépend pas du destinataire est encodé une
+seule fois : en-têtes Subject/From, squelette multipart et segments littéraux
+du template, déjà en quoted-printable. Chaque segment se termine par un saut
+de ligne « doux » (`=\\r\\n`) : les segments encodés séparément se concatènent
+sans changer le texte décodé. Un message ne coûte plus que l'encodage des
+variables et une jointure de bytes, envoyés tels quels par `sendmail()`.
+"""
+import html
+import re
+import uuid
+from email import policy
+from email.utils import make_msgid
+
+CRLF = b"\r\n"
+SOFT_BREAK = b"=\r\n"
+# Longueur maximale d'une ligne quoted-printable (RFC 2045), "=" final compris
+QP_LINE_LENGTH = 76
+# Adresse local@domaine en dot-atom ASCII : rendue telle quelle par la politique SMTP
+_ATOM = r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+"
+PLAIN_ADDRESS = re.compile(rf"{_ATOM}(?:\.{_ATOM})*@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\Z")
+
+
+# Représentation quoted-printable de chaque octet (hors fin de ligne)
+_QP_TOKENS = [
+    chr(byte) if 33 <= byte <= 126 and byte != 61 or byte in (9, 32) else f"={byte:02X}"
+    for byte in range(256)
+]
+
+
+def _encode_qp_line(line):
+    """Lignes physiques (sans CRLF) d'une ligne de texte, coupées par des sauts doux"""
+    tokens = [_QP_TOKENS[byte] for byte in line.encode("utf-8")]
+    # Un blanc en fin de ligne serait supprimé en transit : il est encodé
+    if tokens and tokens[-1] in (" ", "\t"):
+        tokens[-1] = f"={ord(tokens[-1]):02X}"
+    lines = []
+    current = []
+    width = 0
+    for token in tokens:
+        # Chaque ligne garde la place d'un "=" final
+        if width + len(token) > QP_LINE_LENGTH - 1:
+            lines.append("".join(current) + "=")
+            current = []
+            width = 0
+        current.append(token)
+        width += len(token)
+    lines.append("".join(current))
+    return lines
+
+
+def encode_qp(text):
+    """Encode un segment en quoted-printable, terminé par un saut de ligne doux"""
+    if not text:
+        return b""
+    lines = []
+    for line in text.replace("\r\n", "\n").split("\n"):
+        lines.extend(_encode_qp_line(line))
+    return "\r\n".join(lines).encode("ascii") + SOFT_BREAK
+
+
+class InvalidRecipient(ValueError):
+    """Adresse de destinataire inutilisable telle quelle dans un en-tête"""
+
+
+def check_recipient(to_addr):
+    """Refuse une adresse vide ou contenant CR/LF (injection d'en-têtes : « \\r\\nBcc: ... »)"""
+    if not to_addr or "\r" in to_addr or "\n" in to_addr:
+        raise InvalidRecipient(f"Adresse de destinataire invalide : {to_addr!r}")
+    return to_addr
+
+
+def _header(name, value):
+    """En-tête plié et encodé (RFC 2047 pour les accents), fin de ligne CRLF"""
+    if len(name) + len(value) + 2 <= policy.SMTP.max_line_length and PLAIN_ADDRESS.match(value):
+        # Adresse simple qui tient sur une ligne : même résultat, sans l'analyseur d'en-têtes
+        return f"{name}: {value}\r\n".encode("ascii")
+    return policy.SMTP.header_factory(name, value).fold(policy=policy.SMTP).encode("ascii")
+
+
+class PreparedMessage:
+    """Email HTML dont les parties fixes sont déjà encodées.
+
+    `template` est un CompiledTemplate : ses segments littéraux sont encodés à
+    la construction, ses emplacements à chaque appel de `build`. Les `assets`
+    (api.assets.Asset) référencés par `src="nom"` sont réécrits en `cid:` et
+    leurs parties, encodées une fois, jointes telles quelles (multipart/related).
+    """
+
+    def __init__(self, template, subject, from_addr, assets=()):
+        self.template = template
+        self.subject = subject
+        self.from_addr = from_addr
+        self.assets = list(assets)
+        self.domain = from_addr.rpartition("@")[2] if from_addr and "@" in from_addr else None
+        boundary = f"=============={uuid.uuid4().hex}=="
+        if self.assets:
+            content_type = f'multipart/related; type="text/html"; boundary="{boundary}"'
+        else:
+            content_type = f'multipart/alternative; boundary="{boundary}"'
+
+        self.headers = (
+            _header("Subject", subject)
+            + _header("From", from_addr)
+            + b"MIME-Version: 1.0\r\n"
+            + _header("Content-Type", content_type)
+        )
+        self.part_head = (
+            CRLF
+            + f"--{boundary}".encode("ascii") + CRLF
+            + b'Content-Type: text/html; charset="utf-8"\r\n'
+            + b"Content-Transfer-Encoding: quoted-printable\r\n"
+            + CRLF
+        )
+        delimiter = f"--{boundary}".encode("ascii")
+        # Chaque partie d'asset se termine par CRLF, qui précède le délimiteur suivant
+        self.tail = CRLF + b"".join(delimiter + CRLF + asset.part for asset in self.assets) + delimiter + b"--" + CRLF
+        # Segments littéraux encodés une fois ; les emplacements gardent `{cle}`
+        # encodé pour le cas où la variable est absente
+        self.parts = [encode_qp(self._link_assets(part)) for part in template.parts]
+        self.slots = template.slots
+        self.static_size = len(self.headers) + len(self.part_head) + len(self.tail) + sum(map(len, self.parts))
+
+    def _link_assets(self, text):
+        for asset in self.assets:
+            text = text.replace(f'src="{asset.name}"', f'src="cid:{asset.cid}"')
+            text = text.replace(f"src='{asset.name}'", f"src='cid:{asset.cid}'")
+        return text
+
+    def build(self, to_addr, variables=None):
+        """Retourne (Message-ID, bytes prêts pour sendmail) pour un destinataire"""
+        return self.assemble(to_addr, self.render(variables))
+
+    def render(self, variables=None):
+        """Segments du corps, variables échappées et encodées"""
+        parts = self.parts.copy()
+        if variables:
+            for index, key in self.slots:
+                if key in variables:
+                    parts[index] = encode_qp(html.escape(str(variables[key])))
+        return parts
+
+    def assemble(self, to_addr, parts):
+        """Message complet (en-têtes du destinataire compris) à partir des segments rendus"""
+        check_recipient(to_addr)
+        message_id = make_msgid(domain=self.domain)
+        return message_id, b"".join((
+            self.headers,
+            _header("To", to_addr),
+            b"Message-ID: " + message_id.encode("ascii") + CRLF,
+            self.part_head,
+            *parts,
+            self.tail,
+        ))
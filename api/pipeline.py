@@ -0,0 +1,62 @@
+"""Pipeline d'envoi concurrent pour les campagnes.
+
+Les envois (smtplib et supabase-py sont bloquants) sont exécutés dans un pool
+de threads, avec au plus `concurrency` envois simultanés, pour ne plus geler
+la boucle asyncio ni envoyer un seul email à la fois.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def describe_failure(email, error):
+    return {"email": email, "error": str(error)}
+
+
+async def run_campaign(recipients, send_one, concurrency=4, describe=describe_failure, stop=None):
+    """Envoie `send_one(email)` à chaque destinataire avec un parallélisme borné.
+
+    `send_one` est une fonction bloquante ; une exception signifie un échec.
+    Si `stop(exception)` est vrai, plus aucun envoi n'est lancé (identifiants
+    refusés : les suivants échoueraient de la même façon).
+    Retourne (sent_count, failed_count, failed_emails) dans l'ordre des destinataires
+    tentés, chaque échec étant décrit par `describe(email, exception)`.
+    """
+    concurrency = max(1, int(concurrency))
+    loop = asyncio.get_running_loop()
+    recipients = iter(recipients)
+    results = []
+    stopped = False
+
+    async def worker(executor):
+        nonlocal stopped
+        while not stopped:
+            email = next(recipients, None)
+            if email is None:
+                return
+            slot = len(results)
+            results.append(None)
+            try:
+                await loop.run_in_executor(executor, send_one, email)
+                results[slot] = (email, None)
+            except Exception as e:
+                logger.error(f"❌ Échec pour {email} : {str(e)}")
+                results[slot] = (email, e)
+                if stop is not None and stop(e):
+                    stopped = True
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="campaign") as executor:
+        await asyncio.gather(*(worker(executor) for _ in range(concurrency)))
+
+    sent_count = 0
+    failed_count = 0
+    failed_emails = []
+    for email, error in results:
+        if error is None:
+            sent_count += 1
+        else:
+            failed_count += 1
+            failed_emails.append(describe(email, error))
+    return sent_count, failed_count, failed_emails
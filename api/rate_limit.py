@@ -0,0 +1,121 @@
+"""Limitation adaptative du débit d'envoi SMTP.
+
+Un seau à jetons fixe le nombre de messages par seconde. Le débit s'adapte
+en AIMD : il est divisé quand le fournisseur répond 421/451/452 (trop de
+messages), puis remonte par petits paliers tant que les envois réussissent.
+"""
+import logging
+import smtplib
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Réponses SMTP temporaires signifiant « ralentissez »
+THROTTLE_CODES = {421, 451, 452}
+
+
+def throttle_code(error):
+    """Code SMTP de limitation porté par l'exception, ou None"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return next((code for code in codes if code in THROTTLE_CODES), None)
+    code = getattr(error, "smtp_code", None)
+    return code if code in THROTTLE_CODES else None
+
+
+class AdaptiveRateLimiter:
+    """Seau à jetons dont le débit (messages/seconde) varie en AIMD.
+
+    `clock` et `sleep` (time.monotonic et time.sleep par défaut) peuvent être
+    remplacés par une horloge simulée.
+    """
+
+    def __init__(self, rate=10.0, min_rate=0.5, max_rate=50.0, increase=1.0,
+                 decrease=0.5, recovery_after=20, decrease_interval=1.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self._clock = clock
+        self._sleep = sleep
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, rate)
+        self.rate = max(min_rate, rate)
+        # Hausse additive après `recovery_after` succès consécutifs
+        self.increase = increase
+        self.recovery_after = recovery_after
+        # Baisse multiplicative à chaque refus de type 4xx de limitation
+        self.decrease = decrease
+        # Les refus reçus en rafale par plusieurs threads ne comptent qu'une fois
+        self.decrease_interval = decrease_interval
+        self._decreased_at = float("-inf")
+        self._tokens = 1.0
+        self._updated = clock()
+        self._streak = 0
+        self._lock = threading.Lock()
+        self.throttled = 0
+        self.waited = 0.0
+        self.priority_sends = 0
+
+    def _refill(self, now):
+        burst = max(1.0, self.rate)
+        self._tokens = min(burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, priority=False):
+        """Bloque jusqu'à ce qu'un envoi soit autorisé.
+
+        `priority` (emails transactionnels) : pas d'attente derrière les envois
+        de campagne déjà en file ; le jeton est quand même décompté, ce sont
+        les envois suivants de la campagne qui patientent d'autant.
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            # Le jeton est réservé tout de suite (solde négatif possible) : les
+            # threads en attente sont servis dans l'ordre
+            self._tokens -= 1.0
+            if priority:
+                self.priority_sends += 1
+                return
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited += wait
+        if wait > 0:
+            self._sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self._streak += 1
+            if self._streak >= self.recovery_after and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.increase)
+                self._streak = 0
+
+    def on_throttle(self, code=None):
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if now - self._decreased_at >= self.decrease_interval:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self._decreased_at = now
+            self._tokens = min(self._tokens, 0.0)
+            self._streak = 0
+            self.throttled += 1
+            rate = self.rate
+        logger.warning(f"🐢 Limitation SMTP ({code}) : débit réduit à {rate:.2f} emails/s")
+
+    def split(self, parts):
+        """Réduit les débits à une part sur `parts` (limiteur d'un processus parmi d'autres)"""
+        with self._lock:
+            self.rate /= parts
+            self.min_rate /= parts
+            self.max_rate /= parts
+            self.increase /= parts
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rate": round(self.rate, 3),
+                "min_rate": self.min_rate,
+                "max_rate": self.max_rate,
+                "throttled": self.throttled,
+                "waited_seconds": round(self.waited, 3),
+                "priority_sends": self.priority_sends,
+            }
@@ -0,0 +1,225 @@
+"""Ressources partagées de l'API : clients et caches créés une fois par processus.
+
+Le conteneur vit au niveau du module api.index : il survit aux requêtes et
+aux invocations « chaudes » d'une fonction serverless. Le lifespan FastAPI
+le prépare au démarrage (`warm`) et ferme les connexions à l'arrêt
+(`close`) ; sans lifespan (script, worker) ou avec LAZY_CLIENTS=1, chaque
+ressource est créée au premier accès.
+
+supabase et httpx (postgrest, gotrue, realtime, storage...) ne sont importés
+qu'à la création du client : les endpoints qui ne lisent pas la base, et le
+démarrage à froid, ne paient pas leur chargement.
+"""
+import importlib.util
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from api import metrics
+from api.assets import AssetRegistry
+from api.rate_limit import AdaptiveRateLimiter
+from api.smtp_pool import SMTPPool
+from api.template_engine import TemplateEngine
+from api.transports import HTTPBatchTransport, MaildirTransport, MboxTransport, SMTPTransport
+
+logger = logging.getLogger(__name__)
+
+# Optionnel : HTTP/2 multiplexe les requêtes PostgREST sur une seule connexion
+# (détecté sans importer h2)
+HTTP2 = importlib.util.find_spec("h2") is not None
+
+
+class Resources:
+    """Client Supabase (connexions HTTP gardées ouvertes), transports d'envoi et templates compilés"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        # Templates HTML compilés une fois puis réutilisés pour chaque destinataire ;
+        # TEMPLATE_BUILD=0 les envoie tels qu'écrits (sans minification)
+        self.templates = TemplateEngine(settings.templates_dir, build=settings.template_build)
+        # Images des templates (logo) encodées une fois et jointes par Content-ID ;
+        # ASSET_PNG_FALLBACK=1 convertit le SVG en PNG (nécessite cairosvg)
+        self.assets = AssetRegistry(settings.templates_dir, png_fallback=settings.asset_png_fallback)
+        # Débit d'envoi (emails/s) : démarre à SMTP_RATE, s'adapte entre SMTP_MIN_RATE et SMTP_MAX_RATE
+        self.rate_limiter = AdaptiveRateLimiter(
+            rate=settings.smtp_rate,
+            min_rate=settings.smtp_min_rate,
+            max_rate=settings.smtp_max_rate,
+        )
+        # Threads réservés aux emails transactionnels : jamais en file derrière une campagne
+        self.transactional_executor = ThreadPoolExecutor(
+            max_workers=settings.transactional_workers, thread_name_prefix="transactional"
+        )
+        self._supabase = None
+        self._http = None
+        self._smtp_pool = None
+        self._transactional_pool = None
+        self._transport = None
+        self._transactional_transport = None
+        self._dry_run_transport = None
+        self._lock = threading.Lock()
+
+    @property
+    def supabase(self):
+        """Client Supabase instrumenté (créé au premier accès)"""
+        if self._supabase is None:
+            with self._lock:
+                if self._supabase is None:
+                    self._supabase = self._create_supabase()
+        return self._supabase
+
+    @supabase.setter
+    def supabase(self, client):
+        # Remplacement du client (benchmarks, Supabase en mémoire)
+        self._supabase = client
+
+    def _create_supabase(self):
+        import httpx
+        from supabase import create_client
+        from supabase.lib.client_options import SyncClientOptions
+
+        settings = self.settings
+        # Un seul client httpx pour PostgREST : connexions (TLS) réutilisées d'une requête à l'autre
+        self._http = httpx.Client(
+            http2=HTTP2,
+            timeout=settings.supabase_timeout,
+            limits=httpx.Limits(
+                max_connections=settings.supabase_max_connections,
+                max_keepalive_connections=settings.supabase_max_connections,
+                keepalive_expiry=settings.supabase_keepalive_expiry,
+            ),
+        )
+        client = create_client(
+            settings.supabase_url,
+            settings.supabase_key,
+            options=SyncClientOptions(httpx_client=self._http, postgrest_client_timeout=settings.supabase_timeout),
+        )
+        logger.info(f"🔗 Client Supabase créé ({'HTTP/2' if HTTP2 else 'HTTP/1.1'}, "
+                    f"{settings.supabase_max_connections} connexions max)")
+        # Chaque requête est chronométrée (étape db_lookup) et comptée pour /metrics
+        return metrics.InstrumentedClient(client)
+
+    @property
+    def smtp_pool(self):
+        """Pool SMTP partagé (les connexions s'ouvrent au premier envoi)"""
+        if self._smtp_pool is None:
+            with self._lock:
+                if self._smtp_pool is None:
+                    self._smtp_pool = self._create_smtp_pool(self.settings.smtp_pool_size)
+        return self._smtp_pool
+
+    @property
+    def transactional_pool(self):
+        """Sessions SMTP réservées aux emails transactionnels, prioritaires auprès du limiteur"""
+        if self._transactional_pool is None:
+            with self._lock:
+                if self._transactional_pool is None:
+                    self._transactional_pool = self._create_smtp_pool(
+                        self.settings.transactional_connections, priority=True
+                    )
+        return self._transactional_pool
+
+    @property
+    def transport(self):
+        """Transport des campagnes choisi par MAIL_TRANSPORT (voir api.transports)"""
+        if self._transport is None:
+            with self._lock:
+                if self._transport is None:
+                    self._transport = self._create_transport(self.settings.mail_transport)
+        return self._transport
+
+    @property
+    def dry_run_transport(self):
+        """Fichier local (DRY_RUN_FORMAT) des campagnes lancées avec dry_run : rien ne part"""
+        if self._dry_run_transport is None:
+            with self._lock:
+                if self._dry_run_transport is None:
+                    name = "maildir" if self.settings.dry_run_format == "maildir" else "mbox"
+                    self._dry_run_transport = self._create_transport(name)
+        return self._dry_run_transport
+
+    @property
+    def transactional_transport(self):
+        """Transport des emails transactionnels : sessions SMTP réservées, sinon celui des campagnes"""
+        if self.settings.mail_transport != "smtp":
+            return self.transport
+        if self._transactional_transport is None:
+            pool = self.transactional_pool
+            with self._lock:
+                if self._transactional_transport is None:
+                    self._transactional_transport = SMTPTransport(pool)
+        return self._transactional_transport
+
+    def _create_transport(self, name):
+        settings = self.settings
+        if name == "maildir":
+            logger.info(f"📁 Messages écrits dans le Maildir {settings.maildir_path}")
+            return MaildirTransport(settings.maildir_path)
+        if name == "mbox":
+            logger.info(f"📁 Messages ajoutés au mbox {settings.mbox_path}")
+            return MboxTransport(settings.mbox_path, buffer_size=settings.mbox_buffer_bytes)
+        if name == "http":
+            logger.info(f"🌐 Messages envoyés par lots de {settings.http_batch_size} à {settings.http_batch_url}")
+            return HTTPBatchTransport(
+                settings.http_batch_url,
+                settings.http_batch_api_key,
+                batch_size=settings.http_batch_size,
+                timeout=settings.http_batch_timeout,
+            )
+        if name != "smtp":
+            logger.error(f"❌ MAIL_TRANSPORT inconnu : {name} (smtp utilisé)")
+        # Le pool est créé sous le verrou déjà tenu par `transport`
+        if self._smtp_pool is None:
+            self._smtp_pool = self._create_smtp_pool(settings.smtp_pool_size)
+        return SMTPTransport(self._smtp_pool)
+
+    def _create_smtp_pool(self, size, priority=False):
+        settings = self.settings
+        return SMTPPool(
+            settings.smtp_server,
+            settings.smtp_port,
+            settings.smtp_user,
+            settings.smtp_password,
+            size=size,
+            max_messages_per_connection=settings.smtp_max_messages_per_connection,
+            security=settings.smtp_security,
+            rate_limiter=self.rate_limiter,
+            rate_per_connection=settings.smtp_rate_per_connection,
+            priority=priority,
+        )
+
+    def warm(self):
+        """Prépare au démarrage templates, client Supabase et sessions SMTP transactionnelles"""
+        try:
+            self.templates.preload()
+        except OSError as e:
+            logger.error(f"❌ Préchargement des templates impossible : {str(e)}")
+        if self.settings.supabase_url and self.settings.supabase_key:
+            self.supabase
+        self.warm_transactional()
+
+    def warm_transactional(self):
+        """Ouvre (ou rouvre) les sessions réservées aux emails transactionnels"""
+        if self.settings.mail_transport != "smtp" or not self.settings.smtp_configured:
+            return
+        try:
+            opened = self.transactional_transport.warm()
+            if opened:
+                logger.info(f"🔥 {opened} session(s) SMTP transactionnelle(s) ouverte(s) d'avance")
+        except Exception as e:
+            # L'envoi ouvrira sa session lui-même
+            logger.warning(f"⚠️ Préchauffage SMTP transactionnel impossible : {str(e)}")
+
+    def close(self):
+        """Ferme les transports, les sessions SMTP et les connexions HTTP (arrêt du processus)"""
+        with self._lock:
+            closing = (self._transport, self._dry_run_transport, self._smtp_pool, self._transactional_pool)
+            self._transport = self._transactional_transport = self._dry_run_transport = None
+            self._smtp_pool = self._transactional_pool = None
+            http, self._http = self._http, None
+            self._supabase = None
+        for resource in closing:
+            if resource is not None:
+                resource.close()
+        if http is not None:
+            http.close()
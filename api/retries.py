@@ -0,0 +1,183 @@
+"""Relance des envois échoués.
+
+Chaque échec est classé :
+- temporaire (réponse 4xx, connexion perdue, timeout) : placé dans la file de
+  relance avec un délai exponentiel et aléatoire (jitter) ;
+- définitif (réponse 5xx, utilisateur introuvable) : placé en dead-letter ;
+- fatal (identifiants SMTP ou clé d'API refusés) : l'envoi de la campagne
+  s'arrête en échec, aucun destinataire n'est mis en file.
+
+Le message déjà construit est conservé avec l'échec : une relance le renvoie
+tel quel, sans relire Supabase.
+"""
+import logging
+import random
+import smtplib
+import uuid
+from email.parser import BytesHeaderParser
+
+from api import campaign_log, metrics
+from api.mime import InvalidRecipient
+from api.pipeline import run_campaign
+from api.transports import DeliveryError
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT = "transient"
+PERMANENT = "permanent"
+FATAL = "fatal"
+
+# Tentatives (envoi initial compris) avant le passage en dead-letter
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 60.0
+BACKOFF_CAP = 3600.0
+
+
+class CampaignAborted(Exception):
+    """Échec qui vaut pour toute la campagne : relancer les destinataires ne servirait à rien"""
+
+
+def _chain(error):
+    """L'exception et ses causes (HTTPException levée depuis une erreur SMTP, etc.)"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def classify_failure(error):
+    """TRANSIENT, PERMANENT ou FATAL selon la première cause reconnue"""
+    for e in _chain(error):
+        if isinstance(e, InvalidRecipient):
+            # Adresse inutilisable : la renvoyer ne changera rien
+            return PERMANENT
+        if isinstance(e, DeliveryError):
+            # Refus d'un transport sans SMTP : le fournisseur indique s'il est définitif
+            if e.fatal:
+                return FATAL
+            return PERMANENT if e.permanent else TRANSIENT
+        if isinstance(e, smtplib.SMTPAuthenticationError):
+            # Identifiants à corriger côté configuration : tous les envois échoueraient
+            return FATAL
+        if isinstance(e, smtplib.SMTPRecipientsRefused):
+            codes = [code for code, _ in e.recipients.values()]
+            return PERMANENT if codes and all(code >= 500 for code in codes) else TRANSIENT
+        if isinstance(e, smtplib.SMTPResponseException):
+            return PERMANENT if e.smtp_code >= 500 else TRANSIENT
+        if isinstance(e, (smtplib.SMTPServerDisconnected, OSError)):
+            return TRANSIENT
+        if getattr(e, "status_code", None) == 404:
+            return PERMANENT
+    return TRANSIENT
+
+
+def is_fatal(error):
+    return classify_failure(error) == FATAL
+
+
+def check_fatal(failed_emails):
+    """Lève CampaignAborted si un échec décrit par describe_failure est fatal"""
+    for failure in failed_emails:
+        if failure.get("classification") == FATAL:
+            raise CampaignAborted(f"Envoi interrompu pour {failure['email']} : {failure['error']}")
+
+
+def failed_message(error):
+    """Message construit attaché à l'exception lors de l'envoi (None si l'échec est antérieur)"""
+    for e in _chain(error):
+        message = getattr(e, "email_message", None)
+        if message is not None:
+            if hasattr(message, "as_bytes"):
+                # Même sérialisation que smtplib.send_message (fins de ligne CRLF)
+                return message.as_bytes(policy=message.policy.clone(linesep="\r\n"))
+            return message
+    return None
+
+
+def describe_failure(email, error):
+    """Description d'un échec pour le CampaignStore (classement et message à renvoyer)"""
+    return {
+        "email": email,
+        "error": str(error),
+        "classification": classify_failure(error),
+        "message": failed_message(error),
+    }
+
+
+def backoff_delay(attempts, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Délai avant la tentative suivante : exponentiel, plafonné, avec jitter"""
+    return random.uniform(0.5, 1.0) * min(cap, base * 2 ** max(attempts - 1, 0))
+
+
+async def retry_campaign(store, campaign_id, resend_message, resend_email,
+                         force=False, concurrency=4, owner=None):
+    """Renvoie les échecs temporaires dus d'une campagne.
+
+    `resend_message(email, data)` renvoie un message déjà construit ;
+    `resend_email(email)` reconstruit le message quand l'échec a eu lieu avant
+    (lecture Supabase en erreur). `force` ignore les délais d'attente.
+    La campagne est réservée pendant la relance : None si un worker l'envoie ou
+    la relance déjà. CampaignAborted si un échec est fatal (les destinataires
+    non renvoyés restent en file, inchangés).
+    """
+    owner = owner or uuid.uuid4().hex
+    if not store.claim_retries(campaign_id, owner):
+        logger.info(f"⏭️ Campagne {campaign_id} en cours de traitement, relance différée")
+        return None
+    try:
+        return await _retry_entries(store, campaign_id, resend_message, resend_email, force, concurrency)
+    finally:
+        store.release(campaign_id, owner)
+
+
+async def _retry_entries(store, campaign_id, resend_message, resend_email, force, concurrency):
+    entries = {entry["email"]: entry for entry in store.due_retries(campaign_id, force=force)}
+    # Déjà livrés entre-temps (relance concurrente) : retirés de la file sans renvoi
+    delivered = store.delivered(campaign_id, entries)
+    if delivered:
+        store.discard_retries(campaign_id, delivered)
+        for email in delivered:
+            del entries[email]
+    if not entries:
+        return {"retried": 0, "sent": 0, "failed": 0, "pending": store.retry_count(campaign_id)}
+
+    deliveries = []
+
+    def send_one(email):
+        with campaign_log.recipient(campaign_id, email), metrics.campaign_scope(campaign_id):
+            return resend(email)
+
+    def resend(email):
+        message = entries[email]["message"]
+        if message:
+            resend_message(email, message)
+            message_id = BytesHeaderParser().parsebytes(message)["Message-ID"]
+            size = len(message)
+        else:
+            result = resend_email(email)
+            details = result if isinstance(result, dict) else {}
+            message_id, size = details.get("message_id"), details.get("size")
+        deliveries.append((email, message_id, size))
+
+    logger.info(f"🔁 Relance de {len(entries)} envois pour la campagne {campaign_id}")
+    try:
+        sent_count, failed_count, failed_emails = await run_campaign(
+            list(entries), send_one, concurrency, describe=describe_failure, stop=is_fatal
+        )
+    finally:
+        # Inscrits en une transaction, même si la relance est interrompue
+        store.record_deliveries(campaign_id, deliveries)
+    succeeded = [email for email, _, _ in deliveries]
+    # Échecs fatals : laissés en file tels quels, la relance reprendra une fois la configuration corrigée
+    dead_lettered = store.record_retry_results(
+        campaign_id, succeeded, [f for f in failed_emails if f["classification"] != FATAL]
+    )
+    check_fatal(failed_emails)
+    return {
+        "retried": len(entries),
+        "sent": sent_count,
+        "failed": failed_count,
+        "dead_lettered": dead_lettered,
+        "pending": store.retry_count(campaign_id),
+    }
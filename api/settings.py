@@ -0,0 +1,162 @@
+"""Configuration de l'API, lue une fois dans l'environnement.
+
+`Settings.from_env()` convertit et valide chaque variable au démarrage ; le
+reste du code lit des attributs typés au lieu d'appeler os.getenv (et de
+reconvertir le port SMTP) à chaque envoi.
+"""
+import logging
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _int(name, default):
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logger.error(f"❌ {name} invalide : {value} (valeur par défaut {default})")
+        return default
+
+
+def _float(name, default):
+    value = os.getenv(name)
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        logger.error(f"❌ {name} invalide : {value} (valeur par défaut {default})")
+        return default
+
+
+@dataclass(frozen=True)
+class Settings:
+    api_key: Optional[str]
+    supabase_url: Optional[str]
+    supabase_key: Optional[str]
+    # Connexions HTTP gardées ouvertes vers Supabase (HTTP/2 si h2 est installé)
+    supabase_max_connections: int
+    supabase_keepalive_expiry: float
+    supabase_timeout: float
+    smtp_server: Optional[str]
+    smtp_port: int
+    smtp_user: Optional[str]
+    smtp_password: Optional[str]
+    smtp_security: Optional[str]
+    smtp_pool_size: int
+    smtp_max_messages_per_connection: int
+    smtp_rate_per_connection: float
+    smtp_rate: float
+    smtp_min_rate: float
+    smtp_max_rate: float
+    # Remise des messages : "smtp", "maildir"/"mbox" (fichiers locaux) ou "http" (API d'envoi par lots)
+    mail_transport: str
+    mail_from: str
+    maildir_path: str
+    mbox_path: str
+    mbox_buffer_bytes: int
+    # Campagnes ?dry_run=true : messages écrits en "mbox" ou "maildir" au lieu d'être envoyés
+    dry_run_format: str
+    http_batch_url: Optional[str]
+    http_batch_api_key: Optional[str]
+    http_batch_size: int
+    http_batch_timeout: float
+    # Emails transactionnels : sessions SMTP réservées, threads dédiés, NOOP périodique
+    transactional_connections: int
+    transactional_workers: int
+    transactional_keepalive: float
+    transactional_p99_ms: float
+    log_format: str
+    log_success_sample: float
+    campaign_concurrency: int
+    campaign_chunk_size: int
+    campaign_time_budget: float
+    campaign_shards: int
+    campaign_progress_interval: float
+    recipients_page_size: int
+    # Destinataire unique de /send-weekly-email (essai en production) ; vide : tous les utilisateurs
+    weekly_test_recipient: Optional[str]
+    weekly_aggregation: str
+    templates_dir: str
+    # Templates minifiés au chargement (CSS en ligne, commentaires et espaces retirés)
+    template_build: bool
+    asset_png_fallback: bool
+    cache_maxsize: int
+    cache_ttl: float
+    # Clients créés à la première requête qui en a besoin plutôt qu'au démarrage
+    lazy_clients: bool
+
+    @classmethod
+    def from_env(cls):
+        campaign_concurrency = _int("CAMPAIGN_CONCURRENCY", 4)
+        return cls(
+            api_key=os.getenv("API_KEY"),
+            supabase_url=os.getenv("SUPABASE_URL"),
+            supabase_key=os.getenv("SUPABASE_SERVICE_ROLE_KEY"),
+            supabase_max_connections=_int("SUPABASE_MAX_CONNECTIONS", 10),
+            supabase_keepalive_expiry=_float("SUPABASE_KEEPALIVE_EXPIRY", 60),
+            supabase_timeout=_float("SUPABASE_TIMEOUT", 30),
+            smtp_server=os.getenv("SMTP_SERVER"),
+            # Par défaut 465 (SSL)
+            smtp_port=_int("SMTP_PORT", 465),
+            smtp_user=os.getenv("SMTP_USER"),
+            smtp_password=os.getenv("SMTP_PASSWORD"),
+            smtp_security=os.getenv("SMTP_SECURITY") or None,
+            smtp_pool_size=_int("SMTP_POOL_SIZE", campaign_concurrency),
+            smtp_max_messages_per_connection=_int("SMTP_MAX_MESSAGES_PER_CONNECTION", 100),
+            smtp_rate_per_connection=_float("SMTP_RATE_PER_CONNECTION", 0),
+            smtp_rate=_float("SMTP_RATE", 10),
+            smtp_min_rate=_float("SMTP_MIN_RATE", 0.5),
+            smtp_max_rate=_float("SMTP_MAX_RATE", 50),
+            mail_transport=os.getenv("MAIL_TRANSPORT", "smtp").lower(),
+            # Expéditeur des messages : SMTP_USER par défaut (adresse locale pour maildir/mbox)
+            mail_from=os.getenv("MAIL_FROM") or os.getenv("SMTP_USER") or "no-reply@localhost",
+            # /tmp : seul répertoire accessible en écriture sur Vercel
+            maildir_path=os.getenv("MAILDIR_PATH", "/tmp/maildir"),
+            mbox_path=os.getenv("MBOX_PATH", "/tmp/mail.mbox"),
+            mbox_buffer_bytes=_int("MBOX_BUFFER_BYTES", 1 << 20),
+            dry_run_format=os.getenv("DRY_RUN_FORMAT", "mbox").lower(),
+            http_batch_url=os.getenv("HTTP_BATCH_URL"),
+            http_batch_api_key=os.getenv("HTTP_BATCH_API_KEY"),
+            http_batch_size=_int("HTTP_BATCH_SIZE", 500),
+            http_batch_timeout=_float("HTTP_BATCH_TIMEOUT", 30),
+            transactional_connections=_int("TRANSACTIONAL_CONNECTIONS", 1),
+            transactional_workers=_int("TRANSACTIONAL_WORKERS", 2),
+            transactional_keepalive=_float("TRANSACTIONAL_KEEPALIVE", 30),
+            transactional_p99_ms=_float("TRANSACTIONAL_P99_MS", 500),
+            log_format=os.getenv("LOG_FORMAT", "text"),
+            log_success_sample=_float("LOG_SUCCESS_SAMPLE", 1),
+            campaign_concurrency=campaign_concurrency,
+            campaign_chunk_size=_int("CAMPAIGN_CHUNK_SIZE", 50),
+            campaign_time_budget=_float("CAMPAIGN_TIME_BUDGET", 50),
+            campaign_shards=_int("CAMPAIGN_SHARDS", 1),
+            campaign_progress_interval=_float("CAMPAIGN_PROGRESS_INTERVAL", 5),
+            recipients_page_size=_int("RECIPIENTS_PAGE_SIZE", 500),
+            weekly_test_recipient=os.getenv("WEEKLY_TEST_RECIPIENT") or None,
+            weekly_aggregation=os.getenv("WEEKLY_AGGREGATION", "auto"),
+            templates_dir=os.getenv("TEMPLATES_DIR", "templates"),
+            template_build=os.getenv("TEMPLATE_BUILD", "1") == "1",
+            asset_png_fallback=os.getenv("ASSET_PNG_FALLBACK") == "1",
+            cache_maxsize=_int("CACHE_MAXSIZE", 4096),
+            cache_ttl=_float("CACHE_TTL", 300),
+            # Par défaut sur Vercel : un démarrage à froid ne sert souvent qu'une requête
+            lazy_clients=os.getenv("LAZY_CLIENTS", "1" if os.getenv("VERCEL") else "0") == "1",
+        )
+
+    @property
+    def smtp_configured(self):
+        return bool(self.smtp_server and self.smtp_user and self.smtp_password)
+
+    @property
+    def transport_configured(self):
+        """Le transport choisi a ce qu'il lui faut pour remettre un message"""
+        if self.mail_transport in ("maildir", "mbox"):
+            return True
+        if self.mail_transport == "http":
+            return bool(self.http_batch_url)
+        return self.smtp_configured
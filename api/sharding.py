@@ -0,0 +1,110 @@
+"""Exécution d'une campagne répartie sur plusieurs processus.
+
+Les destinataires sont répartis en K shards selon un hash stable de leur
+user_id (l'email à défaut). Chaque shard est envoyé par un processus distinct,
+avec son propre pool SMTP et son propre client Supabase : la construction MIME
+et le TLS ne sont plus limités à un seul cœur. Tous les shards ajoutent leurs
+compteurs à la même ligne `campaigns`, le rapport de campagne ne change pas.
+Les durées des étapes, mesurées dans les processus, sont renvoyées au parent
+et fusionnées dans ses histogrammes (/metrics, "stages" du rapport).
+"""
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from api import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def shard_for(key, shards):
+    """Shard d'un destinataire (hash() de Python change d'un processus à l'autre)"""
+    digest = hashlib.blake2b(str(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+
+def run_shard(campaign_id, shard, shards, owner, time_budget=None):
+    """Point d'entrée d'un processus : envoie un shard.
+
+    Retourne {"finished", "error", "stages"} : l'erreur éventuelle en texte et les
+    étapes mesurées dans ce processus (metrics.export_campaign).
+    """
+    # Importé ici : chaque processus crée ses propres clients (Supabase, pool SMTP, SQLite)
+    from api import index
+    from api.campaigns import drain_chunks
+
+    # Le débit SMTP autorisé par le fournisseur est partagé entre les processus
+    index.smtp_rate_limiter.split(shards)
+    store = index.get_campaign_store()
+    campaign = store.get(campaign_id)
+    deadline = time.monotonic() + time_budget if time_budget else None
+    finished, error = True, None
+    try:
+        finished = asyncio.run(drain_chunks(
+            store,
+            campaign_id,
+            owner,
+            index.chunk_preparer(campaign),
+            chunk_size=index.CAMPAIGN_CHUNK_SIZE,
+            concurrency=index.CAMPAIGN_CONCURRENCY,
+            deadline=deadline,
+            shard=shard
+        ))
+    except Exception as e:
+        logger.exception(f"❌ Erreur dans le shard {shard} de la campagne {campaign_id}")
+        error = str(e)
+    return {"finished": finished, "error": error, "stages": metrics.export_campaign(campaign_id)}
+
+
+def _run_shards(campaign_id, shards, owner, time_budget):
+    """Lance un processus par shard et attend qu'ils aient tous fini.
+
+    Exécuté dans un thread : l'attente (et l'arrêt du pool) ne bloque pas la
+    boucle asyncio du serveur. Un processus mort compte comme un shard en erreur.
+    """
+    # "spawn" : un processus neuf n'hérite ni des sockets SMTP ni de la connexion SQLite du parent
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with ProcessPoolExecutor(max_workers=shards, mp_context=context) as executor:
+        futures = [executor.submit(run_shard, campaign_id, shard, shards, owner, time_budget)
+                   for shard in range(shards)]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append({"finished": True, "error": str(e) or repr(e), "stages": {}})
+    return results
+
+
+async def drain_sharded(store, campaign_id, shards, time_budget=None, owner=None):
+    """Envoie les shards d'une campagne en parallèle, un processus par shard.
+
+    Même contrat que api.campaigns.drain_campaign : True si la campagne est
+    terminée, False si elle reste à reprendre, None si un autre worker la traite.
+    """
+    owner = owner or uuid.uuid4().hex
+    if not store.claim(campaign_id, owner):
+        logger.info(f"⏭️ Campagne {campaign_id} déjà en cours de traitement ou terminée")
+        return None
+
+    logger.info(f"🧩 Campagne {campaign_id} répartie sur {shards} processus")
+    results = await asyncio.to_thread(_run_shards, campaign_id, shards, owner, time_budget)
+    # Étapes mesurées dans les processus, y compris par les shards en erreur
+    for result in results:
+        metrics.merge_campaign(campaign_id, result["stages"])
+    errors = [result["error"] for result in results if result["error"]]
+    if errors:
+        logger.error(f"❌ Erreur fatale dans la campagne {campaign_id} : {errors[0]}")
+        store.finish(campaign_id, owner, error=errors[0])
+        return True
+    if all(result["finished"] for result in results):
+        store.finish(campaign_id, owner)
+        logger.info(f"🏁 Campagne {campaign_id} terminée")
+        return True
+    store.release(campaign_id, owner)
+    logger.info(f"⏸️ Budget de temps épuisé, campagne {campaign_id} à reprendre")
+    return False
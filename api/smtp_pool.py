@@ -0,0 +1,252 @@
+"""Pool de connexions SMTP persistantes.
+
+Chaque session est ouverte et authentifiée une seule fois puis réutilisée
+pour plusieurs messages, au lieu d'un handshake TLS + AUTH par email.
+"""
+import logging
+import queue
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+
+from api import metrics
+from api.rate_limit import throttle_code
+
+logger = logging.getLogger(__name__)
+
+
+class PooledConnection:
+    """Session SMTP authentifiée et son compteur de messages"""
+
+    def __init__(self, server):
+        self.server = server
+        self.sent = 0
+        self.last_used = time.monotonic()
+        self.last_sent = 0.0
+        self.broken = False
+
+    def close(self):
+        try:
+            self.server.quit()
+        except Exception:
+            try:
+                self.server.close()
+            except Exception:
+                pass
+
+
+class SMTPPool:
+    """Garde jusqu'à `size` sessions SMTP ouvertes et les partage entre les envois.
+
+    - `security` : "ssl" (port 465), "starttls" ou "none" (serveur local de test).
+      Par défaut déduit du port, comme avant : 465 → SSL, sinon STARTTLS.
+    - `max_messages_per_connection` : au-delà, la session est fermée et recréée.
+    - `noop_after` : une session inutilisée depuis plus longtemps est vérifiée par NOOP.
+    - `rate_limiter` : AdaptiveRateLimiter partagé (débit global, ralenti sur 421/451/452).
+    - `rate_per_connection` : messages/seconde maximum sur une même session (0 = illimité).
+    - `priority` : envois prioritaires auprès du limiteur (pool réservé aux transactionnels).
+    """
+
+    def __init__(self, host, port, user=None, password=None, size=4,
+                 max_messages_per_connection=100, noop_after=10.0,
+                 security=None, timeout=30.0, rate_limiter=None,
+                 rate_per_connection=0, throttle_retries=3, priority=False):
+        self.host = host
+        self.port = int(port)
+        self.user = user
+        self.password = password
+        self.size = max(1, int(size))
+        self.max_messages_per_connection = max(1, int(max_messages_per_connection))
+        self.noop_after = noop_after
+        self.security = security or ("ssl" if self.port == 465 else "starttls")
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.rate_per_connection = rate_per_connection
+        # Nouvelles tentatives d'un message refusé pour limitation (4xx)
+        self.throttle_retries = throttle_retries
+        self.priority = priority
+
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.connections_opened = 0
+
+    def _connect(self):
+        """Ouvre et authentifie une nouvelle session"""
+        logger.info(f"🔌 Ouverture d'une connexion SMTP vers {self.host}:{self.port} ({self.security})")
+        with metrics.stage("smtp_connect"):
+            if self.security == "ssl":
+                server = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+            else:
+                server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+                if self.security == "starttls":
+                    server.starttls()
+            try:
+                # has_extn ne connaît les extensions qu'après EHLO (déjà fait par starttls)
+                server.ehlo_or_helo_if_needed()
+                if self.user and self.password and (self.security != "none" or server.has_extn("auth")):
+                    server.login(self.user, self.password)
+            except Exception:
+                server.close()
+                raise
+        with self._lock:
+            self.connections_opened += 1
+        metrics.smtp_connections_opened.inc()
+        return PooledConnection(server)
+
+    def _is_alive(self, conn):
+        """Vérifie par NOOP une session restée inactive trop longtemps"""
+        if time.monotonic() - conn.last_used < self.noop_after:
+            return True
+        try:
+            code, _ = conn.server.noop()
+            return code == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _checkout(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if self._is_alive(conn):
+                return conn
+            logger.info("♻️ Connexion SMTP inactive fermée, reconnexion")
+            conn.close()
+
+    def _checkin(self, conn):
+        conn.last_used = time.monotonic()
+        if conn.broken or self._closed or conn.sent >= self.max_messages_per_connection:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Emprunte une session du pool pour la durée du bloc"""
+        if self._closed:
+            raise RuntimeError("Pool SMTP fermé")
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        except smtplib.SMTPServerDisconnected:
+            if conn is not None:
+                conn.broken = True
+            raise
+        except smtplib.SMTPException:
+            # Refus d'un destinataire, erreur 4xx/5xx : la session reste utilisable,
+            # sauf si smtplib l'a fermée (réponse 421)
+            if conn is not None and conn.server.sock is None:
+                conn.broken = True
+            raise
+        except OSError:
+            if conn is not None:
+                conn.broken = True
+            raise
+        finally:
+            if conn is not None:
+                self._checkin(conn)
+            self._slots.release()
+
+    def _pace(self, conn):
+        """Respecte le débit maximum par session"""
+        if self.rate_per_connection:
+            wait = conn.last_sent + 1.0 / self.rate_per_connection - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        conn.last_sent = time.monotonic()
+
+    def send_message(self, msg):
+        """Envoie un EmailMessage (voir _send pour les reprises)"""
+        self._send(lambda server: server.send_message(msg))
+
+    def sendmail(self, from_addr, to_addrs, data):
+        """Envoie un message déjà sérialisé (bytes), sans le reconstruire"""
+        self._send(lambda server: server.sendmail(from_addr, to_addrs, data))
+        metrics.smtp_bytes_sent.inc(amount=len(data))
+
+    def _send(self, action):
+        """Exécute `action(server)` sur une session du pool.
+
+        Reconnexion transparente si le serveur a coupé ; en cas de limitation
+        (421/451/452), le débit est réduit et le message renvoyé jusqu'à
+        `throttle_retries` fois.
+        """
+        reconnected = False
+        throttled = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire(priority=self.priority)
+            try:
+                with self.connection() as conn:
+                    self._pace(conn)
+                    with metrics.stage("smtp_send"):
+                        action(conn.server)
+                    conn.sent += 1
+                if self.rate_limiter:
+                    self.rate_limiter.on_success()
+                return
+            except smtplib.SMTPServerDisconnected:
+                if reconnected:
+                    raise
+                reconnected = True
+                logger.warning("⚠️ Connexion SMTP perdue, nouvelle tentative sur une session neuve")
+            except smtplib.SMTPException as e:
+                code = throttle_code(e)
+                if code is None or self.rate_limiter is None or throttled >= self.throttle_retries:
+                    raise
+                throttled += 1
+                self.rate_limiter.on_throttle(code)
+
+    def warm(self, count=None):
+        """Ouvre d'avance jusqu'à `count` sessions (toutes par défaut) : le premier
+        envoi ne paie ni la connexion, ni TLS, ni l'authentification"""
+        opened = 0
+        for _ in range(min(count or self.size, self.size) - self._idle.qsize()):
+            if not self._slots.acquire(blocking=False):
+                break
+            try:
+                self._idle.put(self._connect())
+                opened += 1
+            finally:
+                self._slots.release()
+        return opened
+
+    def keepalive(self):
+        """NOOP sur les sessions inactives pour que le serveur ne les coupe pas ;
+        les sessions mortes sont fermées puis rouvertes"""
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        reopen = 0
+        for conn in idle:
+            try:
+                alive = conn.server.noop()[0] == 250
+            except (smtplib.SMTPException, OSError):
+                alive = False
+            if alive:
+                conn.last_used = time.monotonic()
+                self._idle.put(conn)
+            else:
+                conn.close()
+                reopen += 1
+        if reopen and not self._closed:
+            logger.info(f"♻️ {reopen} session(s) SMTP coupée(s) par le serveur, réouverture")
+            self.warm(len(idle))
+
+    def close(self):
+        """Ferme toutes les sessions inactives ; les sessions en cours se ferment au retour"""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
@@ -0,0 +1,80 @@
+"""Suivi en direct d'une campagne en NDJSON (Accept: application/x-ndjson).
+
+La réponse pilote l'envoi : une ligne JSON par paquet traité (compteurs du
+paquet, échecs du paquet seulement, débit cumulé), une ligne "progress" lue
+dans le CampaignStore quand aucun paquet n'a abouti depuis `interval`
+secondes (campagnes réparties sur plusieurs processus, connexion gardée
+ouverte), puis une ligne "summary". Rien n'est accumulé : la mémoire ne
+dépend ni du nombre de destinataires ni du nombre d'échecs.
+"""
+import asyncio
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+NDJSON = "application/x-ndjson"
+# Champs du rapport repris dans les lignes "progress" et "summary" (sans les listes d'échecs)
+REPORT_FIELDS = ("job_id", "kind", "status", "total", "processed", "sent", "failed", "progress",
+                 "elapsed_seconds", "emails_per_second", "delivered", "bytes_sent", "retry_pending",
+                 "dry_run", "error")
+
+# Campagnes dont le client s'est déconnecté : l'envoi continue sans lui
+_detached = set()
+
+
+def wants_ndjson(accept):
+    return bool(accept) and NDJSON in accept
+
+
+def _line(event, **fields):
+    return json.dumps({"event": event, **fields}, ensure_ascii=False, default=str) + "\n"
+
+
+def _report(store, campaign_id):
+    report = store.report(campaign_id, failures_limit=0) or {}
+    return {key: report.get(key) for key in REPORT_FIELDS}
+
+
+async def stream_campaign(store, campaign_id, run, interval=5.0):
+    """Lignes NDJSON de la campagne envoyée par `run(on_chunk)` (coroutine)"""
+    events = asyncio.Queue()
+    started = _report(store, campaign_id)
+    total = started["total"]
+    # Campagne reprise après un point de sauvegarde : le compteur part des envois déjà traités
+    resumed = processed = started["processed"] or 0
+    start = time.monotonic()
+    task = asyncio.create_task(run(events.put_nowait))
+    try:
+        yield _line("started", **started)
+        while True:
+            waiter = asyncio.ensure_future(events.get())
+            done, _ = await asyncio.wait({waiter, task}, timeout=interval, return_when=asyncio.FIRST_COMPLETED)
+            if waiter not in done:
+                waiter.cancel()
+                if task in done and events.empty():
+                    break
+                if not done:
+                    yield _line("progress", **_report(store, campaign_id))
+                continue
+            chunk = waiter.result()
+            processed += chunk["sent"] + chunk["failed"]
+            elapsed = time.monotonic() - start
+            yield _line(
+                "chunk",
+                job_id=campaign_id,
+                processed=processed,
+                total=total,
+                emails_per_second=round((processed - resumed) / elapsed, 2) if elapsed > 0 else None,
+                **chunk,
+            )
+        if task.exception() is not None:
+            yield _line("error", job_id=campaign_id, error=str(task.exception()))
+        yield _line("summary", **_report(store, campaign_id))
+    finally:
+        if not task.done():
+            # Client parti : la campagne continue (et reste consultable via /campaigns/{id})
+            logger.info(f"📴 Client déconnecté, la campagne {campaign_id} continue en arrière-plan")
+            _detached.add(task)
+            task.add_done_callback(_detached.discard)
@@ -0,0 +1,403 @@
+"""Préparation des templates HTML à leur chargement (TEMPLATE_BUILD=1).
+
+Chaque template est transformé une fois, avant d'être compilé :
+- commentaires HTML retirés (sauf commentaires conditionnels Outlook) ;
+- CSS des blocs <style> appliqué aux éléments (attribut style) quand le
+  sélecteur le permet (balise, .classe, #id, descendants) ; les règles qui ne
+  peuvent pas l'être (:hover, @media...) restent dans un seul bloc <style>,
+  en !important pour l'emporter sur le style en ligne comme avant ;
+- règles qui ne ciblent aucun élément retirées, doublons fusionnés, classes
+  devenues inutiles supprimées ;
+- espaces superflus supprimés (texte, CSS, balises).
+
+Sans dépendance : un découpage suffisant pour les templates du dossier, pas un
+moteur CSS complet. Les emplacements `{variable}` et `{{ .Variable }}` ne sont
+pas touchés (TemplateEngine vérifie qu'ils sont tous conservés).
+"""
+import re
+from html.parser import HTMLParser
+
+# Espaces HTML (l'espace insécable U+00A0 n'en fait pas partie)
+SPACES = re.compile(r"[ \t\r\n\f]+")
+CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+# Sélecteur simple applicable en ligne : balise, .classe et #id (ex. "a", "p.note", ".brand")
+COMPOUND = re.compile(r"^(\*|[a-zA-Z][a-zA-Z0-9-]*)?((?:[.#][-_a-zA-Z0-9]+)*)$")
+PSEUDO = re.compile(r"::?[-a-zA-Z]+(\([^)]*\))?")
+CLASS_NAME = re.compile(r"\.([-_a-zA-Z0-9]+)")
+
+# Contenu gardé tel quel
+RAW_TEXT = {"pre", "textarea", "script"}
+VOID = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+# Les espaces autour de ces éléments ne s'affichent pas
+BLOCK = {
+    "html", "head", "body", "title", "meta", "link", "style", "script", "div", "p", "h1", "h2", "h3",
+    "h4", "h5", "h6", "ul", "ol", "li", "table", "thead", "tbody", "tr", "td", "th", "br", "hr",
+    "header", "footer", "section", "center", "blockquote",
+}
+# Éléments qui ne reçoivent pas de style en ligne
+NOT_RENDERED = {"html", "head", "title", "meta", "link", "style", "script"}
+
+
+# --- CSS ---------------------------------------------------------------------
+
+def _split_outside(text, separator):
+    """Découpe `text` sur `separator` hors parenthèses et chaînes"""
+    parts, depth, quote, start = [], 0, None, 0
+    for position, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in "\"'":
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:position])
+            start = position + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _squash(text):
+    """Espaces CSS réduits (hors chaînes) : `a , b` → `a,b`, `x : y` → `x:y`"""
+    chunks = re.split(r"(\"[^\"]*\"|'[^']*')", text)
+    for index in range(0, len(chunks), 2):
+        chunk = SPACES.sub(" ", chunks[index])
+        chunks[index] = re.sub(r" ?([,:;{}>]) ?", r"\1", chunk)
+    return "".join(chunks).strip()
+
+
+def parse_declarations(block):
+    """[(propriété, valeur, important)] d'un bloc de déclarations"""
+    declarations = []
+    for item in _split_outside(block, ";"):
+        name, separator, value = item.partition(":")
+        name = name.strip().lower()
+        if not separator or not name:
+            continue
+        value = _squash(value)
+        important = value.lower().endswith("!important")
+        if important:
+            value = value[:-len("!important")].rstrip()
+        declarations.append((name, value, important))
+    return declarations
+
+
+def _closing_brace(css, opening):
+    depth = 0
+    for position in range(opening, len(css)):
+        if css[position] == "{":
+            depth += 1
+        elif css[position] == "}":
+            depth -= 1
+            if depth == 0:
+                return position
+    return len(css)
+
+
+def parse_css(css):
+    """Règles d'une feuille de style : ("rule", sélecteurs, déclarations),
+    ("group", prélude, règles) pour @media/@supports, ("raw", texte) pour le reste"""
+    css = CSS_COMMENT.sub("", css)
+    items = []
+    position = 0
+    while position < len(css):
+        brace = css.find("{", position)
+        semicolon = css.find(";", position)
+        if semicolon != -1 and (brace == -1 or semicolon < brace):
+            # @import, @charset
+            statement = css[position:semicolon].strip()
+            if statement:
+                items.append(("raw", _squash(statement) + ";"))
+            position = semicolon + 1
+            continue
+        if brace == -1:
+            break
+        end = _closing_brace(css, brace)
+        prelude, body = css[position:brace].strip(), css[brace + 1:end]
+        if prelude.startswith(("@media", "@supports")):
+            items.append(("group", _squash(prelude), parse_css(body)))
+        elif prelude.startswith("@"):
+            items.append(("raw", _squash(prelude) + "{" + _squash(body) + "}"))
+        elif prelude:
+            items.append(("rule", prelude, parse_declarations(body)))
+        position = end + 1
+    return items
+
+
+def _compounds(selector):
+    """[(balise, classes, id)] d'un sélecteur de descendants, None s'il ne s'applique pas en ligne"""
+    compounds = []
+    for part in selector.split():
+        match = COMPOUND.match(part)
+        if not match or not part:
+            return None
+        tag = match.group(1)
+        classes, ident = set(), None
+        for token in re.findall(r"[.#][-_a-zA-Z0-9]+", match.group(2)):
+            if token[0] == ".":
+                classes.add(token[1:])
+            else:
+                ident = token[1:]
+        compounds.append((None if tag in (None, "*") else tag.lower(), frozenset(classes), ident))
+    return compounds or None
+
+
+def _specificity(compounds):
+    return (
+        sum(1 for _, _, ident in compounds if ident),
+        sum(len(classes) for _, classes, _ in compounds),
+        sum(1 for tag, _, _ in compounds if tag),
+    )
+
+
+def _match_compound(compound, element):
+    tag, classes, ident = compound
+    return (tag is None or tag == element[0]) and classes <= element[1] and (ident is None or ident == element[2])
+
+
+def _matches(compounds, element, ancestors):
+    if not _match_compound(compounds[-1], element):
+        return False
+    index = len(ancestors) - 1
+    for compound in reversed(compounds[:-1]):
+        while index >= 0 and not _match_compound(compound, ancestors[index]):
+            index -= 1
+        if index < 0:
+            return False
+        index -= 1
+    return True
+
+
+def _format_declarations(declarations, important=False):
+    merged = {}
+    for name, value, flagged in declarations:
+        # Même propriété déclarée deux fois : la dernière l'emporte
+        merged.pop(name, None)
+        merged[name] = value + ("!important" if important or flagged else "")
+    return ";".join(f"{name}:{value}" for name, value in merged.items())
+
+
+# --- HTML --------------------------------------------------------------------
+
+class _Tokenizer(HTMLParser):
+    """Découpe le document en jetons, avec les ancêtres de chaque élément"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=False)
+        self.tokens = []
+        self.css = []
+        self._stack = []
+        self._in_style = False
+
+    def _element(self, tag, attrs):
+        values = dict(attrs)
+        return (tag, frozenset((values.get("class") or "").split()), values.get("id"))
+
+    def handle_decl(self, decl):
+        self.tokens.append(["markup", f"<!{decl}>"])
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs, False)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs, True)
+
+    def _start(self, tag, attrs, self_closing):
+        if tag == "style":
+            self._in_style = not self_closing
+            self.tokens.append(["style"])
+            return
+        element = self._element(tag, attrs)
+        self.tokens.append(["start", tag, list(attrs), self_closing, element, tuple(self._stack)])
+        if not self_closing and tag not in VOID:
+            self._stack.append(element)
+
+    def handle_endtag(self, tag):
+        if tag == "style":
+            self._in_style = False
+            return
+        for depth in range(len(self._stack) - 1, -1, -1):
+            if self._stack[depth][0] == tag:
+                del self._stack[depth:]
+                break
+        self.tokens.append(["end", tag])
+
+    def handle_data(self, data):
+        if self._in_style:
+            self.css.append(data)
+        else:
+            self.tokens.append(["text", data])
+
+    def handle_entityref(self, name):
+        self.tokens.append(["text", f"&{name};"])
+
+    def handle_charref(self, name):
+        self.tokens.append(["text", f"&#{name};"])
+
+    def handle_comment(self, data):
+        # Commentaires conditionnels (<!--[if mso]>) : lus par Outlook
+        if data.startswith("[if") or data.startswith("<![endif"):
+            self.tokens.append(["markup", f"<!--{data}-->"])
+
+    def handle_pi(self, data):
+        self.tokens.append(["markup", f"<?{data}>"])
+
+
+def _attribute(value):
+    return value.replace("&", "&amp;").replace('"', "&quot;")
+
+
+def _start_tag(tag, attrs, self_closing):
+    parts = [tag]
+    for name, value in attrs:
+        parts.append(name if value is None else f'{name}="{_attribute(value)}"')
+    return "<" + " ".join(parts) + ("/>" if self_closing else ">")
+
+
+def build(source):
+    """Template prêt à l'envoi : CSS en ligne, commentaires et espaces retirés"""
+    parser = _Tokenizer()
+    parser.feed(source)
+    parser.close()
+    tokens = parser.tokens
+    stylesheet = parse_css("\n".join(parser.css))
+    elements = [(token[4], token[5]) for token in tokens if token[0] == "start" and token[1] not in NOT_RENDERED]
+
+    def targets_something(selector):
+        compounds = _compounds(PSEUDO.sub("", selector))
+        if compounds is None:
+            # Sélecteur non analysé (>, +, [attr]...) : gardé
+            return True
+        return any(_matches(compounds, element, ancestors) for element, ancestors in elements)
+
+    inline_rules = []
+    kept = []
+    for order, item in enumerate(stylesheet):
+        if item[0] == "rule":
+            _, selectors, declarations = item
+            for selector in _split_outside(selectors, ","):
+                selector = " ".join(selector.split())
+                compounds = _compounds(selector)
+                if compounds is not None:
+                    inline_rules.append((_specificity(compounds), order, compounds, declarations))
+                elif targets_something(selector):
+                    kept.append(("rule", _squash(selector), _format_declarations(declarations, important=True)))
+        elif item[0] == "group":
+            _, prelude, rules = item
+            inner = []
+            for rule in rules:
+                if rule[0] != "rule":
+                    inner.append(rule[1])
+                    continue
+                selectors = [_squash(s) for s in _split_outside(rule[1], ",") if targets_something(s.strip())]
+                if selectors:
+                    inner.append(",".join(selectors) + "{" + _format_declarations(rule[2], important=True) + "}")
+            if inner:
+                kept.append(("raw", prelude + "{" + "".join(_dedupe(inner)) + "}"))
+        else:
+            kept.append(item)
+    kept_css = "".join(_dedupe([
+        f"{item[1]}{{{item[2]}}}" if item[0] == "rule" else item[1] for item in kept
+    ]))
+    # Classes encore lues par le CSS gardé (les autres ne servent plus à rien)
+    used_classes = set(CLASS_NAME.findall(CSS_COMMENT.sub("", re.sub(r"\{[^{}]*\}", "", kept_css))))
+
+    out = []
+    style_written = False
+    for token in tokens:
+        kind = token[0]
+        if kind == "style":
+            if not style_written and kept_css:
+                out.append(("tag", "style", f"<style>{kept_css}</style>"))
+            style_written = True
+        elif kind == "start":
+            _, tag, attrs, self_closing, element, ancestors = token
+            if tag not in NOT_RENDERED:
+                attrs = _inline(attrs, element, ancestors, inline_rules, used_classes)
+            out.append(("tag", tag, _start_tag(tag, attrs, self_closing)))
+        elif kind == "end":
+            out.append(("tag", token[1], f"</{token[1]}>"))
+        elif kind == "markup":
+            out.append(("tag", "!", token[1]))
+        elif out and out[-1][0] == "text":
+            out[-1] = ("text", None, out[-1][2] + token[1])
+        else:
+            out.append(("text", None, token[1]))
+    return _join(out)
+
+
+def _inline(attrs, element, ancestors, inline_rules, used_classes):
+    """Attributs de l'élément avec le CSS qui le cible en style en ligne"""
+    matched = sorted(
+        (specificity, order, declarations)
+        for specificity, order, compounds, declarations in inline_rules
+        if _matches(compounds, element, ancestors)
+    )
+    existing = []
+    others = []
+    for name, value in attrs:
+        if name == "style":
+            existing = parse_declarations(value or "")
+        elif name == "class":
+            classes = [name for name in (value or "").split() if name in used_classes]
+            if classes:
+                others.append(("class", " ".join(classes)))
+        else:
+            others.append((name, value))
+    if not matched and not existing:
+        return others
+    sheet = [declaration for _, _, declarations in matched for declaration in declarations]
+    # Ordre de la cascade : feuille, style en ligne, puis leurs !important
+    cascade = ([d for d in sheet if not d[2]] + [d for d in existing if not d[2]]
+               + [d for d in sheet if d[2]] + [d for d in existing if d[2]])
+    style = _format_declarations(cascade)
+    return others + ([("style", style)] if style else [])
+
+
+def _dedupe(rules):
+    """Règles identiques retirées (la dernière est gardée), voisines de même corps fusionnées"""
+    seen = set()
+    unique = []
+    for rule in reversed(rules):
+        if rule not in seen:
+            seen.add(rule)
+            unique.append(rule)
+    unique.reverse()
+    merged = []
+    for rule in unique:
+        selector, brace, body = rule.partition("{")
+        if merged and brace and not selector.startswith("@"):
+            previous_selector, previous_brace, previous_body = merged[-1].partition("{")
+            if previous_brace and not previous_selector.startswith("@") and previous_body == body:
+                merged[-1] = f"{previous_selector},{selector}{{{body}"
+                continue
+        merged.append(rule)
+    return merged
+
+
+def _join(out):
+    """Réassemble le document ; les espaces autour des éléments de bloc disparaissent"""
+    html = []
+    raw_depth = 0
+    for index, (kind, tag, text) in enumerate(out):
+        if kind == "tag":
+            if tag in RAW_TEXT:
+                raw_depth += -1 if text.startswith("</") else 1
+            html.append(text)
+            continue
+        if raw_depth > 0:
+            html.append(text)
+            continue
+        text = SPACES.sub(" ", text)
+        previous = out[index - 1] if index > 0 else None
+        following = out[index + 1] if index + 1 < len(out) else None
+        if previous is None or previous[1] in BLOCK or previous[1] == "!":
+            text = text.lstrip(" ")
+        if following is None or following[1] in BLOCK or following[1] == "!":
+            text = text.rstrip(" ")
+        if text:
+            html.append(text)
+    return "".join(html)
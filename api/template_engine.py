@@ -0,0 +1,143 @@
+"""Moteur de templates HTML compilés et mis en cache.
+
+Chaque template est lu une seule fois puis découpé en segments littéraux et
+emplacements `{variable}` (ou `{{ .Variable }}`, la syntaxe des templates
+d'authentification Supabase). Le rendu est une simple jointure, sans relecture
+du fichier ni passe `str.replace` par variable. Le cache est invalidé quand
+la date de modification du fichier change.
+
+Avec `build=True`, le fichier passe d'abord par api.template_build (CSS en
+ligne, commentaires et espaces retirés) : chaque message envoyé est plus court.
+"""
+import html
+import logging
+import os
+import re
+import threading
+import time
+
+from api import template_build
+
+logger = logging.getLogger(__name__)
+
+# `{name}` et `{{ .Name }}` sont des variables ; les blocs CSS `{ margin:0; }` ne correspondent pas
+PLACEHOLDER = re.compile(r"\{\{\s*\.([A-Za-z_][A-Za-z0-9_]*)\s*\}\}|\{([A-Za-z_][A-Za-z0-9_]*)\}")
+
+
+class CompiledTemplate:
+    """Template découpé en segments littéraux et emplacements de variables"""
+
+    def __init__(self, name, source, mtime=None, source_size=None):
+        self.name = name
+        self.mtime = mtime
+        # Tailles en octets (UTF-8) : fichier d'origine et template compilé
+        self.size = len(source.encode("utf-8"))
+        self.source_size = self.size if source_size is None else source_size
+        self.parts = []
+        self.slots = []
+        position = 0
+        for match in PLACEHOLDER.finditer(source):
+            self.parts.append(source[position:match.start()])
+            self.slots.append((len(self.parts), match.group(1) or match.group(2)))
+            self.parts.append(match.group(0))
+            position = match.end()
+        self.parts.append(source[position:])
+
+    @property
+    def variables(self):
+        return {key for _, key in self.slots}
+
+    def render(self, variables=None, escape=True):
+        """Remplace les emplacements ; une variable absente laisse `{cle}` intact"""
+        if not variables:
+            return "".join(self.parts)
+        parts = self.parts.copy()
+        for index, key in self.slots:
+            if key in variables:
+                value = str(variables[key])
+                parts[index] = html.escape(value) if escape else value
+        return "".join(parts)
+
+
+class TemplateEngine:
+    """Cache des templates compilés d'un dossier"""
+
+    def __init__(self, directory="templates", check_interval=2.0, build=True):
+        self.directory = directory
+        self.build = build
+        # Délai minimal entre deux vérifications de la date de modification
+        self.check_interval = check_interval
+        self._cache = {}
+        self._checked_at = {}
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load(self, name):
+        path = self._path(name)
+        mtime = os.path.getmtime(path)
+        with open(path, 'r', encoding='utf-8') as fichier:
+            source = fichier.read()
+        source_size = len(source.encode("utf-8"))
+        if self.build:
+            source = self._build(name, source)
+        template = CompiledTemplate(name, source, mtime, source_size)
+        if template.size != source_size:
+            saved = 100 * (source_size - template.size) / source_size
+            logger.info(f"📄 Template {name} compilé ({source_size} → {template.size} octets, -{saved:.0f} %)")
+        else:
+            logger.info(f"📄 Template {name} compilé ({template.size} octets)")
+        return template
+
+    def _build(self, name, source):
+        """Template minifié ; la source telle quelle si un emplacement a été perdu"""
+        try:
+            built = template_build.build(source)
+        except Exception as e:
+            logger.error(f"❌ Préparation du template {name} impossible : {str(e)}")
+            return source
+        before = [match.group(0) for match in PLACEHOLDER.finditer(source)]
+        after = [match.group(0) for match in PLACEHOLDER.finditer(built)]
+        if before != after:
+            logger.error(f"❌ Préparation du template {name} ignorée : emplacements modifiés "
+                         f"({len(before)} → {len(after)})")
+            return source
+        return built
+
+    def get(self, name):
+        """Retourne le template compilé ; FileNotFoundError s'il n'existe pas"""
+        now = time.monotonic()
+        template = self._cache.get(name)
+        if template is not None and now - self._checked_at.get(name, 0) < self.check_interval:
+            return template
+        with self._lock:
+            template = self._cache.get(name)
+            if template is None or os.path.getmtime(self._path(name)) != template.mtime:
+                template = self._load(name)
+                self._cache[name] = template
+            self._checked_at[name] = now
+            return template
+
+    def preload(self, names=None):
+        """Compile à l'avance les templates (tous les .html du dossier par défaut)"""
+        if names is None:
+            names = sorted(f for f in os.listdir(self.directory) if f.endswith(".html"))
+        for name in names:
+            self.get(name)
+
+    def render(self, name, variables=None):
+        return self.get(name).render(variables)
+
+    def stats(self):
+        """Tailles avant/après préparation des templates déjà chargés"""
+        return {
+            name: {"source_bytes": template.source_size, "built_bytes": template.size,
+                   "saved_bytes": template.source_size - template.size}
+            for name, template in self._cache.items()
+        }
+
+    def render_many(self, name, batch):
+        """Rend le même template pour une liste de dictionnaires de variables"""
+        template = self.get(name)
+        return [template.render(variables) for variables in batch]
@@ -0,0 +1,320 @@
+"""Transports de remise des messages déjà sérialisés (MAIL_TRANSPORT).
+
+- "smtp" (défaut) : pool de sessions SMTP (api.smtp_pool), un message par transaction ;
+- "maildir" : un fichier par message dans un Maildir local (tmp/ puis new/), sans réseau ;
+- "mbox" : messages ajoutés à un fichier mbox local, par écritures groupées ;
+- "http" : API d'envoi en masse d'un fournisseur, jusqu'à HTTP_BATCH_SIZE messages
+  par POST sur un client httpx aux connexions gardées ouvertes.
+
+Tous reçoivent les octets produits par PreparedMessage.assemble : le message
+n'est jamais reconstruit, quel que soit le transport.
+"""
+import base64
+import itertools
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+
+from api import metrics
+from api.mime import check_recipient
+
+try:
+    import fcntl
+except ImportError:
+    # Windows : pas de verrou entre processus (un seul processus écrit le mbox)
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Réponses HTTP après lesquelles le lot est renvoyé tel quel
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Clé d'API refusée : aucun lot ne passera, la campagne s'arrête
+AUTH_STATUSES = {401, 403}
+
+
+class DeliveryError(Exception):
+    """Message refusé par un transport sans SMTP (lot HTTP, message rejeté par le fournisseur).
+
+    `fatal` : refus qui vaut pour tous les messages (clé d'API invalide).
+    """
+
+    def __init__(self, message, permanent=False, fatal=False):
+        super().__init__(message)
+        self.permanent = permanent
+        self.fatal = fatal
+
+
+class Transport:
+    """Interface commune : `send` pour un message, `send_batch` pour un paquet"""
+
+    name = None
+    # True si send_batch regroupe réellement les messages (moins d'allers-retours)
+    batched = False
+
+    def send(self, from_addr, to_addr, data):
+        raise NotImplementedError
+
+    def send_batch(self, from_addr, messages):
+        """Envoie [(to_addr, data)] ; retourne, dans l'ordre, None ou l'exception de chaque message"""
+        errors = []
+        for to_addr, data in messages:
+            try:
+                self.send(from_addr, to_addr, data)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    def warm(self):
+        return 0
+
+    def keepalive(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SMTPTransport(Transport):
+    """Remise par le pool SMTP (reconnexion, limiteur de débit, priorité)"""
+
+    name = "smtp"
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def send(self, from_addr, to_addr, data):
+        self.pool.sendmail(from_addr, [to_addr], data)
+
+    def warm(self):
+        return self.pool.warm()
+
+    def keepalive(self):
+        self.pool.keepalive()
+
+    def close(self):
+        self.pool.close()
+
+
+class MaildirTransport(Transport):
+    """Écrit chaque message dans `directory` au format Maildir (lisible par mutt, Thunderbird...)"""
+
+    name = "maildir"
+
+    def __init__(self, directory):
+        self.directory = directory
+        for sub in ("tmp", "new", "cur"):
+            os.makedirs(os.path.join(directory, sub), exist_ok=True)
+        self._counter = itertools.count()
+        self._hostname = socket.gethostname().replace("/", "\\057").replace(":", "\\072")
+
+    def _unique_name(self):
+        now = time.time()
+        return f"{int(now)}.M{int(now % 1 * 1e6)}P{os.getpid()}Q{next(self._counter)}.{self._hostname}"
+
+    def send(self, from_addr, to_addr, data):
+        check_recipient(to_addr)
+        name = self._unique_name()
+        path = os.path.join(self.directory, "tmp", name)
+        with metrics.stage("transport_send"):
+            with open(path, "wb") as fichier:
+                # Enveloppe conservée comme le ferait un agent de livraison
+                fichier.write(f"Return-Path: <{from_addr}>\r\nDelivered-To: {to_addr}\r\n".encode())
+                fichier.write(data)
+            # tmp/ → new/ : un lecteur ne voit jamais de message incomplet
+            os.replace(path, os.path.join(self.directory, "new", name))
+        metrics.transport_bytes_sent.inc(self.name, amount=len(data))
+
+
+class MboxTransport(Transport):
+    """Ajoute les messages à un fichier mbox (format mboxrd), par écritures groupées.
+
+    Un paquet est sérialisé en mémoire puis écrit en un seul appel système
+    (un par tranche de `buffer_size` octets) : tout est sur disque au retour
+    de send_batch, avant l'inscription au registre des livraisons. Ouverture
+    en O_APPEND et verrou fcntl : plusieurs processus (shards) peuvent écrire
+    dans le même fichier.
+    """
+
+    name = "mbox"
+    batched = True
+    # mboxrd : une ligne commençant par ">*From " reçoit un ">" de plus
+    FROM_LINE = re.compile(rb"^(>*From )", re.MULTILINE)
+
+    def __init__(self, path, buffer_size=1 << 20):
+        self.path = path
+        self.buffer_size = buffer_size
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _entry(self, from_addr, to_addr, data):
+        check_recipient(to_addr)
+        body = self.FROM_LINE.sub(rb">\1", data.replace(b"\r\n", b"\n"))
+        envelope = f"From {from_addr} {time.asctime()}\nDelivered-To: {to_addr}\n"
+        return envelope.encode() + body + (b"\n" if body.endswith(b"\n") else b"\n\n")
+
+    def send(self, from_addr, to_addr, data):
+        error = self.send_batch(from_addr, [(to_addr, data)])[0]
+        if error is not None:
+            raise error
+
+    def send_batch(self, from_addr, messages):
+        errors = []
+        written = 0
+        with metrics.stage("transport_send"):
+            buffer = bytearray()
+            for to_addr, data in messages:
+                try:
+                    buffer += self._entry(from_addr, to_addr, data)
+                except ValueError as e:
+                    # Adresse refusée : seul ce message échoue
+                    errors.append(e)
+                    continue
+                errors.append(None)
+                written += len(data)
+                if len(buffer) >= self.buffer_size:
+                    self._write(buffer)
+                    buffer.clear()
+            self._write(buffer)
+        metrics.transport_bytes_sent.inc(self.name, amount=written)
+        return errors
+
+    def _write(self, buffer):
+        if not buffer:
+            return
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                written = os.write(fd, buffer)
+                while written < len(buffer):
+                    written += os.write(fd, buffer[written:])
+            finally:
+                os.close(fd)
+
+
+class HTTPBatchTransport(Transport):
+    """API d'envoi en masse : un POST JSON par lot de `batch_size` messages.
+
+    Corps : {"messages": [{"from", "to": [...], "raw": <message en base64>}]}.
+    Réponse attendue : {"results": [{"status": "accepted" | "rejected", "error",
+    "permanent"}]} dans l'ordre des messages ; sans "results", un code 2xx vaut
+    acceptation du lot entier. 429 et 5xx : lot renvoyé après Retry-After
+    (au plus `retries` fois) puis compté en échec temporaire.
+    """
+
+    name = "http"
+    batched = True
+
+    def __init__(self, url, api_key=None, batch_size=500, timeout=30.0, max_connections=4, retries=2):
+        self.url = url
+        self.api_key = api_key
+        self.batch_size = max(1, int(batch_size))
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.retries = retries
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """Client httpx partagé (importé et créé au premier envoi)"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    import httpx
+
+                    headers = {"Content-Type": "application/json"}
+                    if self.api_key:
+                        headers["Authorization"] = f"Bearer {self.api_key}"
+                    self._client = httpx.Client(
+                        timeout=self.timeout,
+                        headers=headers,
+                        limits=httpx.Limits(max_connections=self.max_connections,
+                                            max_keepalive_connections=self.max_connections),
+                    )
+        return self._client
+
+    def send(self, from_addr, to_addr, data):
+        error = self.send_batch(from_addr, [(to_addr, data)])[0]
+        if error is not None:
+            raise error
+
+    def send_batch(self, from_addr, messages):
+        errors = []
+        for start in range(0, len(messages), self.batch_size):
+            errors.extend(self._post(from_addr, messages[start:start + self.batch_size]))
+        return errors
+
+    def _post(self, from_addr, messages):
+        body = json.dumps({"messages": [
+            {"from": from_addr, "to": [to_addr], "raw": base64.b64encode(data).decode("ascii")}
+            for to_addr, data in messages
+        ]}).encode()
+        attempt = 0
+        while True:
+            try:
+                with metrics.stage("transport_send"):
+                    response = self.client.post(self.url, content=body)
+                metrics.http_batch_requests.inc(str(response.status_code))
+            except Exception as e:
+                # Réseau (httpx.TransportError) : tout le lot est à relancer
+                logger.error(f"❌ Lot HTTP de {len(messages)} messages en échec : {str(e)}")
+                return [_batch_error(str(e), e) for _ in messages]
+            if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                attempt += 1
+                delay = _retry_after(response.headers.get("Retry-After"), attempt)
+                logger.warning(f"⚠️ Lot HTTP refusé ({response.status_code}), nouvel essai dans {delay:.1f} s")
+                time.sleep(delay)
+                continue
+            break
+        if response.status_code >= 300:
+            reason = f"HTTP {response.status_code} : {response.text[:200]}"
+            logger.error(f"❌ Lot HTTP de {len(messages)} messages refusé : {reason}")
+            fatal = response.status_code in AUTH_STATUSES
+            return [_batch_error(reason, fatal=fatal) for _ in messages]
+
+        metrics.transport_bytes_sent.inc(self.name, amount=sum(len(data) for _, data in messages))
+        try:
+            results = response.json().get("results")
+        except ValueError:
+            results = None
+        if not results:
+            return [None] * len(messages)
+        errors = []
+        for position in range(len(messages)):
+            result = results[position] if position < len(results) else {}
+            if result.get("status", "accepted") == "accepted":
+                errors.append(None)
+            else:
+                errors.append(DeliveryError(result.get("error") or "message refusé",
+                                            permanent=bool(result.get("permanent"))))
+        return errors
+
+    def close(self):
+        with self._lock:
+            client, self._client = self._client, None
+        if client is not None:
+            client.close()
+
+
+def _batch_error(reason, cause=None, fatal=False):
+    """Une exception par message : chacune reçoit ensuite le message à relancer"""
+    error = DeliveryError(reason, fatal=fatal)
+    error.__cause__ = cause
+    return error
+
+
+def _retry_after(header, attempt):
+    """Délai avant un nouvel essai : Retry-After (secondes) sinon 1 s, 2 s, 4 s..."""
+    try:
+        return min(float(header), 30.0)
+    except (TypeError, ValueError):
+        return float(2 ** (attempt - 1))
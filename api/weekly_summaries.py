@@ -0,0 +1,140 @@
+"""Résumés hebdomadaires matérialisés (table `weekly_summaries`).
+
+Une semaine close ne change plus : ses statistiques sont calculées une fois
+par (utilisateur, semaine ISO) puis relues en une ligne par utilisateur.
+Le rafraîchissement est incrémental : seules les semaines des utilisateurs
+ayant de nouvelles séances depuis le dernier watermark sont recalculées.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+
+from api.aggregates import EMPTY_AGGREGATE
+from api.bulk_loader import chunked, fetch_all, fetch_in
+
+logger = logging.getLogger(__name__)
+
+STATE_KEY = "weekly_summaries"
+# Semaines matérialisées lors du tout premier rafraîchissement
+BACKFILL_WEEKS = 12
+UPSERT_CHUNK_SIZE = 500
+
+
+def parse_timestamp(value):
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        dt = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+def week_start(value):
+    """Lundi 00:00 UTC de la semaine contenant `value`"""
+    dt = parse_timestamp(value).astimezone(timezone.utc)
+    return (dt - timedelta(days=dt.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def iso_week(value):
+    """Identifiant de semaine ISO, ex. '2026-W41'"""
+    year, week, _ = parse_timestamp(value).isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def get_watermark(client):
+    r = client.table('weekly_summary_state').select('watermark').eq('id', STATE_KEY).execute()
+    if r.data:
+        return parse_timestamp(r.data[0]['watermark'])
+    return None
+
+
+def refresh_weekly_summaries(client, aggregate, until=None):
+    """Matérialise les semaines closes ayant reçu de nouvelles séances.
+
+    `aggregate(user_ids, start_ts, end_ts)` retourne user_id -> agrégats
+    (fetch_weekly_aggregates ou aggregate_rows). `until` est le début de la
+    semaine en cours par défaut : seules les semaines terminées sont écrites.
+    """
+    until = parse_timestamp(until) if until else week_start(datetime.now(timezone.utc))
+    watermark = get_watermark(client) or (until - timedelta(weeks=BACKFILL_WEEKS))
+    if watermark >= until:
+        logger.info(f"✅ Résumés hebdomadaires déjà à jour (watermark {watermark.isoformat()})")
+        return {"weeks": 0, "rows": 0, "watermark": watermark.isoformat()}
+
+    # Séances créées depuis le watermark : quelles (semaine, utilisateur) recalculer
+    new_workouts = fetch_all(
+        lambda: client.table('workouts')
+        .select('id, user_id, created_at')
+        .gte('created_at', watermark.isoformat())
+        .lt('created_at', until.isoformat())
+        .order('id')
+    )
+    users_by_week = {}
+    for w in new_workouts:
+        users_by_week.setdefault(week_start(w['created_at']), set()).add(w['user_id'])
+    logger.info(f"🔄 {len(new_workouts)} nouvelles séances sur {len(users_by_week)} semaines")
+
+    now = datetime.now(timezone.utc).isoformat()
+    rows_written = 0
+    for start in sorted(users_by_week):
+        user_ids = sorted(users_by_week[start])
+        aggregates = aggregate(user_ids, start.isoformat(), (start + timedelta(days=7)).isoformat())
+        rows = []
+        for user_id in user_ids:
+            a = aggregates.get(user_id, EMPTY_AGGREGATE)
+            rows.append({
+                "user_id": user_id,
+                "iso_week": iso_week(start),
+                "week_start": start.isoformat(),
+                "seances": a["workouts_count"],
+                "exercises_count": a["exercises_count"],
+                "total_reps": a["total_reps"],
+                "reps_by_exercise": a["reps_by_exercise"],
+                "refreshed_at": now,
+            })
+        for chunk in chunked(rows, UPSERT_CHUNK_SIZE):
+            client.table('weekly_summaries').upsert(chunk, on_conflict='user_id,iso_week').execute()
+        rows_written += len(rows)
+
+    client.table('weekly_summary_state').upsert(
+        {"id": STATE_KEY, "watermark": until.isoformat()}, on_conflict='id'
+    ).execute()
+    logger.info(f"💾 {rows_written} résumés hebdomadaires écrits, watermark {until.isoformat()}")
+    return {"weeks": len(users_by_week), "rows": rows_written, "watermark": until.isoformat()}
+
+
+def load_materialized(client, user_ids, start_ts):
+    """Agrégats de la semaine commençant à `start_ts`, lus dans weekly_summaries"""
+    rows = fetch_in(
+        client, 'weekly_summaries',
+        'user_id, seances, exercises_count, total_reps, reps_by_exercise',
+        'user_id', user_ids,
+        extra_filters=lambda q: q.eq('iso_week', iso_week(start_ts)),
+        order='user_id'
+    )
+    return {
+        row['user_id']: {
+            "workouts_count": row.get('seances') or 0,
+            "exercises_count": row.get('exercises_count') or 0,
+            "total_reps": row.get('total_reps') or 0,
+            "reps_by_exercise": row.get('reps_by_exercise') or {},
+        }
+        for row in rows
+    }
+
+
+def get_weekly_history(client, user_id, weeks=8):
+    """Dernières semaines matérialisées d'un utilisateur, avec l'évolution d'une semaine à l'autre"""
+    r = client.table('weekly_summaries') \
+        .select('iso_week, week_start, seances, exercises_count, total_reps, reps_by_exercise') \
+        .eq('user_id', user_id) \
+        .order('week_start', desc=True) \
+        .limit(weeks) \
+        .execute()
+    history = list(reversed(r.data or []))
+    previous = None
+    for row in history:
+        row["delta"] = {
+            key: (row.get(key) or 0) - (previous.get(key) or 0) if previous else None
+            for key in ("seances", "exercises_count", "total_reps")
+        }
+        previous = row
+    return history
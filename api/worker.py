@@ -0,0 +1,26 @@
+"""Worker qui vide la file des campagnes en dehors des requêtes HTTP.
+
+Usage: python -m api.worker
+"""
+import asyncio
+import logging
+import os
+import time
+
+from api.index import drain_pending
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = float(os.getenv("CAMPAIGN_POLL_INTERVAL", "5"))
+
+
+def main():
+    logger.info("👷 Worker de campagnes démarré")
+    while True:
+        drained = asyncio.run(drain_pending())
+        if not drained:
+            time.sleep(POLL_INTERVAL)
+
+
+if __name__ == "__main__":
+    main()
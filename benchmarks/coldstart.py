@@ -0,0 +1,129 @@
+"""Mesure du démarrage à froid de api.index (ce que paie une invocation Vercel froide).
+
+Chaque mesure tourne dans un processus neuf lancé avec `python -X importtime` :
+durée cumulée de l'import de api.index, modules lourds effectivement chargés
+(supabase, httpx, dotenv...) et délai jusqu'à la réponse de GET /, appelé
+directement en ASGI (sans client HTTP qui chargerait lui-même httpx).
+
+Usage:
+    python -m benchmarks.coldstart
+    python -m benchmarks.coldstart --runs 10 --output coldstart.json
+    python -m benchmarks.coldstart --baseline coldstart.json   # affiche le gain (ou la régression)
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Dépendances dont le chargement à l'import trahit un import non différé
+HEAVY_MODULES = ("supabase", "postgrest", "supabase_auth", "realtime", "httpx", "dotenv", "email_validator")
+
+# Import puis GET / servi par l'application ASGI, dans le même processus froid
+PROBE = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+import api.index
+imported = time.perf_counter()
+
+async def get_root():
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": "/", "raw_path": b"/", "root_path": "", "query_string": b"",
+             "headers": [], "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80)}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await api.index.app(scope, receive, send)
+    return messages[0]["status"]
+
+status = asyncio.run(get_root())
+print(json.dumps({"import_ms": (imported - start) * 1000,
+                  "first_response_ms": (time.perf_counter() - start) * 1000, "status": status,
+                  "loaded": sorted(sys.modules)}))
+"""
+
+
+def parse_importtime(stderr):
+    """{module: (self µs, cumulé µs)} à partir de la sortie de -X importtime
+    (tentatives d'import en échec comprises)"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure_once():
+    env = dict(os.environ)
+    # Valeurs factices : le client Supabase ne doit de toute façon pas se connecter à l'import
+    env.setdefault("SUPABASE_URL", "https://coldstart.supabase.co")
+    env.setdefault("SUPABASE_SERVICE_ROLE_KEY", "coldstart")
+    # Conditions d'une fonction Vercel (pas de .env, clients paresseux)
+    env.setdefault("VERCEL", "1")
+    # Exigée sur Vercel (stockage partagé) ; la base n'est pas ouverte par GET /
+    env.setdefault("CAMPAIGN_DB_PATH", "/mnt/shared/campaigns.db")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        capture_output=True, text=True, env=env,
+    )
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr[-2000:])
+        raise RuntimeError("Import de api.index en échec")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["modules"] = parse_importtime(completed.stderr)
+    return result
+
+
+def measure(runs=5, top=15):
+    samples = [measure_once() for _ in range(runs)]
+    modules = samples[-1]["modules"]
+    loaded = set(samples[-1]["loaded"])
+    # Modules chargés par l'import de l'API (hors interpréteur), par coût propre
+    own = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)
+    return {
+        "runs": runs,
+        "import_ms": round(statistics.median(s["import_ms"] for s in samples), 1),
+        "first_response_ms": round(statistics.median(s["first_response_ms"] for s in samples), 1),
+        "modules_loaded": len(loaded),
+        "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in loaded],
+        "top_self_ms": {name: round(self_us / 1000, 2) for name, (self_us, _) in own[:top]},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Démarrage à froid de l'API")
+    parser.add_argument("--runs", type=int, default=5, help="processus froids mesurés (médiane)")
+    parser.add_argument("--top", type=int, default=15, help="modules les plus coûteux affichés")
+    parser.add_argument("--output", help="fichier JSON où écrire le résultat")
+    parser.add_argument("--baseline", help="résultat de référence (JSON) à comparer")
+    args = parser.parse_args(argv)
+
+    result = measure(args.runs, args.top)
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fichier:
+            fichier.write(output + "\n")
+
+    print(f"❄️ Import {result['import_ms']} ms, première réponse {result['first_response_ms']} ms, "
+          f"modules lourds : {', '.join(result['heavy_modules_loaded']) or 'aucun'}", file=sys.stderr)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fichier:
+            baseline = json.load(fichier)
+        for key in ("import_ms", "first_response_ms"):
+            delta = result[key] - baseline[key]
+            print(f"   {key} : {baseline[key]} → {result[key]} ms ({delta:+.1f} ms, "
+                  f"{delta / baseline[key]:+.0%})", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
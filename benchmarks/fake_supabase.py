@@ -0,0 +1,184 @@
+"""Client Supabase en mémoire pour les benchmarks.
+
+Imite le sous-ensemble de supabase-py utilisé par l'API (table().select()
+.eq/in_/gt/gte/lt/order/limit/range/upsert().execute() et rpc()) et compte
+chaque requête exécutée. La RPC weekly_user_aggregates est servie par
+api.aggregates.SQLiteAggregates, comme la fonction Postgres.
+"""
+import operator
+from datetime import datetime, timedelta, timezone
+
+from api.aggregates import RPC_NAME, SQLiteAggregates
+
+# Colonnes indexées : les filtres eq/in_ sur ces colonnes ne parcourent pas la table
+INDEXED_COLUMNS = {"id", "email", "user_id", "workout_id"}
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    def __init__(self, client, table):
+        self.client = client
+        self.table = table
+        self.columns = None
+        self.filters = []
+        self._order = None
+        self._limit = None
+        self._range = None
+        self._upsert = None
+
+    def select(self, columns, count=None):
+        self.columns = [column.strip() for column in columns.split(",")]
+        return self
+
+    def eq(self, column, value):
+        self.filters.append((column, operator.eq, value))
+        return self
+
+    def gt(self, column, value):
+        self.filters.append((column, operator.gt, value))
+        return self
+
+    def gte(self, column, value):
+        self.filters.append((column, operator.ge, value))
+        return self
+
+    def lt(self, column, value):
+        self.filters.append((column, operator.lt, value))
+        return self
+
+    def in_(self, column, values):
+        self.filters.append((column, "in", set(values)))
+        return self
+
+    def order(self, column, desc=False):
+        self._order = (column, desc)
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def range(self, start, end):
+        self._range = (start, end)
+        return self
+
+    def upsert(self, rows, on_conflict=None):
+        self._upsert = (rows if isinstance(rows, list) else [rows], on_conflict)
+        return self
+
+    def _candidates(self):
+        """Lignes candidates, via un index quand un filtre d'égalité le permet"""
+        for column, op, value in self.filters:
+            if column in INDEXED_COLUMNS and (op is operator.eq or op == "in"):
+                index = self.client.index(self.table, column)
+                values = value if op == "in" else (value,)
+                return [row for v in values for row in index.get(v, ())]
+        return self.client.tables.get(self.table, [])
+
+    def execute(self):
+        self.client.queries += 1
+        if self._upsert:
+            rows, on_conflict = self._upsert
+            self.client.upsert(self.table, rows, on_conflict.split(",") if on_conflict else ["id"])
+            return FakeResponse(rows)
+
+        rows = [row for row in self._candidates() if all(
+            row.get(column) in value if op == "in" else op(row.get(column), value)
+            for column, op, value in self.filters
+        )]
+        if self._order:
+            column, desc = self._order
+            rows.sort(key=lambda row: row.get(column), reverse=desc)
+        if self._range:
+            rows = rows[self._range[0]:self._range[1] + 1]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        if self.columns and self.columns != ["*"]:
+            rows = [{column: row.get(column) for column in self.columns} for row in rows]
+        return FakeResponse(rows)
+
+
+class FakeRPC:
+    def __init__(self, client, run):
+        self.client = client
+        self.run = run
+
+    def execute(self):
+        self.client.queries += 1
+        return FakeResponse(self.run())
+
+
+class FakeSupabase:
+    """Tables en mémoire (listes de dictionnaires) et compteur de requêtes"""
+
+    def __init__(self):
+        self.tables = {}
+        self.queries = 0
+        self._indexes = {}
+        self.aggregates = SQLiteAggregates()
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params):
+        if name != RPC_NAME:
+            raise ValueError(f"Fonction RPC inconnue : {name}")
+        call = self.aggregates.rpc(name, params)
+        return FakeRPC(self, lambda: call.execute().data)
+
+    def index(self, table, column):
+        key = (table, column)
+        if key not in self._indexes:
+            index = {}
+            for row in self.tables.get(table, []):
+                index.setdefault(row.get(column), []).append(row)
+            self._indexes[key] = index
+        return self._indexes[key]
+
+    def insert(self, table, rows):
+        self.tables.setdefault(table, []).extend(rows)
+        self._indexes = {key: value for key, value in self._indexes.items() if key[0] != table}
+        if table == "workouts":
+            self.aggregates.load(workouts=rows)
+        elif table == "exercises":
+            self.aggregates.load(exercises=rows)
+
+    def upsert(self, table, rows, keys):
+        existing = {tuple(row.get(k) for k in keys): row for row in self.tables.get(table, [])}
+        added = []
+        for row in rows:
+            current = existing.get(tuple(row.get(k) for k in keys))
+            if current is not None:
+                current.update(row)
+            else:
+                added.append(dict(row))
+        self.insert(table, added)
+
+
+def seed(users=100, workouts_per_user=3, exercises_per_workout=4, now=None):
+    """Client factice peuplé : séances réparties sur la semaine dernière"""
+    client = FakeSupabase()
+    now = now or datetime.now(timezone.utc)
+    last_week = (now - timedelta(days=now.weekday() + 7)).replace(hour=12, minute=0, second=0, microsecond=0)
+    user_rows, stats, workouts, exercises = [], [], [], []
+    for i in range(users):
+        user_id = f"u{i:06d}"
+        user_rows.append({"id": user_id, "email": f"user{i}@example.com", "full_name": f"User {i}"})
+        stats.append({"user_id": user_id, "total_workouts": 10, "total_exercises": 40,
+                      "last_workout_date": last_week.date().isoformat()})
+        for w in range(workouts_per_user):
+            workout_id = len(workouts) + 1
+            workouts.append({"id": workout_id, "user_id": user_id,
+                             "created_at": (last_week + timedelta(days=w % 7)).isoformat()})
+            for e in range(exercises_per_workout):
+                exercises.append({"id": len(exercises) + 1, "workout_id": workout_id,
+                                  "name": f"Exercice {e}", "reps": 10 + e})
+    client.insert("users", user_rows)
+    client.insert("user_workout_stats", stats)
+    client.insert("workouts", workouts)
+    client.insert("exercises", exercises)
+    return client
@@ -0,0 +1,95 @@
+"""API d'envoi par lots locale qui accepte et jette les messages (benchmarks).
+
+Imite l'endpoint attendu par api.transports.HTTPBatchTransport : POST JSON
+{"messages": [{"from", "to", "raw"}]}, réponse {"results": [...]} dans
+l'ordre des messages. Connexions HTTP/1.1 gardées ouvertes, un thread par
+connexion. Compte requêtes, connexions, messages (au total et par requête)
+et octets (messages décodés).
+"""
+import base64
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class HTTPSink:
+    """Usage : `with HTTPSink() as sink:` puis MAIL_TRANSPORT=http, HTTP_BATCH_URL=sink.url
+
+    `reject` : adresses refusées définitivement (résultat "rejected" pour ce message).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, reject=()):
+        self.host = host
+        self.port = port
+        self.reject = set(reject)
+        self.requests = 0
+        self.connections = 0
+        self.messages = 0
+        self.bytes = 0
+        # Nombre de messages de chaque requête, dans l'ordre de réception
+        self.batches = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/v1/messages/batch"
+
+    def _handler(self):
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with sink._lock:
+                    sink.connections += 1
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                results = []
+                size = 0
+                for message in payload["messages"]:
+                    size += len(base64.b64decode(message["raw"]))
+                    if sink.reject.intersection(message["to"]):
+                        results.append({"status": "rejected", "error": "550 adresse inconnue", "permanent": True})
+                    else:
+                        results.append({"status": "accepted"})
+                with sink._lock:
+                    sink.requests += 1
+                    sink.batches.append(len(results))
+                    sink.messages += len(results)
+                    sink.bytes += size
+                body = json.dumps({"results": results}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._server = ThreadingHTTPServer((self.host, self.port), self._handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="http-sink", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
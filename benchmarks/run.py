@@ -0,0 +1,340 @@
+"""Benchmark du parcours des campagnes (excuses et récapitulatif hebdomadaire).
+
+L'application FastAPI tourne dans le processus, branchée sur un serveur SMTP
+local (benchmarks.smtp_sink) et un Supabase en mémoire (benchmarks.fake_supabase)
+peuplé du volume demandé. Chaque scénario (campagne × nombre d'utilisateurs)
+s'exécute dans un processus neuf : caches froids et pic mémoire propre au scénario.
+
+Résultat (JSON) par scénario : emails/s, latence par email (p50/p99), nombre
+de requêtes Supabase, durée cumulée de chaque étape (api.metrics), octets
+reçus par le serveur SMTP et pic de RSS.
+
+Avec --transport http, les messages partent par lots (HTTP_BATCH_SIZE par
+POST) vers une API locale (benchmarks.http_sink) au lieu du serveur SMTP :
+le résultat compte alors requêtes HTTP, messages et octets reçus par l'API.
+Avec --transport mbox ou maildir, les campagnes sont lancées en dry-run :
+tout le parcours (lecture, agrégation, rendu, MIME) sans réseau, les messages
+écrits dans un fichier local ; "stages" donne le débit de chaque étape.
+
+Le scénario "transactional" envoie des emails POST /send/reset-password
+pendant qu'une campagne hebdomadaire (limitée à CAMPAIGN_RATE emails/s,
+comme face à un vrai fournisseur) tourne sur les mêmes utilisateurs : sa
+latence (p50/p99, de bout en bout) est comparée à l'objectif TRANSACTIONAL_P99_MS.
+
+Usage:
+    python -m benchmarks.run
+    python -m benchmarks.run --users 100,1000 --campaigns excuse --output bench.json
+    python -m benchmarks.run --baseline bench.json --tolerance 0.2   # CI : code 1 si régression
+    python -m benchmarks.run --campaigns excuse --transport http
+    python -m benchmarks.run --users 10000 --campaigns weekly --transport mbox   # profil CPU
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+CAMPAIGNS = ("excuse", "weekly", "transactional")
+TRANSPORTS = ("smtp", "http", "mbox", "maildir")
+# Transports des campagnes en dry-run (fichiers locaux)
+DRY_RUN_FORMATS = ("mbox", "maildir")
+DEFAULT_USERS = (100, 1000, 10000)
+API_KEY = "benchmark"
+# Scénario transactionnel : envois mesurés et débit de la campagne concurrente
+TRANSACTIONAL_REQUESTS = 200
+CAMPAIGN_RATE = 200
+# Transport http : un paquet de campagne = un lot (un POST)
+HTTP_BATCH_SIZE = 500
+
+
+def percentile(values, fraction):
+    """Percentile au rang le plus proche (None si aucune valeur)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def configure_environment(sink, db_path, rate=1000000, transport="smtp"):
+    """Variables lues à l'import de api.index : à poser avant de l'importer"""
+    if transport in DRY_RUN_FORMATS:
+        directory = os.path.dirname(db_path)
+        os.environ.update({
+            "DRY_RUN_FORMAT": transport,
+            "MBOX_PATH": os.path.join(directory, "dry-run.mbox"),
+            "MAILDIR_PATH": os.path.join(directory, "dry-run"),
+        })
+    if transport == "http":
+        os.environ.update({
+            "MAIL_TRANSPORT": "http",
+            "HTTP_BATCH_URL": sink.url,
+            "HTTP_BATCH_SIZE": str(HTTP_BATCH_SIZE),
+            "CAMPAIGN_CHUNK_SIZE": str(HTTP_BATCH_SIZE),
+        })
+        # Aucun envoi SMTP attendu : port fermé
+        smtp_host, smtp_port = "127.0.0.1", 9
+    else:
+        smtp_host, smtp_port = sink.host, sink.port
+    os.environ.update({
+        "API_KEY": API_KEY,
+        "SUPABASE_URL": "http://127.0.0.1:9",
+        "SUPABASE_SERVICE_ROLE_KEY": "benchmark",
+        "SMTP_SERVER": smtp_host,
+        "SMTP_PORT": str(smtp_port),
+        "SMTP_USER": "benchmark@serenity-fitness.local",
+        "SMTP_PASSWORD": "benchmark",
+        "SMTP_SECURITY": "none",
+        # Le débit mesuré est celui du code, pas celui du limiteur
+        "SMTP_RATE": str(rate),
+        "SMTP_MAX_RATE": str(rate),
+        # Les shards sont des processus séparés qui n'auraient pas le faux Supabase
+        "CAMPAIGN_SHARDS": "1",
+        "CAMPAIGN_DB_PATH": db_path,
+        # Campagne mesurée d'un bout à l'autre, sans reprise par le cron
+        "CAMPAIGN_TIME_BUDGET": "0",
+    })
+
+
+def sink_counters(sink, transport, directory=None):
+    """Ce qu'a reçu le serveur SMTP ou l'API d'envoi par lots (et le fichier du dry-run)"""
+    if transport == "http":
+        return {"http_requests": sink.requests, "http_messages": sink.messages,
+                "http_bytes": sink.bytes, "http_connections": sink.connections}
+    counters = {"smtp_messages": sink.messages, "smtp_bytes": sink.bytes, "smtp_connections": sink.connections}
+    if transport in DRY_RUN_FORMATS and directory:
+        counters["dry_run_bytes"] = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(directory)
+            for name in names if "dry-run" in os.path.join(root, name)
+        )
+    return counters
+
+
+def instrument(app_module, latencies):
+    """Chronomètre chaque envoi (rendu, MIME, remise) des campagnes"""
+    def timed(prepare_chunk):
+        def prepare(recipients, transport=None):
+            send_one = prepare_chunk(recipients, transport)
+
+            def timed_send(email):
+                start = time.perf_counter()
+                try:
+                    return send_one(email)
+                finally:
+                    latencies.append(time.perf_counter() - start)
+
+            send_batch = getattr(send_one, "send_batch", None)
+            if send_batch:
+                def timed_batch(emails):
+                    # Latence d'un email : sa part du lot
+                    start = time.perf_counter()
+                    try:
+                        return send_batch(emails)
+                    finally:
+                        share = (time.perf_counter() - start) / max(len(emails), 1)
+                        latencies.extend([share] * len(emails))
+                timed_send.send_batch = timed_batch
+            return timed_send
+        return prepare
+
+    for kind, prepare_chunk in list(app_module.CAMPAIGN_KINDS.items()):
+        app_module.CAMPAIGN_KINDS[kind] = timed(prepare_chunk)
+
+
+def run_scenario(campaign, users, workouts_per_user=3, exercises_per_workout=4, transport="smtp"):
+    """Exécute une campagne complète dans ce processus et retourne ses mesures"""
+    from benchmarks.fake_supabase import seed
+    from benchmarks.http_sink import HTTPSink
+    from benchmarks.smtp_sink import SMTPSink
+
+    with (HTTPSink() if transport == "http" else SMTPSink()) as sink, tempfile.TemporaryDirectory() as directory:
+        rate = CAMPAIGN_RATE if campaign == "transactional" else 1000000
+        configure_environment(sink, os.path.join(directory, "campaigns.db"), rate, transport)
+        from fastapi.testclient import TestClient
+
+        import api.index as app_module
+        from api import metrics
+
+        client = seed(users, workouts_per_user, exercises_per_workout)
+        app_module.resources.supabase = metrics.InstrumentedClient(client)
+        latencies = []
+        instrument(app_module, latencies)
+        client.queries = 0
+
+        dry_run = transport in DRY_RUN_FORMATS
+        start = time.perf_counter()
+        if campaign == "transactional":
+            return run_transactional(app_module, client, sink, users, latencies, transport)
+        response = TestClient(app_module.app).post(f"/send-{campaign}-email", headers={"x-api-key": API_KEY},
+                                                   params={"dry_run": dry_run})
+        response.raise_for_status()
+        job_id = response.json()["job_id"]
+        elapsed = time.perf_counter() - start
+
+        report = app_module.get_campaign_store().report(job_id, failures_limit=0)
+        return {
+            "campaign": campaign,
+            "users": users,
+            "transport": transport,
+            "sent": report["sent"],
+            "failed": report["failed"],
+            "elapsed_seconds": round(elapsed, 3),
+            "emails_per_second": round(report["sent"] / elapsed, 2) if elapsed else None,
+            "latency_ms": {
+                "p50": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+                "p99": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+            },
+            "queries": client.queries,
+            "stages": {name: metrics.stage_seconds.summary(name) for name in metrics.STAGES},
+            **sink_counters(sink, transport, directory),
+            # ru_maxrss est en kilo-octets sous Linux
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+def run_transactional(app_module, client, sink, users, campaign_latencies, transport="smtp"):
+    """Emails transactionnels envoyés un par un pendant une campagne hebdomadaire"""
+    from fastapi import BackgroundTasks
+    from fastapi.testclient import TestClient
+
+    from api import metrics
+
+    latencies = []
+    # Le lifespan ouvre d'avance la session SMTP réservée
+    with TestClient(app_module.app) as http:
+        tasks = BackgroundTasks()
+        job_id = app_module.enqueue_campaign("weekly", app_module.iter_recipients(), tasks)["job_id"]
+        background = threading.Thread(target=lambda: asyncio.run(tasks()), name="weekly-campaign")
+        background.start()
+        start = time.perf_counter()
+        for i in range(TRANSACTIONAL_REQUESTS):
+            sent_at = time.perf_counter()
+            response = http.post(
+                "/send/reset-password",
+                headers={"x-api-key": API_KEY},
+                json={"email": f"user{i % max(users, 1)}@example.com",
+                      "confirmation_url": f"https://serenity-fitness.local/verify?token={i}&type=recovery"},
+            )
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - sent_at)
+        elapsed = time.perf_counter() - start
+        during_campaign = background.is_alive()
+        background.join()
+
+    report = app_module.get_campaign_store().report(job_id, failures_limit=0)
+    p99 = percentile(latencies, 0.99) * 1000
+    return {
+        "campaign": "transactional",
+        "users": users,
+        "transport": transport,
+        "sent": len(latencies),
+        "failed": 0,
+        "elapsed_seconds": round(elapsed, 3),
+        "emails_per_second": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p99": round(p99, 3),
+        },
+        "latency_target_ms": app_module.settings.transactional_p99_ms,
+        "within_target": p99 <= app_module.settings.transactional_p99_ms,
+        # Faux si la campagne s'est terminée avant le dernier envoi transactionnel
+        "during_campaign": during_campaign,
+        "campaign_sent": report["sent"],
+        "campaign_latency_p99_ms": round(percentile(campaign_latencies, 0.99) * 1000, 3)
+        if campaign_latencies else None,
+        "queries": client.queries,
+        "stages": {name: metrics.stage_seconds.summary(name) for name in metrics.STAGES},
+        **sink_counters(sink, transport),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def run_isolated(campaign, users, args):
+    """Lance un scénario dans un processus neuf et lit son résultat JSON"""
+    command = [
+        sys.executable, "-m", "benchmarks.run", "--scenario", campaign, "--users", str(users),
+        "--workouts", str(args.workouts), "--exercises", str(args.exercises), "--log-level", args.log_level,
+        "--transport", args.transport,
+    ]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+        raise RuntimeError(f"Scénario {campaign} / {users} utilisateurs en échec")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def regressions(results, baseline, tolerance):
+    """Scénarios plus lents (au-delà de `tolerance`) ou plus bavards que la référence"""
+    reference = {(r["campaign"], r["users"], r.get("transport", "smtp")): r for r in baseline}
+    found = []
+    for result in results:
+        previous = reference.get((result["campaign"], result["users"], result["transport"]))
+        if not previous:
+            continue
+        if result["emails_per_second"] < previous["emails_per_second"] * (1 - tolerance):
+            found.append(f"{result['campaign']}/{result['users']} : {result['emails_per_second']} emails/s "
+                         f"(référence {previous['emails_per_second']})")
+        if result["campaign"] == "transactional" and not result["within_target"]:
+            found.append(f"transactional/{result['users']} : p99 {result['latency_ms']['p99']} ms "
+                         f"(objectif {result['latency_target_ms']} ms)")
+        if result["queries"] > previous["queries"]:
+            found.append(f"{result['campaign']}/{result['users']} : {result['queries']} requêtes "
+                         f"(référence {previous['queries']})")
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark des campagnes d'emails")
+    parser.add_argument("--users", default=",".join(map(str, DEFAULT_USERS)),
+                        help="nombres d'utilisateurs, séparés par des virgules")
+    parser.add_argument("--campaigns", default=",".join(CAMPAIGNS), help="excuse, weekly, transactional")
+    parser.add_argument("--workouts", type=int, default=3, help="séances par utilisateur")
+    parser.add_argument("--exercises", type=int, default=4, help="exercices par séance")
+    parser.add_argument("--output", help="fichier JSON où écrire les résultats")
+    parser.add_argument("--baseline", help="résultats de référence (JSON) à comparer")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="baisse de débit tolérée")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="smtp",
+                        help="remise par SMTP, par lots HTTP (benchmarks.http_sink) ou dry-run mbox/maildir")
+    parser.add_argument("--log-level", default="WARNING", help="niveau des logs de l'API pendant la mesure")
+    parser.add_argument("--scenario", choices=CAMPAIGNS, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.scenario:
+        # Processus enfant : un seul scénario, résultat sur la dernière ligne de stdout
+        logging.basicConfig(level=args.log_level)
+        logging.disable(logging.getLevelName(args.log_level) - 1)
+        result = run_scenario(args.scenario, int(args.users), args.workouts, args.exercises, args.transport)
+        print(json.dumps(result))
+        return 0
+
+    results = []
+    for campaign in args.campaigns.split(","):
+        for users in args.users.split(","):
+            result = run_isolated(campaign.strip(), int(users), args)
+            print(f"⏱️ {campaign} / {users} utilisateurs : {result['emails_per_second']} emails/s, "
+                  f"p99 {result['latency_ms']['p99']} ms, {result['queries']} requêtes", file=sys.stderr)
+            results.append(result)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fichier:
+            fichier.write(output + "\n")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as fichier:
+            found = regressions(results, json.load(fichier), args.tolerance)
+        for message in found:
+            print(f"❌ Régression : {message}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
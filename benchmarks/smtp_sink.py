@@ -0,0 +1,130 @@
+"""Serveur SMTP local qui accepte et jette les messages (benchmarks, tests).
+
+Juste assez du protocole pour smtplib (EHLO, MAIL, RCPT, DATA, RSET, NOOP,
+QUIT), sans TLS, dans une boucle asyncio sur un thread dédié. Compte les
+messages, les octets, les NOOP et les destinataires des messages acceptés.
+"""
+import asyncio
+import re
+import threading
+
+RCPT_ADDRESS = re.compile(rb"<([^>]*)>")
+
+
+class SMTPSink:
+    """Usage : `with SMTPSink() as sink:` puis SMTP_SERVER=sink.host, SMTP_PORT=sink.port
+
+    `auth_error` : AUTH annoncé puis toujours refusé (535, identifiants invalides).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, auth_error=False):
+        self.host = host
+        self.port = port
+        self.auth_error = auth_error
+        self.messages = 0
+        self.bytes = 0
+        self.connections = 0
+        self.noops = 0
+        # Destinataires des messages acceptés, dans l'ordre de réception
+        self.recipients = []
+        self._writers = set()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._writers.add(writer)
+        writer.write(b"220 sink ESMTP\r\n")
+        recipients = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line[:4].upper()
+                if command == b"EHLO":
+                    auth = b"250-AUTH PLAIN LOGIN\r\n" if self.auth_error else b""
+                    writer.write(b"250-sink\r\n250-8BITMIME\r\n" + auth + b"250 PIPELINING\r\n")
+                elif command == b"AUTH":
+                    writer.write(b"535 5.7.8 Authentication credentials invalid\r\n")
+                elif command == b"RCPT":
+                    match = RCPT_ADDRESS.search(line)
+                    recipients.append(match.group(1).decode() if match else "")
+                    writer.write(b"250 OK\r\n")
+                elif command in (b"MAIL", b"RSET"):
+                    recipients = []
+                    writer.write(b"250 OK\r\n")
+                elif command == b"NOOP":
+                    self.noops += 1
+                    writer.write(b"250 OK\r\n")
+                elif command == b"DATA":
+                    writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                    await writer.drain()
+                    size = 0
+                    while True:
+                        data_line = await reader.readline()
+                        if not data_line or data_line == b".\r\n":
+                            break
+                        size += len(data_line)
+                    self.messages += 1
+                    self.bytes += size
+                    self.recipients.extend(recipients)
+                    recipients = []
+                    writer.write(b"250 OK\r\n")
+                elif command == b"QUIT":
+                    writer.write(b"221 Bye\r\n")
+                    await writer.drain()
+                    break
+                else:
+                    # HELO
+                    writer.write(b"250 OK\r\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port, limit=2 ** 20)
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+        # Sessions encore ouvertes à l'arrêt : fermées proprement avant la boucle
+        tasks = asyncio.all_tasks(self._loop)
+        for task in tasks:
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self._server.close()
+        self._loop.run_until_complete(self._server.wait_closed())
+        self._loop.close()
+
+    def disconnect(self):
+        """Coupe toutes les sessions ouvertes côté serveur (redémarrage, timeout d'inactivité)"""
+        async def close_all():
+            for writer in list(self._writers):
+                writer.close()
+        asyncio.run_coroutine_threadsafe(close_all(), self._loop).result()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="smtp-sink", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
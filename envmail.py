@@ -1,6 +1,6 @@
 #uvicorn envmail:app --reload
-from pydantic import BaseModel, EmailStr
 import smtplib
+from email import policy
 from email.message import EmailMessage
 import os
 from fastapi import Depends, Header, HTTPException
@@ -14,7 +14,14 @@ from datetime import datetime, timedelta
 from fastapi import FastAPI, HTTPException
 from fastapi.responses import JSONResponse
 
-API_KEY = os.getenv("API_KEY")
+from api.resources import Resources
+from api.settings import Settings
+
+# Même configuration et même transport (MAIL_TRANSPORT) que api.index
+settings = Settings.from_env()
+resources = Resources(settings)
+
+API_KEY = settings.api_key
 
 app = FastAPI(
     title="API Email Serenity Fitness",
@@ -163,14 +170,10 @@ def charger_template_html(nom_fichier, variables=None):
 
 async def envmail(email):
     try:
-        SMTP_SERVER = os.getenv("SMTP_SERVER")
-        SMTP_PORT = int(os.getenv("SMTP_PORT"))
-        SMTP_USER = os.getenv("SMTP_USER")
-        SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
-        if not SMTP_PASSWORD:
+        if not settings.transport_configured:
             raise HTTPException(
                 status_code=500, 
-                detail="Configuration SMTP incomplète : mot de passe manquant"
+                detail="Configuration d'envoi incomplète (MAIL_TRANSPORT)"
             )
         datadb = getclientbyid(email)
         if not datadb:
@@ -202,13 +205,12 @@ async def envmail(email):
             return {"error" : "Aucune template"}
         msg = EmailMessage()
         msg['Subject'] = "Votre récapitulatif de la semaine"
-        msg['From'] = SMTP_USER
+        msg['From'] = settings.mail_from
         msg['To'] = email
         msg.add_alternative(contenue_html, subtype="html")
 
-        with smtplib.SMTP_SSL(SMTP_SERVER, SMTP_PORT) as server:
-            server.login(SMTP_USER, SMTP_PASSWORD)
-            server.send_message(msg)
+        # Remise par le transport partagé (fins de ligne CRLF, comme smtplib.send_message)
+        resources.transport.send(settings.mail_from, email, msg.as_bytes(policy=policy.SMTP))
         print("Le message c'est envoyé.")
         return {
             "message": "succès"
@@ -0,0 +1,58 @@
+-- Agrégats hebdomadaires calculés côté Postgres (appelés via supabase.rpc).
+-- Seuls les totaux par utilisateur transitent sur le réseau, au lieu de
+-- toutes les lignes de `exercises`.
+--
+-- À exécuter dans l'éditeur SQL de Supabase. Les utilisateurs sans séance
+-- sur la période ne sont pas retournés (l'API les compte à 0).
+
+create or replace function public.weekly_user_aggregates(
+    user_ids uuid[],
+    start_ts timestamptz,
+    end_ts timestamptz
+)
+returns table (
+    user_id uuid,
+    workouts_count bigint,
+    exercises_count bigint,
+    total_reps bigint,
+    reps_by_exercise jsonb
+)
+language sql
+stable
+as $$
+    with w as (
+        select id, user_id
+        from public.workouts
+        where user_id = any(user_ids)
+          and created_at >= start_ts
+          and created_at < end_ts
+    ),
+    wc as (
+        select user_id, count(*) as workouts_count
+        from w
+        group by user_id
+    ),
+    per_ex as (
+        select w.user_id,
+               coalesce(e.name, 'Inconnu') as name,
+               count(*) as n,
+               sum(coalesce(e.reps, 0)) as reps
+        from w
+        join public.exercises e on e.workout_id = w.id
+        group by w.user_id, coalesce(e.name, 'Inconnu')
+    )
+    select wc.user_id,
+           wc.workouts_count,
+           coalesce(sum(p.n), 0)::bigint as exercises_count,
+           coalesce(sum(p.reps), 0)::bigint as total_reps,
+           coalesce(jsonb_object_agg(p.name, p.reps) filter (where p.name is not null), '{}'::jsonb)
+    from wc
+    left join per_ex p on p.user_id = wc.user_id
+    group by wc.user_id, wc.workouts_count;
+$$;
+
+grant execute on function public.weekly_user_aggregates(uuid[], timestamptz, timestamptz) to service_role;
+
+-- Index utilisés par la fonction
+create index if not exists workouts_user_id_created_at_idx on public.workouts (user_id, created_at);
+create index if not exists exercises_workout_id_idx on public.exercises (workout_id);
@@ -0,0 +1,23 @@
+-- Résumés hebdomadaires matérialisés : une ligne par (utilisateur, semaine ISO).
+-- Remplie par POST /weekly-summaries/refresh (rafraîchissement incrémental),
+-- lue par les campagnes hebdomadaires et par /users/{id}/weekly-history.
+
+create table if not exists public.weekly_summaries (
+    user_id uuid not null,
+    iso_week text not null,              -- ex. '2026-W41'
+    week_start timestamptz not null,
+    seances integer not null default 0,
+    exercises_count integer not null default 0,
+    total_reps integer not null default 0,
+    reps_by_exercise jsonb not null default '{}'::jsonb,
+    refreshed_at timestamptz not null default now(),
+    primary key (user_id, iso_week)
+);
+
+create index if not exists weekly_summaries_iso_week_idx on public.weekly_summaries (iso_week);
+
+-- Watermark : toutes les séances créées avant cette date sont matérialisées
+create table if not exists public.weekly_summary_state (
+    id text primary key,
+    watermark timestamptz not null
+);
@@ -5,6 +5,7 @@ Usage: python test_api.py
 
 import requests
 import os
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,6 +13,8 @@ load_dotenv()
 # Configuration
 API_URL = "http://127.0.0.1:8000"  # URL locale
 API_KEY = os.getenv("API_KEY")
+# Durée maximale du suivi d'une campagne (secondes)
+CAMPAIGN_TIMEOUT = 300
 
 def test_root():
     """Test de la route racine"""
@@ -101,19 +104,31 @@ def test_send_email_with_key():
     
     print(f"Status: {response.status_code}")
     data = response.json()
+    print(f"  - Campagne: {data.get('job_id')} ({data.get('status')})")
+    assert response.status_code == 202
+    
+    # Suivi de la campagne jusqu'à la fin
+    deadline = time.monotonic() + CAMPAIGN_TIMEOUT
+    while True:
+        data = requests.get(f"{API_URL}/campaigns/{data['job_id']}", headers=headers, timeout=30).json()
+        if data.get('status') in ('done', 'failed'):
+            break
+        assert time.monotonic() < deadline, f"Campagne non terminée après {CAMPAIGN_TIMEOUT} s : {data}"
+        time.sleep(1)
+    
     print(f"\n📊 Résultats:")
-    print(f"  - Succès: {data.get('success')}")
-    print(f"  - Message: {data.get('message')}")
+    print(f"  - Statut: {data.get('status')}")
     print(f"  - Envoyés: {data.get('sent')}")
     print(f"  - Échecs: {data.get('failed')}")
     print(f"  - Total: {data.get('total')}")
+    print(f"  - Débit: {data.get('emails_per_second')} emails/s")
     
     if data.get('failed_emails'):
         print(f"\n❌ Emails en échec:")
         for failed in data['failed_emails']:
             print(f"  - {failed.get('email')}: {failed.get('error')}")
     
-    assert response.status_code == 200
+    assert data.get('status') == 'done'
     print("\n✅ Test réussi!")
 
 if __name__ == "__main__":
@@ -0,0 +1,28 @@
+"""Fixtures partagées : serveurs locaux de benchmarks/ (aucun envoi réel)"""
+import os
+import tempfile
+
+import pytest
+
+from benchmarks.smtp_sink import SMTPSink
+
+# api.index lit sa configuration à l'import : environnement de test fixé avant,
+# messages écrits dans un mbox temporaire
+TEST_DIR = tempfile.mkdtemp(prefix="api-mail-tests-")
+os.environ.pop("VERCEL", None)
+os.environ.update({
+    "API_KEY": "test-key",
+    "MAIL_TRANSPORT": "mbox",
+    "MAIL_FROM": "no-reply@example.com",
+    "MBOX_PATH": os.path.join(TEST_DIR, "mail.mbox"),
+    "MAILDIR_PATH": os.path.join(TEST_DIR, "maildir"),
+    "CAMPAIGN_DB_PATH": os.path.join(TEST_DIR, "campaigns.db"),
+    "LAZY_CLIENTS": "1",
+})
+
+
+@pytest.fixture
+def sink():
+    """Serveur SMTP local qui accepte tous les messages"""
+    with SMTPSink() as sink:
+        yield sink
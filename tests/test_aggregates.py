@@ -0,0 +1,62 @@
+"""Agrégats hebdomadaires : RPC (SQLiteAggregates) et agrégation Python identiques"""
+from datetime import datetime, timedelta
+
+from api.aggregates import SQLiteAggregates, fetch_weekly_aggregates
+from api.bulk_loader import aggregate_rows
+from api.index import week_bounds_previous
+from benchmarks.fake_supabase import FakeSupabase
+
+
+def fixtures(start_prev, start_curr):
+    start, end = datetime.fromisoformat(start_prev), datetime.fromisoformat(start_curr)
+    at = lambda moment: moment.isoformat()
+    workouts = [
+        {"id": 1, "user_id": "alice", "created_at": at(start)},                        # borne incluse
+        {"id": 2, "user_id": "alice", "created_at": at(start + timedelta(days=3))},
+        {"id": 3, "user_id": "alice", "created_at": at(end)},                          # borne exclue
+        {"id": 4, "user_id": "alice", "created_at": at(start - timedelta(seconds=1))},  # semaine d'avant
+        {"id": 5, "user_id": "bob", "created_at": at(end - timedelta(seconds=1))},
+        {"id": 6, "user_id": "bob", "created_at": at(start + timedelta(days=1))},       # sans exercice
+        {"id": 7, "user_id": "carol", "created_at": at(start + timedelta(days=2))},     # non demandée
+        {"id": 8, "user_id": "dave", "created_at": at(start - timedelta(days=2))},      # rien dans la période
+    ]
+    exercises = [
+        {"id": 1, "workout_id": 1, "name": "Pompes", "reps": 20},
+        {"id": 2, "workout_id": 1, "name": "Squats", "reps": 15},
+        {"id": 3, "workout_id": 2, "name": "Pompes", "reps": 12},
+        {"id": 4, "workout_id": 2, "name": None, "reps": 8},
+        {"id": 5, "workout_id": 2, "name": "Gainage", "reps": None},
+        {"id": 6, "workout_id": 3, "name": "Pompes", "reps": 100},
+        {"id": 7, "workout_id": 4, "name": "Pompes", "reps": 100},
+        {"id": 8, "workout_id": 5, "name": "Tractions", "reps": 6},
+        {"id": 9, "workout_id": 7, "name": "Pompes", "reps": 50},
+        {"id": 10, "workout_id": 8, "name": "Squats", "reps": 30},
+    ]
+    return workouts, exercises
+
+
+def test_rpc_matches_python_aggregation():
+    start_prev, start_curr = week_bounds_previous()
+    workouts, exercises = fixtures(start_prev, start_curr)
+    rpc = SQLiteAggregates()
+    rpc.load(workouts, exercises)
+    tables = FakeSupabase()
+    tables.tables = {"workouts": workouts, "exercises": exercises}
+    user_ids = ["alice", "bob", "dave"]
+
+    from_rpc = fetch_weekly_aggregates(rpc, user_ids, start_prev, start_curr)
+    from_rows = aggregate_rows(tables, user_ids, start_prev, start_curr)
+
+    assert from_rpc == from_rows
+    assert from_rpc["alice"] == {
+        "workouts_count": 2,
+        "exercises_count": 5,
+        "total_reps": 55,
+        "reps_by_exercise": {"Pompes": 32, "Squats": 15, "Inconnu": 8, "Gainage": 0},
+    }
+    assert from_rpc["bob"] == {
+        "workouts_count": 2, "exercises_count": 1, "total_reps": 6, "reps_by_exercise": {"Tractions": 6},
+    }
+    # Sans séance dans la période : absent (EMPTY_AGGREGATE côté appelant)
+    assert "dave" not in from_rpc and "carol" not in from_rpc
+    assert rpc.calls == 1
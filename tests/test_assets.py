@@ -0,0 +1,54 @@
+"""Minification du logo SVG : nombres arrondis dans la tolérance, transformations intactes"""
+import os
+import re
+
+import pytest
+
+from api.assets import SVG_PRECISION, minify_svg
+
+LOGO = os.path.join("templates", "logo.svg")
+# Nombres SVG, y compris collés (« 0.5.5 », « 1-2 ») et en notation scientifique
+NUMBER = re.compile(r"-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?")
+TRANSFORM = re.compile(r'[\w:-]*[tT]ransform="[^"]*"')
+
+
+@pytest.fixture(scope="module")
+def logo():
+    with open(LOGO, encoding="utf-8") as fichier:
+        return fichier.read()
+
+
+def numbers(svg):
+    return [float(value) for value in NUMBER.findall(svg)]
+
+
+def assert_within_tolerance(source):
+    exact, rounded = minify_svg(source, precision=None), minify_svg(source)
+    expected, actual = numbers(exact), numbers(rounded)
+    assert len(actual) == len(expected)
+    tolerance = 0.5 * 10 ** -SVG_PRECISION + 1e-9
+    for original, minified in zip(expected, actual):
+        assert abs(original - minified) <= tolerance, (original, minified)
+    return exact, rounded
+
+
+def test_logo_numbers_rounded_within_tolerance(logo):
+    exact, rounded = assert_within_tolerance(logo)
+    assert len(rounded) < len(exact) < len(logo)
+
+
+def test_logo_transforms_kept_exactly(logo):
+    rounded = minify_svg(logo)
+    assert TRANSFORM.findall(rounded) == TRANSFORM.findall(minify_svg(logo, precision=None))
+    assert 'transform="matrix(-0.92178394,-0.38770398,-0.4494326,0.89331424,0,5.2041088)"' in rounded
+
+
+def test_small_values_rounded_not_truncated():
+    rounded = minify_svg('<path d="m 0.0049,0.0051 1.99999,-2.1234" />')
+    assert rounded == '<path d="m 0.005,0.005 2,-2.123" />'
+
+
+def test_packed_path_numbers_stay_separate():
+    source = '<path d="m1.0004.5.25-.0001.12345e-2 0.5.5" />'
+    assert_within_tolerance(source)
+    assert minify_svg(source) == '<path d="m1 0.5 0.25-0 0.001 0.5 0.5" />'
@@ -0,0 +1,100 @@
+"""TTLCache et @cached : expiration, éviction LRU, compteurs et clés"""
+import pytest
+
+from api.cache import TTLCache, cached
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(ttl=10, clock=clock)
+    cache.set("a", 1)
+    clock.now += 9.9
+    assert cache.get("a") == 1
+    clock.now += 0.1
+    assert cache.get("a", None) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_evicted_first(clock):
+    cache = TTLCache(maxsize=3, clock=clock)
+    for key in "abc":
+        cache.set(key, key)
+    # Lecture de "a" : "b" devient la plus ancienne
+    assert cache.get("a") == "a"
+    cache.set("d", "d")
+    assert cache.get("b", None) is None
+    cache.set("e", "e")
+    assert cache.get("c", None) is None
+    assert [cache.get(key) for key in "ade"] == ["a", "d", "e"]
+    assert cache.stats()["evictions"] == 2
+
+
+def test_hit_and_miss_counters(clock):
+    cache = TTLCache(clock=clock)
+    cache.get("a", None)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("a")
+    assert cache.stats() == {"size": 1, "maxsize": 4096, "ttl": 300.0, "hits": 2, "misses": 1,
+                             "evictions": 0, "hit_rate": 0.6667}
+
+
+def test_key_is_function_and_arguments(clock):
+    cache = TTLCache(clock=clock)
+    calls = []
+
+    @cached(cache)
+    def fetch_workout_ids(user_id, start_prev, start_curr):
+        calls.append((user_id, start_prev))
+        return [f"{user_id}:{start_prev}"]
+
+    @cached(cache)
+    def fetch_sessions(user_id, start_prev, start_curr):
+        calls.append(("sessions", user_id))
+        return {"user_id": user_id}
+
+    week = ("2026-10-05", "2026-10-12")
+    previous_week = ("2026-09-28", "2026-10-05")
+    assert fetch_workout_ids("u1", *week) == ["u1:2026-10-05"]
+    assert fetch_workout_ids("u1", *week) == ["u1:2026-10-05"]
+    fetch_workout_ids("u2", *week)
+    fetch_workout_ids("u1", *previous_week)
+    # Même arguments, autre fonction : autre clé
+    fetch_sessions("u1", *week)
+    assert len(calls) == 4
+    assert cache.stats()["hits"] == 1
+
+
+def test_none_and_exceptions_not_cached(clock):
+    cache = TTLCache(clock=clock)
+    results = [None, {"id": "u1"}]
+    calls = []
+
+    @cached(cache)
+    def fetch_client(email):
+        calls.append(email)
+        if email == "boom@example.com":
+            raise ConnectionError("reset")
+        return results.pop(0)
+
+    # Utilisateur pas encore créé : introuvable, puis trouvé à l'appel suivant
+    assert fetch_client("new@example.com") is None
+    assert fetch_client("new@example.com") == {"id": "u1"}
+    assert fetch_client("new@example.com") == {"id": "u1"}
+    assert calls == ["new@example.com"] * 2
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            fetch_client("boom@example.com")
+    assert calls.count("boom@example.com") == 2
@@ -0,0 +1,81 @@
+"""Reprise d'une campagne interrompue et emplacement de la base des campagnes"""
+import asyncio
+import threading
+
+import pytest
+
+from api.campaign_store import DONE, CampaignStore, default_db_path
+from api.campaigns import drain_campaign
+from api.smtp_pool import SMTPPool
+
+MESSAGE = b"Subject: test\r\n\r\nbonjour\r\n"
+EMAILS = [f"user{n}@example.com" for n in range(25)]
+
+
+def sender(pool, on_sent=None):
+    def prepare(recipients):
+        def send_one(email):
+            pool.sendmail("from@example.com", [email], MESSAGE)
+            if on_sent:
+                on_sent()
+            return {"message_id": None, "size": len(MESSAGE)}
+        return send_one
+    return prepare
+
+
+def test_resume_after_interruption_sends_each_recipient_once(tmp_path, sink):
+    store = CampaignStore(str(tmp_path / "campaigns.db"))
+    campaign_id, _ = store.create_campaign("excuse", EMAILS)
+    pool = SMTPPool(sink.host, sink.port, size=2, security="none")
+
+    async def interrupted():
+        loop = asyncio.get_running_loop()
+        task = None
+        sent = 0
+        lock = threading.Lock()
+
+        def on_sent():
+            nonlocal sent
+            with lock:
+                sent += 1
+                # 13e envoi : au milieu du deuxième paquet de 10
+                if sent == 13:
+                    loop.call_soon_threadsafe(task.cancel)
+
+        task = asyncio.create_task(drain_campaign(
+            store, campaign_id, sender(pool, on_sent), chunk_size=10, concurrency=2, owner="worker"
+        ))
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert asyncio.run(interrupted())
+    # Premier paquet sauvegardé, le deuxième interrompu : ses envois sont au registre
+    assert store.get(campaign_id)["cursor"] == 10
+    interrupted_count = len(sink.recipients)
+    assert 13 <= interrupted_count < 25
+    assert len(store.delivered(campaign_id, EMAILS)) == interrupted_count
+
+    finished = asyncio.run(drain_campaign(
+        store, campaign_id, sender(pool), chunk_size=10, concurrency=2, owner="worker"
+    ))
+    pool.close()
+    assert finished is True
+    assert sorted(sink.recipients) == sorted(EMAILS)
+    report = store.report(campaign_id)
+    assert report["status"] == DONE
+    assert report["sent"] == 25 and report["failed"] == 0
+
+
+def test_vercel_requires_shared_campaign_db(monkeypatch):
+    monkeypatch.setenv("VERCEL", "1")
+    monkeypatch.delenv("CAMPAIGN_DB_PATH", raising=False)
+    with pytest.raises(RuntimeError):
+        default_db_path()
+    monkeypatch.setenv("CAMPAIGN_DB_PATH", "/tmp/campaigns.db")
+    with pytest.raises(RuntimeError):
+        default_db_path()
+    monkeypatch.setenv("CAMPAIGN_DB_PATH", "/mnt/shared/campaigns.db")
+    assert default_db_path() == "/mnt/shared/campaigns.db"
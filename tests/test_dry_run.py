@@ -0,0 +1,62 @@
+"""Campagne hebdomadaire en dry-run : Supabase factice, messages écrits dans un mbox"""
+import dataclasses
+import logging
+import mailbox
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import index
+from api.resources import Resources
+from benchmarks.fake_supabase import seed
+
+HEADERS = {"x-api-key": "test-key"}
+USERS = 12
+
+
+@pytest.fixture
+def dry_run(monkeypatch, tmp_path, sink):
+    # Transport réel sur le serveur SMTP local : le dry-run ne doit jamais s'en servir
+    settings = dataclasses.replace(
+        index.settings,
+        mail_transport="smtp",
+        smtp_server=sink.host,
+        smtp_port=sink.port,
+        smtp_user="user",
+        smtp_password="secret",
+        smtp_security="none",
+        dry_run_format="mbox",
+        mbox_path=str(tmp_path / "dry-run.mbox"),
+    )
+    resources = Resources(settings)
+    resources.supabase = seed(users=USERS, workouts_per_user=2)
+    monkeypatch.setattr(index, "settings", settings)
+    monkeypatch.setattr(index, "resources", resources)
+    monkeypatch.setattr(index, "WEEKLY_TEST_RECIPIENT", None)
+    yield settings
+    resources.close()
+
+
+def test_weekly_dry_run_writes_one_message_per_recipient(dry_run, sink, caplog):
+    with caplog.at_level(logging.INFO, logger=index.logger.name), TestClient(index.app) as client:
+        response = client.post("/send-weekly-email", headers=HEADERS, params={"dry_run": True})
+        assert response.status_code == 202
+        job_id = response.json()["job_id"]
+        report = client.get(f"/campaigns/{job_id}", headers=HEADERS).json()
+
+    assert report["dry_run"] is True
+    assert (report["sent"], report["failed"], report["total"]) == (USERS, 0, USERS)
+    recipients = sorted(message["To"] for message in mailbox.mbox(dry_run.mbox_path))
+    assert recipients == sorted(f"user{i}@example.com" for i in range(USERS))
+
+    # Rien n'a atteint le serveur SMTP
+    assert (sink.connections, sink.messages) == (0, 0)
+    assert "smtp_send" not in report["stages"]
+
+    # Débit de chaque étape : dans le rapport et dans le résumé journalisé
+    for name in ("aggregation", "render", "mime_build", "transport_send"):
+        assert report["stages"][name]["per_second"] > 0
+    assert report["stages"]["mime_build"]["count"] == USERS
+    logged = caplog.text
+    assert dry_run.mbox_path in logged
+    assert "⏱️ render" in logged and "⏱️ mime_build" in logged
@@ -0,0 +1,66 @@
+"""HTTPBatchTransport contre l'API d'envoi par lots locale (benchmarks/http_sink.py)"""
+import pytest
+
+from api.campaign_store import CampaignStore
+from api.campaigns import send_recorded_batch
+from api.retries import PERMANENT, classify_failure
+from api.transports import DeliveryError, HTTPBatchTransport
+from benchmarks.http_sink import HTTPSink
+
+REJECTED = {"user3@example.com", "user8@example.com"}
+MESSAGES = [(f"user{n}@example.com", f"Subject: {n}\r\n\r\nbonjour\r\n".encode()) for n in range(10)]
+
+
+@pytest.fixture
+def sink():
+    with HTTPSink(reject=REJECTED) as sink:
+        yield sink
+
+
+@pytest.fixture
+def transport(sink):
+    transport = HTTPBatchTransport(sink.url, api_key="key", batch_size=4)
+    yield transport
+    transport.close()
+
+
+def test_messages_posted_in_batches(sink, transport):
+    errors = transport.send_batch("from@example.com", MESSAGES)
+    assert sink.requests == 3
+    assert sink.batches == [4, 4, 2]
+    assert sink.messages == len(MESSAGES)
+    assert sink.bytes == sum(len(data) for _, data in MESSAGES)
+    # Une seule connexion gardée ouverte pour les trois POST
+    assert sink.connections == 1
+    assert len(errors) == len(MESSAGES)
+
+
+def test_rejected_entries_reported_to_caller(transport):
+    errors = transport.send_batch("from@example.com", MESSAGES)
+    failed = {to_addr: error for (to_addr, _), error in zip(MESSAGES, errors) if error is not None}
+    assert set(failed) == REJECTED
+    for error in failed.values():
+        assert isinstance(error, DeliveryError) and error.permanent
+        assert classify_failure(error) == PERMANENT
+
+    with pytest.raises(DeliveryError):
+        transport.send("from@example.com", "user3@example.com", MESSAGES[3][1])
+    transport.send("from@example.com", "user0@example.com", MESSAGES[0][1])
+
+
+def test_campaign_batch_records_failures(tmp_path, sink, transport):
+    store = CampaignStore(str(tmp_path / "campaigns.db"))
+    emails = [to_addr for to_addr, _ in MESSAGES]
+    campaign_id, _ = store.create_campaign("excuse", emails)
+    data = dict(MESSAGES)
+
+    def send_batch(batch):
+        errors = transport.send_batch("from@example.com", [(email, data[email]) for email in batch])
+        return [(email, error or {"message_id": None, "size": len(data[email])})
+                for email, error in zip(batch, errors)]
+
+    sent, failed, failed_emails = send_recorded_batch(store, campaign_id, send_batch, emails)
+    assert (sent, failed) == (8, 2)
+    assert {failure["email"] for failure in failed_emails} == REJECTED
+    assert all(failure["classification"] == PERMANENT for failure in failed_emails)
+    assert store.delivered(campaign_id, emails) == set(emails) - REJECTED
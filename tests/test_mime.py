@@ -0,0 +1,77 @@
+"""PreparedMessage : segments quoted-printable encodés séparément puis joints"""
+import email
+from email import policy
+
+import pytest
+
+from api.mime import QP_LINE_LENGTH, PreparedMessage, _header, encode_qp
+from api.template_engine import CompiledTemplate
+
+
+def html_part(data):
+    message = email.message_from_bytes(data, policy=policy.default)
+    part = next(part for part in message.walk() if part.get_content_type() == "text/html")
+    return part
+
+
+def body_lines(part):
+    return part.get_payload(decode=False).splitlines()
+
+
+def build(source, variables):
+    template = CompiledTemplate("t", source)
+    prepared = PreparedMessage(template, "Sujet", "from@example.com")
+    _, data = prepared.build("to@example.com", variables)
+    return template, data
+
+
+def assert_round_trip(source, variables):
+    template, data = build(source, variables)
+    part = html_part(data)
+    # Les fins de ligne du texte circulent sous forme canonique (CRLF)
+    assert part.get_content().replace("\r\n", "\n") == template.render(variables)
+    for line in body_lines(part):
+        assert len(line) <= QP_LINE_LENGTH
+
+
+def test_round_trip_multibyte_and_equals():
+    source = "<p style=\"color:red\">Séances — {name} = {seances} 💪</p>\n<p>a=b; ünïcødé</p>"
+    assert_round_trip(source, {"name": "Zoë Ünal ✓", "seances": "3 = trois"})
+
+
+def test_round_trip_long_lines():
+    source = ("é" * 120) + "{name}" + ("x=" * 90) + "\n" + "{seances}"
+    assert_round_trip(source, {"name": "ü" * 100, "seances": "=" * 200})
+
+
+@pytest.mark.parametrize("prefix_length", range(66, 82))
+def test_variable_at_soft_break_boundary(prefix_length):
+    # Le segment littéral remplit la ligne jusqu'au saut doux, la variable suit
+    source = "a" * prefix_length + "{name}" + "b" * prefix_length
+    assert_round_trip(source, {"name": "é=" * 30})
+
+
+@pytest.mark.parametrize("value", ["", " ", "fin ", "tab\t", "a\nb", "é"])
+def test_round_trip_edge_values(value):
+    assert_round_trip("<p>{name}</p>\n", {"name": value})
+
+
+def test_missing_variable_kept_in_body():
+    template, data = build("<p>{name}</p>", {})
+    assert html_part(data).get_content() == "<p>{name}</p>"
+
+
+def test_segment_ends_with_soft_break():
+    encoded = encode_qp("é" * 40)
+    assert encoded.endswith(b"=\r\n")
+    assert all(len(line) <= QP_LINE_LENGTH for line in encoded.split(b"\r\n"))
+
+
+@pytest.mark.parametrize("address", [
+    "user@example.com", "first.last+tag@sub.example.co", "o'neil@example.com", "x" * 70 + "@example.com",
+    ".dot@example.com", "Zoë <zoe@example.com>", "user@exämple.com",
+])
+def test_header_fast_path_matches_policy(address):
+    # Le raccourci des adresses simples produit exactement l'en-tête de la politique SMTP
+    expected = policy.SMTP.header_factory("To", address).fold(policy=policy.SMTP).encode("ascii")
+    assert _header("To", address) == expected
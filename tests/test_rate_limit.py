@@ -0,0 +1,142 @@
+"""Limiteur AIMD et débit par session SMTP, sur une horloge simulée"""
+import smtplib
+
+import pytest
+
+from api import smtp_pool
+from api.rate_limit import AdaptiveRateLimiter, throttle_code
+from api.smtp_pool import SMTPPool
+
+
+class FakeClock:
+    """Horloge simulée : sleep() avance le temps au lieu d'attendre"""
+
+    def __init__(self):
+        # Loin de 0, comme time.monotonic()
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def limiter(clock, **options):
+    return AdaptiveRateLimiter(clock=clock.monotonic, sleep=clock.sleep, **options)
+
+
+def test_token_bucket_caps_messages_per_second(clock):
+    bucket = limiter(clock, rate=10)
+    for _ in range(51):
+        bucket.acquire()
+    # Premier envoi immédiat, puis un toutes les 100 ms
+    assert clock.now == pytest.approx(1005.0)
+    assert all(wait == pytest.approx(0.1) for wait in clock.sleeps)
+    assert bucket.stats()["waited_seconds"] == pytest.approx(5.0)
+
+
+def test_idle_time_refills_burst_up_to_rate(clock):
+    bucket = limiter(clock, rate=5)
+    bucket.acquire()
+    clock.advance(60)
+    for _ in range(5):
+        bucket.acquire()
+    # Rafale bornée à `rate` jetons, pas aux 300 accumulés en une minute
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.2)]
+
+
+def test_priority_sends_do_not_wait_but_consume_tokens(clock):
+    bucket = limiter(clock, rate=10)
+    for _ in range(3):
+        bucket.acquire(priority=True)
+    assert clock.sleeps == []
+    bucket.acquire()
+    # Deux jetons empruntés par les envois prioritaires, puis celui de cet envoi
+    assert clock.sleeps == [pytest.approx(0.3)]
+    assert bucket.stats()["priority_sends"] == 3
+
+
+@pytest.mark.parametrize("code", [421, 451, 452])
+def test_throttle_halves_rate_once_per_interval(clock, code):
+    bucket = limiter(clock, rate=8, decrease=0.5, decrease_interval=1.0)
+    bucket.on_throttle(code)
+    assert bucket.rate == 4
+    # Rafale de refus reçus par plusieurs threads : une seule baisse
+    bucket.on_throttle(code)
+    assert bucket.rate == 4
+    clock.advance(1.0)
+    bucket.on_throttle(code)
+    assert bucket.rate == 2
+    assert bucket.throttled == 3
+
+
+def test_rate_never_below_min(clock):
+    bucket = limiter(clock, rate=8, min_rate=1.5)
+    for _ in range(10):
+        bucket.on_throttle(421)
+        clock.advance(1.0)
+    assert bucket.rate == 1.5
+
+
+def test_additive_recovery_after_successes_up_to_max(clock):
+    bucket = limiter(clock, rate=4, max_rate=6, increase=1.0, recovery_after=20)
+    for _ in range(19):
+        bucket.on_success()
+    assert bucket.rate == 4
+    bucket.on_success()
+    assert bucket.rate == 5
+    for _ in range(100):
+        bucket.on_success()
+    assert bucket.rate == 6
+
+
+def test_throttle_resets_success_streak(clock):
+    bucket = limiter(clock, rate=4, recovery_after=20)
+    for _ in range(15):
+        bucket.on_success()
+    bucket.on_throttle(421)
+    for _ in range(15):
+        bucket.on_success()
+    assert bucket.rate == 2
+
+
+def test_split_shares_rates_between_processes(clock):
+    bucket = limiter(clock, rate=10, min_rate=1, max_rate=40, increase=2)
+    bucket.split(4)
+    assert (bucket.rate, bucket.min_rate, bucket.max_rate, bucket.increase) == (2.5, 0.25, 10, 0.5)
+
+
+@pytest.mark.parametrize("error, code", [
+    (smtplib.SMTPDataError(421, b"too many messages"), 421),
+    (smtplib.SMTPSenderRefused(451, b"slow down", "from@example.com"), 451),
+    (smtplib.SMTPRecipientsRefused({"a@example.com": (452, b"too many recipients")}), 452),
+    (smtplib.SMTPDataError(450, b"mailbox busy"), None),
+    (smtplib.SMTPDataError(550, b"unknown"), None),
+    (smtplib.SMTPServerDisconnected("closed"), None),
+])
+def test_throttle_code(error, code):
+    assert throttle_code(error) == code
+
+
+def test_pool_paces_each_connection(sink, clock, monkeypatch):
+    monkeypatch.setattr(smtp_pool, "time", clock)
+    pool = SMTPPool(sink.host, sink.port, size=1, security="none", rate_per_connection=5)
+    for n in range(6):
+        pool.sendmail("from@example.com", [f"user{n}@example.com"], b"Subject: x\r\n\r\nx\r\n")
+    pool.close()
+    # 5 messages/seconde sur la session : un envoi toutes les 200 ms
+    assert clock.sleeps == [pytest.approx(0.2)] * 5
+    assert sink.messages == 6 and sink.connections == 1
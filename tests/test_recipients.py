@@ -0,0 +1,59 @@
+"""Parcours paginé des destinataires (pagination par clé sur users.id)"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from api import index
+from api.campaign_store import CampaignStore
+from api.campaigns import drain_campaign
+from benchmarks.fake_supabase import seed
+
+USERS = 23
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    client = seed(users=USERS, workouts_per_user=0)
+    # Ordre d'insertion différent de l'ordre des id, et un utilisateur sans email
+    client.tables["users"].reverse()
+    client.tables["users"].append({"id": "u999999", "email": None, "full_name": "Sans email"})
+    monkeypatch.setattr(index, "resources", SimpleNamespace(supabase=client))
+    client.queries = 0
+    return client
+
+
+def expected_ids():
+    return [f"u{i:06d}" for i in range(USERS)]
+
+
+def test_pages_in_id_order_without_duplicates_or_gaps(supabase):
+    rows = list(index.iter_recipients(page_size=5))
+    assert [row["id"] for row in rows] == expected_ids()
+    # 24 lignes (dont l'utilisateur sans email, ignoré) : 4 pages pleines puis une incomplète
+    assert supabase.queries == 5
+
+
+def test_first_page_available_before_next_is_fetched(supabase):
+    recipients = index.iter_recipients(page_size=5)
+    first = [next(recipients) for _ in range(5)]
+    assert [row["id"] for row in first] == expected_ids()[:5]
+    assert supabase.queries == 1
+    next(recipients)
+    assert supabase.queries == 2
+
+
+def test_campaign_chunks_follow_pages(supabase, tmp_path):
+    store = CampaignStore(str(tmp_path / "campaigns.db"))
+    # Pages de 7, paquets de 5 : les paquets chevauchent les pages
+    campaign_id, total = store.create_campaign("weekly", index.iter_recipients(page_size=7))
+    assert total == USERS
+    chunks = []
+
+    def prepare(recipients):
+        chunks.append([recipient["id"] for recipient in recipients])
+        return lambda email: {"message_id": None, "size": 1}
+
+    assert asyncio.run(drain_campaign(store, campaign_id, prepare, chunk_size=5)) is True
+    assert [len(chunk) for chunk in chunks] == [5, 5, 5, 5, 3]
+    assert [user_id for chunk in chunks for user_id in chunk] == expected_ids()
@@ -0,0 +1,145 @@
+"""Classement des échecs, délais de relance et arrêt sur identifiants refusés"""
+import asyncio
+import smtplib
+
+import pytest
+from fastapi import HTTPException
+
+from api import retries
+from api.campaign_store import CampaignStore
+from api.campaigns import drain_campaign
+from api.mime import InvalidRecipient
+from api.retries import (FATAL, PERMANENT, TRANSIENT, CampaignAborted, backoff_delay, classify_failure,
+                         describe_failure, retry_campaign)
+from api.smtp_pool import SMTPPool
+from api.transports import DeliveryError
+from benchmarks.smtp_sink import SMTPSink
+
+MESSAGE = b"Subject: test\r\n\r\nbonjour\r\n"
+
+
+def wrapped(error):
+    """Erreur SMTP relevée en HTTPException, comme dans envoyer_recap"""
+    try:
+        raise error
+    except Exception:
+        try:
+            raise HTTPException(status_code=500, detail="Erreur SMTP")
+        except HTTPException as e:
+            return e
+
+
+@pytest.mark.parametrize("error, expected", [
+    (smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"unknown")}), PERMANENT),
+    (smtplib.SMTPRecipientsRefused({"a@example.com": (450, b"busy")}), TRANSIENT),
+    (smtplib.SMTPDataError(554, b"rejected"), PERMANENT),
+    (smtplib.SMTPDataError(421, b"try later"), TRANSIENT),
+    (smtplib.SMTPServerDisconnected("closed"), TRANSIENT),
+    (ConnectionResetError(), TRANSIENT),
+    (smtplib.SMTPAuthenticationError(535, b"bad credentials"), FATAL),
+    (wrapped(smtplib.SMTPAuthenticationError(535, b"bad credentials")), FATAL),
+    (wrapped(smtplib.SMTPDataError(554, b"rejected")), PERMANENT),
+    (DeliveryError("rejected", permanent=True), PERMANENT),
+    (DeliveryError("timeout"), TRANSIENT),
+    (DeliveryError("HTTP 401", fatal=True), FATAL),
+    (HTTPException(status_code=404, detail="Utilisateur introuvable"), PERMANENT),
+    (InvalidRecipient("a\r\nb"), PERMANENT),
+    (ValueError("inattendu"), TRANSIENT),
+])
+def test_classify_failure(error, expected):
+    assert classify_failure(error) == expected
+
+
+def test_backoff_delay_doubles_up_to_cap(monkeypatch):
+    monkeypatch.setattr(retries.random, "uniform", lambda low, high: high)
+    assert [backoff_delay(n, base=60, cap=3600) for n in range(0, 9)] == [
+        60, 60, 120, 240, 480, 960, 1920, 3600, 3600
+    ]
+
+
+def test_backoff_delay_jitter_bounds():
+    for attempts in range(1, 10):
+        ceiling = min(3600, 60 * 2 ** (attempts - 1))
+        for _ in range(50):
+            assert ceiling / 2 <= backoff_delay(attempts, base=60, cap=3600) <= ceiling
+
+
+def sender(pool):
+    def prepare(recipients):
+        def send_one(email):
+            pool.sendmail("from@example.com", [email], MESSAGE)
+            return {"message_id": None, "size": len(MESSAGE)}
+        return send_one
+    return prepare
+
+
+def make_campaign(tmp_path, count=20):
+    store = CampaignStore(str(tmp_path / "campaigns.db"))
+    campaign_id, _ = store.create_campaign("excuse", [f"user{n}@example.com" for n in range(count)])
+    return store, campaign_id
+
+
+def test_authentication_error_fails_campaign_without_retries(tmp_path):
+    store, campaign_id = make_campaign(tmp_path)
+    with SMTPSink(auth_error=True) as sink:
+        pool = SMTPPool(sink.host, sink.port, user="user", password="wrong", size=2, security="none")
+        finished = asyncio.run(drain_campaign(store, campaign_id, sender(pool), chunk_size=5, concurrency=2))
+        pool.close()
+    assert finished is True
+    report = store.report(campaign_id)
+    assert report["status"] == "failed"
+    assert "535" in report["error"]
+    assert report["retry_pending"] == 0
+    assert report["dead_letters"] == []
+    # Arrêt au premier refus : pas une tentative par destinataire
+    assert sink.connections <= 2
+
+
+def queue_transient_failures(store, campaign_id, emails):
+    owner = "sender"
+    assert store.claim(campaign_id, owner)
+    failures = [describe_failure(email, smtplib.SMTPServerDisconnected("closed")) for email in emails]
+    store.checkpoint(campaign_id, owner, len(emails), 0, failures)
+    store.finish(campaign_id, owner)
+
+
+def test_retry_waits_for_backoff_unless_forced(tmp_path, sink):
+    store, campaign_id = make_campaign(tmp_path, count=3)
+    queue_transient_failures(store, campaign_id, [f"user{n}@example.com" for n in range(3)])
+    pool = SMTPPool(sink.host, sink.port, size=1, security="none")
+    resend_email = sender(pool)(None)
+
+    result = asyncio.run(retry_campaign(store, campaign_id, None, resend_email))
+    assert result["retried"] == 0 and result["pending"] == 3
+
+    result = asyncio.run(retry_campaign(store, campaign_id, None, resend_email, force=True))
+    pool.close()
+    assert result["sent"] == 3 and result["pending"] == 0
+    assert sorted(sink.recipients) == [f"user{n}@example.com" for n in range(3)]
+    assert store.get(campaign_id)["lease_owner"] is None
+
+
+def test_retry_skipped_while_campaign_leased(tmp_path):
+    store, campaign_id = make_campaign(tmp_path, count=2)
+    queue_transient_failures(store, campaign_id, ["user0@example.com"])
+    assert store.claim_retries(campaign_id, "other-worker")
+
+    def resend_email(email):
+        raise AssertionError("aucun renvoi attendu")
+
+    assert asyncio.run(retry_campaign(store, campaign_id, None, resend_email, force=True)) is None
+    assert store.retry_count(campaign_id) == 1
+
+
+def test_retry_aborted_on_authentication_error(tmp_path):
+    store, campaign_id = make_campaign(tmp_path, count=4)
+    queue_transient_failures(store, campaign_id, [f"user{n}@example.com" for n in range(4)])
+    with SMTPSink(auth_error=True) as sink:
+        pool = SMTPPool(sink.host, sink.port, user="user", password="wrong", size=1, security="none")
+        with pytest.raises(CampaignAborted):
+            asyncio.run(retry_campaign(store, campaign_id, None, sender(pool)(None), force=True, concurrency=1))
+        pool.close()
+    # Destinataires laissés en file, tentatives inchangées
+    assert [entry["attempts"] for entry in store.due_retries(campaign_id, force=True)] == [1, 1, 1, 1]
+    assert store.dead_letters(campaign_id) == []
+    assert store.get(campaign_id)["lease_owner"] is None
@@ -0,0 +1,66 @@
+"""Campagnes réparties : boucle asyncio libre pendant les shards, étapes fusionnées"""
+import asyncio
+import time
+
+from api import metrics, sharding
+from api.campaign_store import FAILED, CampaignStore
+
+
+def fake_shard(campaign_id, shard, shards, owner, time_budget=None):
+    """Remplace run_shard dans les processus : le shard 1 échoue, le 0 mesure des étapes"""
+    if shard == 1:
+        raise ValueError("shard en échec")
+    time.sleep(0.5)
+    with metrics.campaign_scope(campaign_id):
+        for _ in range(3):
+            metrics.observe("render", 0.002)
+    return {"finished": True, "error": None, "stages": metrics.export_campaign(campaign_id)}
+
+
+def test_metrics_export_and_merge():
+    metrics.observe("render", 1.0)
+    with metrics.campaign_scope("export-source"):
+        metrics.observe("render", 0.003)
+        metrics.observe("render", 0.2)
+    exported = metrics.export_campaign("export-source")
+    assert exported["render"][2] == 2
+
+    before = metrics.stage_seconds.summary("render")["count"]
+    metrics.merge_campaign("export-target", exported)
+    metrics.merge_campaign("export-target", exported)
+    assert metrics.campaign_stages("export-target")["render"]["count"] == 4
+    assert metrics.campaign_stage_seconds.export("export-target", "render")[0] == [
+        2 * count for count in exported["render"][0]
+    ]
+    assert metrics.stage_seconds.summary("render")["count"] == before + 4
+
+
+def test_failed_shard_does_not_block_loop_and_keeps_stages(tmp_path, monkeypatch):
+    monkeypatch.setattr(sharding, "run_shard", fake_shard)
+    store = CampaignStore(str(tmp_path / "campaigns.db"))
+    campaign_id, _ = store.create_campaign("excuse", ["a@example.com", "b@example.com"], shards=2)
+
+    async def main():
+        ticks = 0
+        done = False
+
+        async def ticker():
+            nonlocal ticks
+            while not done:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        finished = await sharding.drain_sharded(store, campaign_id, 2)
+        done = True
+        await task
+        return finished, ticks
+
+    finished, ticks = asyncio.run(main())
+    assert finished is True
+    # La boucle a continué de tourner pendant les processus (démarrage compris)
+    assert ticks >= 20
+    report = store.report(campaign_id)
+    assert report["status"] == FAILED
+    assert report["error"] == "shard en échec"
+    assert metrics.campaign_stages(campaign_id)["render"]["count"] == 3
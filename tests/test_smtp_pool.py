@@ -0,0 +1,85 @@
+"""SMTPPool contre le serveur local benchmarks.smtp_sink"""
+import smtplib
+import threading
+
+import pytest
+
+from api.smtp_pool import SMTPPool
+from benchmarks.smtp_sink import SMTPSink
+
+MESSAGE = b"Subject: test\r\n\r\nbonjour\r\n"
+
+
+def make_pool(sink, **options):
+    options.setdefault("size", 1)
+    return SMTPPool(sink.host, sink.port, security="none", **options)
+
+
+def send(pool, count, prefix="user"):
+    for index in range(count):
+        pool.sendmail("from@example.com", [f"{prefix}{index}@example.com"], MESSAGE)
+
+
+def test_session_reused_between_messages(sink):
+    pool = make_pool(sink)
+    send(pool, 10)
+    pool.close()
+    assert sink.messages == 10
+    assert sink.connections == 1
+    assert pool.connections_opened == 1
+
+
+def test_idle_session_checked_with_noop(sink):
+    pool = make_pool(sink, noop_after=0)
+    send(pool, 3)
+    pool.close()
+    # Pas de NOOP avant le premier message (session neuve)
+    assert sink.noops == 2
+    assert pool.connections_opened == 1
+
+
+def test_recent_session_used_without_noop(sink):
+    pool = make_pool(sink, noop_after=60)
+    send(pool, 3)
+    pool.close()
+    assert sink.noops == 0
+
+
+def test_reconnects_after_server_disconnect(sink):
+    pool = make_pool(sink)
+    send(pool, 1, prefix="before")
+    sink.disconnect()
+    send(pool, 1, prefix="after")
+    pool.close()
+    assert sink.recipients == ["before0@example.com", "after0@example.com"]
+    assert pool.connections_opened == 2
+
+
+def test_session_closed_after_message_cap(sink):
+    pool = make_pool(sink, max_messages_per_connection=3)
+    send(pool, 7)
+    pool.close()
+    assert sink.messages == 7
+    assert pool.connections_opened == 3
+    assert sink.connections == 3
+
+
+def test_concurrent_senders_share_at_most_size_sessions(sink):
+    pool = make_pool(sink, size=2)
+    threads = [threading.Thread(target=send, args=(pool, 10, f"t{n}-")) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    pool.close()
+    assert sink.messages == 40
+    assert pool.connections_opened <= 2
+
+
+def test_authentication_error_raised():
+    with SMTPSink(auth_error=True) as sink:
+        pool = make_pool(sink, user="user", password="wrong")
+        with pytest.raises(smtplib.SMTPAuthenticationError):
+            send(pool, 1)
+        pool.close()
+        assert sink.messages == 0
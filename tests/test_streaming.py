@@ -0,0 +1,78 @@
+"""Routes de campagne : destinataires visés, réponses 202 en JSON comme en NDJSON"""
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import index
+from api.streaming import NDJSON, stream_campaign
+
+HEADERS = {"x-api-key": "test-key"}
+EMAILS = [f"user{n}@example.com" for n in range(3)]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    # Destinataires et envoi simulés : ni Supabase ni serveur SMTP
+    monkeypatch.setattr(index, "iter_recipients", lambda: iter(EMAILS))
+    monkeypatch.setattr(index, "chunk_preparer",
+                        lambda campaign: lambda recipients: lambda email: {"message_id": None, "size": 1})
+    with TestClient(index.app) as client:
+        yield client
+
+
+def test_json_response_is_accepted(client):
+    response = client.post("/send-excuse-email", headers=HEADERS)
+    assert response.status_code == 202
+    assert response.json()["total"] == len(EMAILS)
+
+
+def test_ndjson_response_is_accepted(client):
+    response = client.post("/send-excuse-email", headers={**HEADERS, "Accept": NDJSON})
+    assert response.status_code == 202
+    assert response.headers["content-type"].startswith(NDJSON)
+    lines = [json.loads(line) for line in response.text.splitlines() if line]
+    assert lines[-1]["sent"] == len(EMAILS)
+
+
+def test_openapi_declares_ndjson():
+    for path in ("/send-excuse-email", "/send-weekly-email"):
+        responses = index.app.openapi()["paths"][path]["post"]["responses"]
+        assert set(responses["202"]["content"]) == {"application/json", NDJSON}
+        assert "200" not in responses
+
+
+def test_weekly_campaign_targets_all_users(client):
+    response = client.post("/send-weekly-email", headers=HEADERS)
+    assert response.status_code == 202
+    assert response.json()["total"] == len(EMAILS)
+
+
+def test_weekly_test_recipient_limits_real_send(client, monkeypatch):
+    monkeypatch.setattr(index, "WEEKLY_TEST_RECIPIENT", "tester@example.com")
+    response = client.post("/send-weekly-email", headers=HEADERS)
+    assert response.json()["total"] == 1
+    # Le dry-run vise toujours tous les utilisateurs
+    assert client.post("/send-weekly-email", headers=HEADERS, params={"dry_run": True}).json()["total"] == len(EMAILS)
+
+
+def test_resumed_campaign_counts_checkpointed_deliveries(client, monkeypatch):
+    monkeypatch.setattr(index, "CAMPAIGN_CHUNK_SIZE", 2)
+    emails = [f"resume{n}@example.com" for n in range(5)]
+    store = index.get_campaign_store()
+    job_id, total = store.create_campaign("excuse", emails)
+    # Un premier worker a sauvegardé un paquet puis rendu la main
+    assert store.claim(job_id, "worker")
+    chunk = store.next_chunk(job_id, 2)
+    store.checkpoint(job_id, "worker", chunk[-1]["position"] + 1, len(chunk), [])
+    store.release(job_id, "worker")
+
+    async def collect():
+        run = lambda on_chunk: index.run_queued_campaign(job_id, on_chunk=on_chunk)
+        return [json.loads(line) async for line in stream_campaign(store, job_id, run)]
+
+    lines = asyncio.run(collect())
+    assert [line["processed"] for line in lines if line["event"] == "chunk"] == [4, 5]
+    assert lines[-1]["event"] == "summary"
+    assert lines[-1]["processed"] == total == 5
@@ -0,0 +1,101 @@
+"""Préparation des templates (TEMPLATE_BUILD=1) : emplacements, CSS en ligne, texte affiché"""
+import os
+import re
+from html.parser import HTMLParser
+
+import pytest
+
+from api.template_build import build
+from api.template_engine import PLACEHOLDER, CompiledTemplate, TemplateEngine
+
+TEMPLATES = "templates"
+VARIABLES = {
+    "name": "Ana <Lopez>", "seances": 3, "total_exercises": 12, "repstotal": 240,
+    "last_workout_date": "2026-10-11", "reps_par_exo": "Pompes : 40", "ConfirmationURL": "https://x/?a=1&b=2",
+}
+
+
+def read(name):
+    with open(os.path.join(TEMPLATES, name), encoding="utf-8") as fichier:
+        return fichier.read()
+
+
+class _VisibleText(HTMLParser):
+    """Morceaux de texte affichés (hors <head>, <style> et <script>)"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self._hidden = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("head", "style", "script"):
+            self._hidden += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("head", "style", "script"):
+            self._hidden -= 1
+
+    def handle_data(self, data):
+        text = " ".join(data.split())
+        if text and not self._hidden:
+            self.chunks.append(text)
+
+
+def visible_text(document):
+    parser = _VisibleText()
+    parser.feed(document)
+    parser.close()
+    return parser.chunks
+
+
+@pytest.mark.parametrize("name", sorted(f for f in os.listdir(TEMPLATES) if f.endswith(".html")))
+def test_placeholders_survive_build(name):
+    source = read(name)
+    built = build(source)
+    assert PLACEHOLDER.findall(built) == PLACEHOLDER.findall(source)
+    # Hors commentaires conditionnels Outlook, plus aucun commentaire ; un seul <style> au plus
+    assert not re.search(r"<!--(?!\[if)", built)
+    assert built.count("<style") <= 1
+
+
+def test_comments_removed_and_css_inlined_and_deduped():
+    source = """<html><head><style>
+      /* couleurs */
+      p { color: red; }
+      p { color: red; }
+      .lead { font-weight: bold }
+      .unused { margin: 0 }
+      a:hover { color: blue }
+      a:hover { color: blue }
+      @media (max-width: 600px) { .lead { font-size: 14px } .lead { font-size: 14px } .absent { top: 0 } }
+    </style></head><body>
+      <!-- note interne -->
+      <p class="lead">Bonjour {name}</p>
+      <a href="#">lien</a>
+    </body></html>"""
+    built = build(source)
+    assert "<!--" not in built and "couleurs" not in built and "note interne" not in built
+    assert '<p class="lead" style="color:red;font-weight:bold">Bonjour {name}</p>' in built
+    style = re.search(r"<style>(.*)</style>", built).group(1)
+    assert style == "a:hover{color:blue!important}@media (max-width:600px){.lead{font-size:14px!important}}"
+    assert ".unused" not in built and ".absent" not in built
+
+
+def test_fully_inlined_stylesheet_leaves_no_style_block():
+    built = build("<html><head><style>p{color:red}</style></head><body><p>{name}</p></body></html>")
+    assert "<style" not in built
+    assert '<p style="color:red">{name}</p>' in built
+
+
+@pytest.mark.parametrize("name", ["score.html", "excuses.html"])
+def test_built_template_is_smaller_with_same_visible_text(name):
+    engine = TemplateEngine(TEMPLATES, build=True)
+    built = engine.get(name)
+    stats = engine.stats()[name]
+    assert stats["source_bytes"] > stats["built_bytes"] == built.size
+    assert stats["saved_bytes"] == stats["source_bytes"] - stats["built_bytes"]
+
+    source = CompiledTemplate(name, read(name))
+    assert built.variables == source.variables
+    assert visible_text(built.render(VARIABLES)) == visible_text(source.render(VARIABLES))
@@ -0,0 +1,84 @@
+"""TemplateEngine / CompiledTemplate : échappement, variables absentes, rechargement"""
+import os
+
+import pytest
+
+from api.template_engine import CompiledTemplate, TemplateEngine
+
+
+def write(path, content, mtime):
+    path.write_text(content, encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def engine(tmp_path):
+    write(tmp_path / "hello.html", "<p>Bonjour {name}, lien : {{ .ConfirmationURL }}</p>", 1_000_000)
+    return TemplateEngine(str(tmp_path), check_interval=0, build=False)
+
+
+def test_variables_are_html_escaped():
+    template = CompiledTemplate("t", "<p>{name}</p>")
+    rendered = template.render({"name": '<script>alert("x")</script> & \'co\''})
+    assert rendered == "<p>&lt;script&gt;alert(&quot;x&quot;)&lt;/script&gt; &amp; &#x27;co&#x27;</p>"
+
+
+def test_escape_can_be_disabled():
+    template = CompiledTemplate("t", "<p>{name}</p>")
+    assert template.render({"name": "<b>x</b>"}, escape=False) == "<p><b>x</b></p>"
+
+
+def test_missing_variable_left_intact():
+    template = CompiledTemplate("t", "<p>{name} : {seances}</p>")
+    assert template.render({"name": "Ana"}) == "<p>Ana : {seances}</p>"
+    assert template.render() == "<p>{name} : {seances}</p>"
+
+
+def test_css_blocks_are_not_placeholders():
+    template = CompiledTemplate("t", "<style>p { margin:0; } a{color:red}</style><p>{name}</p>")
+    assert template.variables == {"name"}
+    assert template.render({"name": "Ana"}).endswith("<p>Ana</p>")
+
+
+def test_go_style_placeholder(engine):
+    rendered = engine.render("hello.html", {"name": "Ana", "ConfirmationURL": "https://x.test/?a=1&b=2"})
+    assert rendered == "<p>Bonjour Ana, lien : https://x.test/?a=1&amp;b=2</p>"
+
+
+def test_render_many_renders_each_recipient(engine):
+    rendered = engine.render_many("hello.html", [{"name": "Ana"}, {"name": "<Bob>"}, {}])
+    assert [r.split(",")[0] for r in rendered] == ["<p>Bonjour Ana", "<p>Bonjour &lt;Bob&gt;", "<p>Bonjour {name}"]
+
+
+def test_template_cached_until_mtime_changes(engine, tmp_path):
+    first = engine.get("hello.html")
+    assert engine.get("hello.html") is first
+
+    write(tmp_path / "hello.html", "<p>Salut {name}</p>", 1_000_100)
+    reloaded = engine.get("hello.html")
+    assert reloaded is not first
+    assert reloaded.render({"name": "Ana"}) == "<p>Salut Ana</p>"
+
+
+def test_mtime_checked_at_most_every_check_interval(tmp_path):
+    write(tmp_path / "hello.html", "<p>{name}</p>", 1_000_000)
+    engine = TemplateEngine(str(tmp_path), check_interval=3600, build=False)
+    first = engine.get("hello.html")
+    write(tmp_path / "hello.html", "<p>Salut {name}</p>", 1_000_100)
+    assert engine.get("hello.html") is first
+
+
+def test_missing_template_raises(engine):
+    with pytest.raises(FileNotFoundError):
+        engine.get("absent.html")
+
+
+def test_build_keeps_placeholders_and_records_sizes(tmp_path):
+    source = "<html><head><style>p { color: red; }</style></head>\n<body>\n  <!-- note -->\n  <p>{name}</p>\n</body></html>"
+    write(tmp_path / "page.html", source, 1_000_000)
+    engine = TemplateEngine(str(tmp_path), check_interval=0)
+    template = engine.get("page.html")
+    assert template.render({"name": "Ana"}) == '<html><head></head><body><p style="color:red">Ana</p></body></html>'
+    assert engine.stats()["page.html"] == {
+        "source_bytes": len(source), "built_bytes": template.size, "saved_bytes": len(source) - template.size,
+    }
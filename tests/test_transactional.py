@@ -0,0 +1,79 @@
+"""POST /send/{template} : validation de l'adresse et en-têtes du message écrit"""
+import mailbox
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from api import index
+from api.mime import InvalidRecipient, PreparedMessage
+from api.retries import PERMANENT, classify_failure
+from api.template_engine import CompiledTemplate
+from api.transports import MaildirTransport, MboxTransport
+
+HEADERS = {"x-api-key": "test-key"}
+INJECTION = "victim@example.com\r\nBcc: attacker@evil.com"
+
+
+@pytest.fixture
+def client():
+    with TestClient(index.app) as client:
+        yield client
+
+
+def read_mbox():
+    return list(mailbox.mbox(index.settings.mbox_path))
+
+
+def send(client, address):
+    return client.post("/send/confirm-signup", headers=HEADERS,
+                       json={"email": address, "confirmation_url": "https://example.com/confirm?t=1"})
+
+
+def test_valid_address_sent(client):
+    before = len(read_mbox()) if os.path.exists(index.settings.mbox_path) else 0
+    response = send(client, "user@example.com")
+    assert response.status_code == 200
+    messages = read_mbox()
+    assert len(messages) == before + 1
+    assert messages[-1]["To"] == "user@example.com"
+    assert messages[-1]["Delivered-To"] == "user@example.com"
+
+
+@pytest.mark.parametrize("address", [
+    INJECTION,
+    "victim@example.com\nBcc: attacker@evil.com",
+    "user@example.com\n",
+    "not-an-email",
+    "user@",
+    "a b@example.com",
+    "",
+])
+def test_invalid_address_rejected(client, address):
+    response = send(client, address)
+    assert response.status_code == 422
+
+
+def test_assemble_refuses_line_breaks():
+    prepared = PreparedMessage(CompiledTemplate("t", "<p>x</p>"), "Sujet", "from@example.com")
+    with pytest.raises(InvalidRecipient):
+        prepared.build(INJECTION)
+    _, data = prepared.build("Zoë <zoë@example.com>")
+    assert b"\r\nTo: =?utf-8?" in data
+
+
+def test_file_transports_refuse_line_breaks(tmp_path):
+    maildir = MaildirTransport(str(tmp_path / "maildir"))
+    with pytest.raises(InvalidRecipient):
+        maildir.send("from@example.com", INJECTION, b"Subject: x\r\n\r\nx\r\n")
+    assert os.listdir(tmp_path / "maildir" / "new") == []
+
+    mbox = MboxTransport(str(tmp_path / "mail.mbox"))
+    errors = mbox.send_batch("from@example.com", [
+        ("ok@example.com", b"Subject: x\r\n\r\nx\r\n"),
+        (INJECTION, b"Subject: x\r\n\r\nx\r\n"),
+    ])
+    assert errors[0] is None and isinstance(errors[1], InvalidRecipient)
+    messages = list(mailbox.mbox(str(tmp_path / "mail.mbox")))
+    assert [m["Delivered-To"] for m in messages] == ["ok@example.com"]
+    assert classify_failure(errors[1]) == PERMANENT
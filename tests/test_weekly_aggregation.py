@@ -0,0 +1,84 @@
+"""Mode WEEKLY_AGGREGATION=auto : repli définitif ou temporaire selon l'erreur"""
+from types import SimpleNamespace
+
+import pytest
+from postgrest.exceptions import APIError
+
+from api import index
+from api.aggregates import is_missing_relation
+
+
+@pytest.mark.parametrize("error, missing", [
+    (APIError({"code": "PGRST205", "message": "Could not find the table 'public.weekly_summaries'"}), True),
+    (APIError({"code": "PGRST202", "message": "Could not find the function"}), True),
+    (APIError({"code": "42P01", "message": 'relation "weekly_summaries" does not exist'}), True),
+    (APIError({"code": "42883", "message": "function does not exist"}), True),
+    (APIError({"code": "57014", "message": "canceling statement due to statement timeout"}), False),
+    (APIError({"code": "PGRST000", "message": "Could not connect"}), False),
+    (ConnectionResetError(), False),
+])
+def test_is_missing_relation(error, missing):
+    assert is_missing_relation(error) is missing
+
+
+@pytest.fixture
+def auto(monkeypatch):
+    monkeypatch.setattr(index, "WEEKLY_AGGREGATION", "auto")
+    monkeypatch.setattr(index, "resources", SimpleNamespace(supabase=None))
+    monkeypatch.setattr(index, "_materialized_fresh_until", None)
+    monkeypatch.setattr(index, "_materialized_available", True)
+    monkeypatch.setattr(index, "_materialized_retry_at", 0.0)
+    monkeypatch.setattr(index, "_rpc_available", True)
+    monkeypatch.setattr(index, "_rpc_retry_at", 0.0)
+    calls = []
+
+    def refresh(client, aggregate, until=None):
+        calls.append(until)
+        error = refresh.errors.pop(0) if refresh.errors else None
+        if error:
+            raise error
+
+    refresh.errors = []
+    monkeypatch.setattr(index, "refresh_weekly_summaries", refresh)
+    return refresh, calls
+
+
+def test_transient_error_retried_after_cooldown(auto):
+    refresh, calls = auto
+    refresh.errors = [ConnectionResetError("reset by peer")]
+    assert index.weekly_summaries_ready("2026-10-12") is False
+    # Pendant le délai : pas de nouvel appel
+    assert index.weekly_summaries_ready("2026-10-12") is False
+    assert len(calls) == 1
+    assert index._materialized_available is True
+
+    index._materialized_retry_at = 0.0
+    assert index.weekly_summaries_ready("2026-10-12") is True
+    assert len(calls) == 2
+
+
+def test_missing_table_disables_materialized_path(auto):
+    refresh, calls = auto
+    refresh.errors = [APIError({"code": "PGRST205", "message": "Could not find the table"})]
+    assert index.weekly_summaries_ready("2026-10-12") is False
+    index._materialized_retry_at = 0.0
+    assert index.weekly_summaries_ready("2026-10-12") is False
+    assert len(calls) == 1
+    assert index._materialized_available is False
+
+
+def test_rpc_transient_error_falls_back_for_cooldown_only(auto, monkeypatch):
+    errors = [APIError({"code": "57014", "message": "statement timeout"})]
+
+    def fetch(client, user_ids, start_ts, end_ts):
+        if errors:
+            raise errors.pop(0)
+        return {"rpc": True}
+
+    monkeypatch.setattr(index, "fetch_weekly_aggregates", fetch)
+    monkeypatch.setattr(index, "aggregate_rows", lambda client, user_ids, start_ts, end_ts: {"rows": True})
+    assert index.aggregate_week(["u"], "a", "b") == {"rows": True}
+    assert index.aggregate_week(["u"], "a", "b") == {"rows": True}
+    index._rpc_retry_at = 0.0
+    assert index.aggregate_week(["u"], "a", "b") == {"rpc": True}
+    assert index._rpc_available is True